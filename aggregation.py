@@ -0,0 +1,116 @@
+"""
+Weighted group aggregation over prebuilt membership arrays.
+
+groupby(...).mean() gives every row the same weight, so a county
+averaged from its census tracts counts a 500-person tract as much as a
+20,000-person one, and the grouping is redone on every call. Membership
+numbers the groups once and keeps the membership as a sparse (groups x rows) matrix
+holding the row weights; any number of metrics are then aggregated
+with one sparse matrix product:
+
+    tracts_to_counties = Membership(tracts[['FIPS']], weights=tracts['POP2010'])
+    counties = tracts_to_counties.aggregate(
+        tracts, means=['PovertyRate'], shares=['LowIncomeTracts'])
+    population = tracts_to_counties.totals()
+
+means are weighted means, sums weighted sums (weight x value, plain
+sums with weights=None) and shares the weighted fraction of rows where
+the column is non-zero. Missing values are skipped, as in pandas. The
+groups come out sorted by their keys, as groupby(sort=True) orders
+them (categorical keys by their categories, also when there are
+several of them).
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class Membership:
+
+    def __init__(self, keys, weights=None):
+
+        """
+        keys: DataFrame (or Series) of group key columns, one row per
+        member. weights: one non-negative weight per member, or None
+        for equal weights. Rows with a missing key or weight belong to
+        no group.
+        """
+
+        keys = keys.to_frame() if isinstance(keys, pd.Series) else keys
+        n = len(keys)
+        #group numbers; rows with a missing key get none
+        codes = keys.groupby(list(keys.columns), sort=True, observed=True).ngroup()
+        codes = codes.fillna(-1).to_numpy(dtype=np.int64)
+        valid = codes >= 0
+
+        if weights is None:
+            weights = np.ones(n)
+        weights = np.asarray(weights, dtype='float64')
+        valid &= ~np.isnan(weights)
+
+        members = np.flatnonzero(valid)
+        _, first, codes = np.unique(codes[members], return_index=True, return_inverse=True)
+        #one row of key values per group, with the dtypes of the keys
+        groups = keys.iloc[members[first]].reset_index(drop=True)
+        #with several categorical keys ngroup() numbers the observed groups
+        #in order of appearance (pandas 1.x); renumber them in key order
+        order = groups.sort_values(list(groups.columns), kind='mergesort').index.to_numpy()
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        codes = rank[codes]
+        self.codes = np.full(n, -1, dtype=np.int64)
+        self.codes[members] = codes
+        self.weights = weights
+        self.matrix = sparse.csr_matrix(
+            (weights[members], (codes, members)), shape=(len(first), n))
+        self.groups = groups.iloc[order].reset_index(drop=True)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def _dot(self, values):
+        #weighted sums of the present values and of the weights behind them;
+        #(groups,) for one column of values, (groups, k) for k columns
+        values = np.asarray(values, dtype='float64')
+        present = ~np.isnan(values)
+        sums = np.asarray(self.matrix @ np.where(present, values, 0.0))
+        totals = np.asarray(self.matrix @ present.astype('float64'))
+        return sums, totals
+
+    def totals(self):
+        #sum of the member weights of each group
+        return np.asarray(self.matrix.sum(axis=1)).ravel()
+
+    def sums(self, values):
+        return self._dot(values)[0]
+
+    def means(self, values):
+        sums, totals = self._dot(values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return sums / totals
+
+    def shares(self, values):
+        values = np.asarray(values, dtype='float64')
+        return self.means(np.where(np.isnan(values), np.nan, values != 0))
+
+    def aggregate(self, frame, means=(), sums=(), shares=()):
+
+        """
+        One row per group: the key columns, then the requested columns
+        of ``frame`` (aligned by position with the keys), all computed
+        in a single product
+        """
+
+        means, sums, shares = list(means), list(sums), list(shares)
+        values = frame[means + sums + shares].to_numpy(dtype='float64')
+        k, s = len(means), len(means) + len(sums)
+        values[:, s:] = np.where(np.isnan(values[:, s:]), np.nan, values[:, s:] != 0)
+        totals_of, totals = self._dot(values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = totals_of / totals
+        result[:, k:s] = totals_of[:, k:s]
+
+        out = self.groups.copy()
+        for i, name in enumerate(means + sums + shares):
+            out[name] = result[:, i]
+        return out
@@ -8,44 +8,57 @@ https://stackoverflow.com/questions/63592900/plotly-dash-how-to-design-the-layou
 https://dash-bootstrap-components.opensource.faculty.ai/docs/components/layout/
 
 """
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash import Dash, dcc, html
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import plotly.express as px
 import gunicorn #whilst your local machine's webserver doesn't need this, Heroku's linux webserver (i.e. dyno) does. I.e. This is your HTTP server
 from whitenoise import WhiteNoise   #for serving static files on Heroku
 import pandas as pd
-import helpers
-
-from urllib.request import urlopen
-import json
-with urlopen(
-        'https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-    geojson_counties = json.load(response)
-
-
-#get the data from public repos
-df = pd.read_parquet('https://github.com/nmmarcelnv/cmsdatajam/blob/main/data/DataProcessed.parquet?raw=true')
-ckd_inc_df = pd.read_excel(
-    'https://github.com/nmmarcelnv/cmsdatajam/blob/main/reports/charts.xlsx?raw=true',
-    sheet_name='CKD Incidence Research',
-    usecols=['DASH Score', 'Odds ratio']
-).dropna()
-diet_df = pd.read_excel(
-    'https://github.com/nmmarcelnv/cmsdatajam/blob/main/reports/charts.xlsx?raw=true',
-    sheet_name='Diet Followed'
-).sort_values(by=['Percentage of population'])
-#ckd_inc_df['Odds ratio'] = ckd_inc_df['Odds ratio'] * 100
-ckd_inc_df = ckd_inc_df[ckd_inc_df['DASH Score']!=1]
-diet_df['Percentage of population'] = diet_df['Percentage of population'] * 100
-
-#source: https://www.fns.usda.gov/snap/foods-typically-purchased-supplemental-nutrition-assistance-program-snap-households
-usecols=['Food Category','Percentage of Total Spend']
-foods = pd.read_excel(
-    'https://github.com/nmmarcelnv/cmsdatajam/blob/main/reports/charts.xlsx?raw=true',
-    sheet_name='What SNAP People Buy', usecols=usecols)
-foods = foods[foods['Food Category']!='Total Summary Category Expenditures']
-foods['Percentage of Total Spend'] = foods['Percentage of Total Spend'] * 100
+import logging
+import geometry
+import compile_assets
+import scenario_grid
+import prediction_cache
+import tables
+import figure_cache
+import map_data
+import compression
+import correlation
+import snapshot
+import metrics
+import tracing
+
+#county polygons at the CKD_GEOMETRY_LEVEL simplification level (see geometry.py)
+geojson_counties = geometry.load_counties()
+
+
+#compiled, pre-cleaned artifacts (see compile_assets.py); rebuilt in memory if stale
+assets = compile_assets.load_assets()
+df = assets['data_processed']   #categorical keys, float32 metrics (tables.compact)
+ckd_inc_df = assets['ckd_incidence']
+diet_df = assets['diet']
+foods = assets['snap_foods']
+logging.getLogger(__name__).info('DataProcessed: %d rows, %.1f MB', len(df), tables.memory_usage_mb(df))
+
+#read-only per-year slices of df, so callbacks don't rescan the whole table;
+#the partitioned (Year-sorted) table becomes df, so only one copy stays alive
+years = tables.YearPartitions(df)
+df = assets['data_processed'] = years.table
+fips_index = tables.FipsIndex(years)
+
+#built choropleths, keyed on the normalized callback inputs and the data version
+figures = figure_cache.FigureCache(maxsize=64, version=tables.data_version(df))
+
+#group-averaged model inputs for the 2024 projections, built once per worker,
+#and their precomputed predictions over every (perc-senior, perc-lowi, perc-snap) value
+engines = scenario_grid.prediction_engines(df)
+map_engine, scatter_engine = engines['map'], engines['scatter']
+map_grid = scenario_grid.ScenarioGrid('map', map_engine)
+scatter_grid = scenario_grid.ScenarioGrid('scatter', scatter_engine)
+#off-grid scenarios are computed once per deployment and shared by all workers
+prediction_store = prediction_cache.PredictionCache()
 
 cmin, cmax = 20, 40
 fips_options = df['FIPS']
@@ -59,87 +72,40 @@ metrics_options=[
 ]
 
 
-def get_correlation(df, year=2019):
-    
-    import scipy
-    def assign_distance(x):
-    
-        if '20' in x[-2:]: return '20 Miles'
-        if '10' in x[-2:]: return '10 Miles'
-        if ('1' in x[-2:])&(any(c.isalpha() for c in x[-2:])): return '1 Miles'
-        if 'lf' in x[-2:]: return '0.5 Miles'
-        return x
+#every year and state, for the year/state filters of the correlation charts
+corr_cube = correlation.get_cube(df)
+#Spearman tables, cached on disk by data hash (see correlation.py), with
+#the committed significance.py results for national 2019
+corr_df1, corr_df2 = correlation.get_correlation(df, year=2019, cube=corr_cube)
+corr_years = sorted(corr_cube['Year'].unique().tolist())
+corr_states = [correlation.NATIONAL] + sorted(df['State'].astype(str).unique())
 
-    def assign_names(x):
 
-        if 'lalow' in x: return 'Low Income'
-        if 'laseniors' in x: return 'Senior'
-        if 'lasnap' in x: return 'SNAP'
-        return x
+def corr_tables(year, state):
+    #the startup tables (with significance results) for national 2019, the cube otherwise
+    if year == 2019 and state == correlation.NATIONAL:
+        return corr_df1, corr_df2
+    return correlation.split_table(correlation.cube_slice(corr_cube, year, state))
 
-    
-    dff = df[(df.Year==2019)]
-    cols = [
-        'CkdRate','unEmpRate', 'PovertyRate', 
-        'lalowihalf','lalowi1','lalowi10', 'lalowi20', 
-        'laseniorshalf','laseniors1', 'laseniors10', 'laseniors20',
-        'lasnaphalf', 'lasnap1', 'lasnap10','lasnap20', 
-        'TractWhite', 'TractBlack',
-        'TractAsian', 'TractNHOPI', 'TractAIAN', 'TractOMultir', 'TractSNAP']
-    
-    dd = pd.DataFrame()
-    feats = []
-    corrs = []
-    p_values = []
-    feat='CkdRate'
-    for feati in cols:
-        #if feati != feat:
-            feats.append(feati)
-            corr, p_value = scipy.stats.spearmanr(dff[feat], dff[feati])
-            corrs.append(corr)
-            p_values.append(p_value)
-
-    dd['Feature'] = feats
-    dd['Correlation Coeff with CKD'] = corrs
-    dd['p_value'] = [round(x, 4) for x in p_values]
-    
-    dd['Distance from supermarket'] = dd['Feature'].apply(assign_distance)
-    dd['Population Group'] = dd['Feature'].apply(assign_names)
-    dd = dd.sort_values(
-        by=['Population Group','Distance from supermarket'])
-    dd = dd[['Population Group','Distance from supermarket','Correlation Coeff with CKD', 'p_value']]
-
-    cols1 = ['CkdRate','unEmpRate','PovertyRate','TractWhite', 'TractBlack',
-       'TractAsian', 'TractNHOPI', 'TractAIAN', 'TractOMultir', 'TractSNAP']
-    
-    d1 = dd[~dd['Population Group'].isin(cols1)]
-    d2 = dd[dd['Population Group'].isin(cols1)]
-    d2 = d2.rename(columns={'Distance from supermarket':'Social Determinant'})
-    d2['Social Determinant']=d2['Social Determinant'].apply(lambda x: x.replace('Tract', 'Proportion of '))
 
-    return d1, d2
-    
-
-corr_df1, corr_df2 = get_correlation(df, year=2019)
+def corr_error_bars(data):
+    #bootstrap 95% interval as error bars when significance.py results are present
+    if 'ci_plus' not in data:
+        return {'hover_data': {'p_value':True, }}
+    return {
+        'error_y': 'ci_plus',
+        'error_y_minus': 'ci_minus',
+        'hover_data': {'p_value':True, 'perm_p_value':True, 'ci_plus':False, 'ci_minus':False},
+    }
 
 def drawMap(object_id, metric='CkdRate', xrange=(20, 40)):
     return  html.Div([
+        dcc.Store(id=map_data.store_id(object_id)),
         dbc.Card(
             dbc.CardBody([
                 dcc.Graph(
                     id=object_id,
-                    figure = px.choropleth(
-                        df[df.Year==2019], 
-                        geojson=geojson_counties,
-                        locations="FIPS", 
-                        color=metric,
-                        scope='usa',
-                        color_continuous_scale='YlOrRd',
-                        range_color=xrange,
-                        hover_data = {'State':True, 'County':True},
-                        labels={'CkdRate':'CKD Prevalence (%)'},
-                        
-                    ),
+                    figure = map_data.choropleth(years[2019], geojson_counties, metric, xrange),
                 ) 
             ])
         ),  
@@ -205,7 +171,7 @@ def drawCorr1(object_id):
                         color='Population Group', 
                         barmode='group',
                         #width=800, height=400,
-                        hover_data = {'p_value':True, },
+                        **corr_error_bars(corr_df1),
                         title='Correlation between CKD prevalence and access to healthy food'
                     )
                 ) 
@@ -226,7 +192,7 @@ def drawCorr2(object_id):
                         y="Correlation Coeff with CKD",
                         color=['blue' if x>0 else 'red' for x in corr_df2['Correlation Coeff with CKD']],
                         barmode='group',
-                        hover_data = {'p_value':True, },
+                        **corr_error_bars(corr_df2),
                         title='Correlation between CKD prevalence and various social determinants'
                     ).update(layout_showlegend=False)
                     
@@ -629,12 +595,24 @@ def section_resources():
     )        
         
 # Build App
-app = Dash(__name__, external_stylesheets=[dbc.themes.SLATE])
+app = Dash(__name__, external_stylesheets=[dbc.themes.SLATE], compress=False)
 
 server = app.server 
+compression.configure(server)   #brotli/gzip for layout and callback responses
+metrics.configure(server)   #Prometheus /metrics, see instrument() below
+tracing.configure(server)   #per-stage breakdown of recent callbacks on /traces
 server.wsgi_app = WhiteNoise(server.wsgi_app, root='static/') 
 
-app.layout = html.Div([
+#the built layout comes from a startup snapshot when one matches the code and the
+#tables behind it (see snapshot.py), so a worker only builds the figures below once
+layout_key = snapshot.fingerprint(
+    dict(assets, corr_df1=corr_df1, corr_df2=corr_df2),
+    files=[geometry.level_path(geometry.DEFAULT_LEVEL)],
+    extra={'geometry': geometry.DEFAULT_LEVEL},
+)
+layout_snapshot = snapshot.load(layout_key)
+app.layout = layout_snapshot or html.Div([
+    dcc.Store(id='county-names', data=map_data.county_names(df)),
     dbc.Card(
         dbc.CardBody([
             #Header row
@@ -708,7 +686,7 @@ app.layout = html.Div([
                 
                 ######
                 dbc.Col([
-                    html.Label('Select FIPS'),
+                    html.Label('Select FIPS (comma-separated for several)'),
                     dcc.Input(
                         id="fips-id", 
                         type="text", 
@@ -813,6 +791,20 @@ app.layout = html.Div([
                         value='SNAP', 
                         id='var-dropdown'
                     ),
+                    html.Label('Select Year'),
+                    dcc.Dropdown(
+                        options=corr_years, 
+                        value=2019, 
+                        clearable=False,
+                        id='corr-year-dropdown'
+                    ),
+                    html.Label('Select State'),
+                    dcc.Dropdown(
+                        options=corr_states, 
+                        value=correlation.NATIONAL, 
+                        clearable=False,
+                        id='corr-state-dropdown'
+                    ),
                 ], width=1),
                 
                 dbc.Col([
@@ -841,47 +833,71 @@ app.layout = html.Div([
         ]), color = 'dark'
     )
 ])
+if layout_snapshot is None:
+    snapshot.save(app.layout, layout_key)
 
 
 
-# Create a callback to update the range_color of the choropleth map based on the slider value
-@app.callback(
-    Output('ckd-map-id', 'figure'),
-    [
-     Input('c-range-slider', 'value'),
-     Input('year-picker', 'value'),
-     Input('btn-nclicks', 'n_clicks'),
-     Input('perc-senior', 'value'),
-     Input('perc-lowi', 'value'),
-     Input('perc-snap', 'value'),
-    ]
-)
-def update_map(ckdvalues,year,btn,perc_senior,perc_lowi,perc_snap):
-    cmin = ckdvalues[0]
-    cmax = ckdvalues[1]
+MAP_INPUTS = [
+    Input('c-range-slider', 'value'),
+    Input('year-picker', 'value'),
+    Input('btn-nclicks', 'n_clicks'),
+    Input('perc-senior', 'value'),
+    Input('perc-lowi', 'value'),
+    Input('perc-snap', 'value'),
+]
+
+def ckd_map_data(year,btn,perc_senior,perc_lowi,perc_snap):
     
-    data = df[df.Year==year].copy()
+    with tracing.span('filter'):
+        data = years[year]
     if (year==2024)&(btn==0):
         year=19999999
-        data = df[df.Year==year].copy()
+        data = years[year]
     elif (year==2024)&(btn>0):
         
-        test_df = df[(df.Year>2015)].copy()
-        data = helpers.make_predictions(test_df,perc_senior,perc_lowi,perc_snap)
-       
+        with tracing.span('predict'):
+            rates = map_grid.rates(perc_senior,perc_lowi,perc_snap,cache=prediction_store)
+            data = map_engine.make_predictions(perc_senior,perc_lowi,perc_snap,rates=rates)
     
-    fig = px.choropleth(
-        data, 
+    return data
+
+
+def ckd_map_key(name,ckdvalues,year,btn,perc_senior,perc_lowi,perc_snap):
+    predicting = (year==2024)&(btn>0)
+    scenario = (perc_senior,perc_lowi,perc_snap) if predicting else None
+    return figures.key(name, ckdvalues, year, predicting, scenario)
+
+
+# Create a callback to update the range_color of the choropleth map based on the slider value
+def update_map(ckdvalues,year,btn,perc_senior,perc_lowi,perc_snap):
+    key = ckd_map_key('update_map',ckdvalues,year,btn,perc_senior,perc_lowi,perc_snap)
+    return figures.get_or_build(
+        key,
+        lambda: build_ckd_map(ckdvalues,year,btn,perc_senior,perc_lowi,perc_snap),
         geojson=geojson_counties,
-        locations="FIPS", 
-        color='CkdRate',
-        scope='usa',
-        color_continuous_scale='YlOrRd',
-        range_color=(cmin, cmax),
-        hover_data = {'State':True, 'County':True},
-        labels={'CkdRate':'CKD Prevalence (%)'},
-        title='CKD Prevalence by US Counties',
     )
+
+
+def update_map_data(year,btn,perc_senior,perc_lowi,perc_snap):
+    #no colour range here: c-range-slider is applied in the browser
+    key = ckd_map_key('update_map_data',None,year,btn,perc_senior,perc_lowi,perc_snap)
+    def build():
+        data = ckd_map_data(year,btn,perc_senior,perc_lowi,perc_snap)
+        with tracing.span('figure'):
+            return map_data.payload(data, 'CkdRate', title='CKD Prevalence by US Counties')
+    return figures.get_or_build(key, build)
+
+
+def build_ckd_map(ckdvalues,year,btn,perc_senior,perc_lowi,perc_snap):
+    cmin = ckdvalues[0]
+    cmax = ckdvalues[1]
+    
+    data = ckd_map_data(year,btn,perc_senior,perc_lowi,perc_snap)
+    
+    with tracing.span('figure'):
+        fig = map_data.choropleth(
+            data, geojson_counties, 'CkdRate', (cmin, cmax), title='CKD Prevalence by US Counties')
     
     return fig
 
@@ -896,116 +912,211 @@ def update_map(ckdvalues,year,btn,perc_senior,perc_lowi,perc_snap):
      Input('perc-snap', 'value'),
     ]
 )
+@tracing.traced
 def update_scatter(year,btn,perc_senior,perc_lowi,perc_snap):
     
-    data = df[df.Year==year].copy()
-    if (year==2024)&(btn==0):
-        year=19999999
-        data = df[df.Year==year].copy()
-    elif (year==2024)&(btn>0):
+    with tracing.span('filter'):
+        data = years[year]
+        if (year==2024)&(btn==0):
+            year=19999999
+            data = years[year]
+    if (year==2024)&(btn>0):
         
-        test_df = df[(df.Year>2015)].copy()
-        test_df['Year'] = year
-        data = helpers.make_predictions(test_df,perc_senior,perc_lowi,perc_snap)
+        with tracing.span('predict'):
+            rates = scatter_grid.rates(perc_senior,perc_lowi,perc_snap,cache=prediction_store)
+            data = scatter_engine.make_predictions(perc_senior,perc_lowi,perc_snap,rates=rates)
        
 
-    data = pd.concat([df, data])
-    actual = data.groupby(['Year'])[['CkdRate']].mean().reset_index()
-    
-    actual['Data Label'] = 'Actual'
-    pred = actual.copy()
-    
-    for year in [2017,2018,2019]:
-        pred.loc[pred.Year==year,'CkdRate'] =\
-            1.05*pred.loc[pred.Year.isin([year-2,year-1]),'CkdRate'].mean()
-    pred.loc[pred.Year==2024,'CkdRate'] = \
-        1.05*pred.loc[pred.Year.isin([2018,2019,2024]),'CkdRate'].mean()
-    pred['Data Label'] = 'Predicted'
-    actual_df = actual[actual.Year<2024]
-    pred_df = pred[pred.Year>=2017]
-    
-    if btn==0:
-        dff = actual_df
-    else:
-        dff = pd.concat([actual_df,pred_df])
-    
-    dff['CkdRate']=dff['CkdRate'].apply(lambda x:round(x,1))
-    dff = dff.rename(columns={'CkdRate':'Avg CKD Rate (%)'})
+    with tracing.span('aggregate'):
+        data = pd.concat([df, data])
+        actual = data.groupby(['Year'])[['CkdRate']].mean().reset_index()
+        
+        actual['Data Label'] = 'Actual'
+        pred = actual.copy()
+        
+        for year in [2017,2018,2019]:
+            pred.loc[pred.Year==year,'CkdRate'] =\
+                1.05*pred.loc[pred.Year.isin([year-2,year-1]),'CkdRate'].mean()
+        pred.loc[pred.Year==2024,'CkdRate'] = \
+            1.05*pred.loc[pred.Year.isin([2018,2019,2024]),'CkdRate'].mean()
+        pred['Data Label'] = 'Predicted'
+        actual_df = actual[actual.Year<2024]
+        pred_df = pred[pred.Year>=2017]
+        
+        if btn==0:
+            dff = actual_df
+        else:
+            dff = pd.concat([actual_df,pred_df])
+        
+        dff['CkdRate']=dff['CkdRate'].apply(lambda x:round(x,1))
+        dff = dff.rename(columns={'CkdRate':'Avg CKD Rate (%)'})
     
-    fig = px.scatter(
-        dff, x='Year', 
-        y='Avg CKD Rate (%)', 
-        color='Data Label', 
-        size='Avg CKD Rate (%)',
-        text='Avg CKD Rate (%)',
-        title='CKD prevalence in the US has been increase over the years'
-    )
-    fig.update(layout_showlegend=False)
-    fig.update_traces(textposition="top center")
+    with tracing.span('figure'):
+        fig = px.scatter(
+            dff, x='Year', 
+            y='Avg CKD Rate (%)', 
+            color='Data Label', 
+            size='Avg CKD Rate (%)',
+            text='Avg CKD Rate (%)',
+            title='CKD prevalence in the US has been increase over the years'
+        )
+        fig.update(layout_showlegend=False)
+        fig.update_traces(textposition="top center")
     return fig
 
 
 
-@app.callback(
-    Output('metrics-map-id', 'figure'),
-    [
-     Input('metric-dropdown', 'value'),
-     Input('perc-senior', 'value'),
-     Input('perc-lowi', 'value'),
-     Input('perc-snap', 'value'),
-     Input('fips-id', 'value'),
-     Input('metric-range-slider','value'),
-    ]
-)
-def update_metric_map(metric,perc_senior,perc_lowi,perc_snap,fips_id,metric_range):
-    cmin, cmax = metric_range[0], metric_range[1]
+METRIC_MAP_INPUTS = [
+    Input('metric-dropdown', 'value'),
+    Input('perc-senior', 'value'),
+    Input('perc-lowi', 'value'),
+    Input('perc-snap', 'value'),
+    Input('fips-id', 'value'),
+    Input('metric-range-slider','value'),
+]
+
+def metric_map_data(perc_senior,perc_lowi,perc_snap,fips_id):
     #data = df[df.Year==2019].copy()
-    if fips_id!='00000':
-        data = df[(df.Year==2019)&(df.FIPS==fips_id)].copy()
-    else:
-        data = df[df.Year==2019].copy()
-    data['laseniors10'] = data['laseniors10']*perc_senior
-    data['lalowi10'] = data['lalowi10']*perc_lowi
-    data['lasnap10'] = data['lasnap10']*perc_snap
-    fig = px.choropleth(
-        data, 
+    with tracing.span('filter'):
+        if fips_id and fips_id!='00000':
+            data = fips_index.rows(2019, tables.parse_fips(fips_id))
+        else:
+            data = years[2019]
+        return data.assign(
+            laseniors10=data['laseniors10']*perc_senior,
+            lalowi10=data['lalowi10']*perc_lowi,
+            lasnap10=data['lasnap10']*perc_snap,
+        )
+
+
+def metric_map_key(name,metric,perc_senior,perc_lowi,perc_snap,fips_id,metric_range):
+    fips = tuple(tables.parse_fips(fips_id)) if fips_id and fips_id!='00000' else None
+    scaled = metric in ('laseniors10','lalowi10','lasnap10')
+    scenario = (perc_senior,perc_lowi,perc_snap) if scaled else None
+    return figures.key(name, metric, scenario, fips, metric_range)
+
+
+def update_metric_map(metric,perc_senior,perc_lowi,perc_snap,fips_id,metric_range):
+    key = metric_map_key('update_metric_map',metric,perc_senior,perc_lowi,perc_snap,fips_id,metric_range)
+    return figures.get_or_build(
+        key,
+        lambda: build_metric_map(metric,perc_senior,perc_lowi,perc_snap,fips_id,metric_range),
         geojson=geojson_counties,
-        locations="FIPS", 
-        color=metric,
-        scope='usa',
-        color_continuous_scale='YlOrRd',
-        range_color=(cmin, cmax),
-        hover_data = {'State':True, 'County':True},
-        labels={'CkdRate':'CKD Prevalence (%)'},
     )
+
+
+def update_metric_map_data(metric,perc_senior,perc_lowi,perc_snap,fips_id):
+    #no colour range here: metric-range-slider is applied in the browser
+    if not metric:
+        #metric-dropdown was cleared: keep the map the browser already shows
+        raise PreventUpdate
+    key = metric_map_key('update_metric_map_data',metric,perc_senior,perc_lowi,perc_snap,fips_id,None)
+    def build():
+        data = metric_map_data(perc_senior,perc_lowi,perc_snap,fips_id)
+        with tracing.span('figure'):
+            return map_data.payload(data, metric)
+    return figures.get_or_build(key, build)
+
+
+def build_metric_map(metric,perc_senior,perc_lowi,perc_snap,fips_id,metric_range):
+    cmin, cmax = metric_range[0], metric_range[1]
+    data = metric_map_data(perc_senior,perc_lowi,perc_snap,fips_id)
+    with tracing.span('figure'):
+        fig = map_data.choropleth(data, geojson_counties, metric, (cmin, cmax))
     
     return fig
 
 
+if map_data.ENABLED:
+    #the geometry goes out once with the layout; afterwards only values
+    #travel, and the browser merges them into the figure it already has.
+    #The range sliders never reach the server: the colour range is set
+    #by the same clientside function.
+    app.callback(
+        Output(map_data.store_id('ckd-map-id'), 'data'), MAP_INPUTS[1:]
+    )(tracing.traced(update_map_data))
+    app.callback(
+        Output(map_data.store_id('metrics-map-id'), 'data'), METRIC_MAP_INPUTS[:-1]
+    )(tracing.traced(update_metric_map_data))
+    for graph_id, slider_id in [('ckd-map-id', 'c-range-slider'), ('metrics-map-id', 'metric-range-slider')]:
+        app.clientside_callback(
+            ClientsideFunction(namespace='ckd', function_name='apply_map_data'),
+            Output(graph_id, 'figure'),
+            Input(map_data.store_id(graph_id), 'data'),
+            Input(slider_id, 'value'),
+            State(graph_id, 'figure'),
+            State('county-names', 'data'),
+        )
+else:
+    app.callback(Output('ckd-map-id', 'figure'), MAP_INPUTS)(tracing.traced(update_map))
+    app.callback(Output('metrics-map-id', 'figure'), METRIC_MAP_INPUTS)(tracing.traced(update_metric_map))
+
+
 @app.callback(
     Output('corr1-id', 'figure'),
     [
      Input('var-dropdown', 'value'),
+     Input('corr-year-dropdown', 'value'),
+     Input('corr-state-dropdown', 'value'),
     ]
 )
-def update_corr1_graph(variable):
+@tracing.traced
+def update_corr1_graph(variable, year, state):
     
-    
-    data = corr_df1[corr_df1['Population Group']==variable]
-    fig = px.bar(
-        data, 
-        x="Distance from supermarket", 
-        y="Correlation Coeff with CKD",
-        color=['blue' if x>0 else 'red' for x in data['Correlation Coeff with CKD']],
-        barmode='group',
-        #width=800, height=400,
-        hover_data = {'p_value':True, },
-        title='Correlation between CKD prevalence and access to healthy food'
-    ).update(layout_showlegend=False)
+    with tracing.span('filter'):
+        d1, _ = corr_tables(year, state)
+        data = d1[d1['Population Group']==variable]
+    with tracing.span('figure'):
+        fig = px.bar(
+            data, 
+            x="Distance from supermarket", 
+            y="Correlation Coeff with CKD",
+            color=['blue' if x>0 else 'red' for x in data['Correlation Coeff with CKD']],
+            barmode='group',
+            #width=800, height=400,
+            **corr_error_bars(data),
+            title='Correlation between CKD prevalence and access to healthy food'
+        ).update(layout_showlegend=False)
     
     return fig             
+
+
+@app.callback(
+    Output('corr2-id', 'figure'),
+    [
+     Input('corr-year-dropdown', 'value'),
+     Input('corr-state-dropdown', 'value'),
+    ]
+)
+@tracing.traced
+def update_corr2_graph(year, state):
+    
+    with tracing.span('filter'):
+        _, data = corr_tables(year, state)
+    with tracing.span('figure'):
+        fig = px.bar(
+            data, 
+            x="Social Determinant", 
+            y="Correlation Coeff with CKD",
+            color=['blue' if x>0 else 'red' for x in data['Correlation Coeff with CKD']],
+            barmode='group',
+            **corr_error_bars(data),
+            title='Correlation between CKD prevalence and various social determinants'
+        ).update(layout_showlegend=False)
+    
+    return fig
    
 
+#stage spans of every callback above, then their latency, payload size and
+#outcome, plus cache hit rates
+tracing.instrument(app)
+metrics.instrument(app)
+metrics.register_cache('figures', figures)
+metrics.register_cache('predictions', prediction_store)
+metrics.register_cache('map_grid', map_grid)
+metrics.register_cache('scatter_grid', scatter_grid)
+
+
 # Run flask app
 if __name__ == "__main__": 
     app.run_server(debug=False, host='0.0.0.0', port=8050)
\ No newline at end of file
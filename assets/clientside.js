@@ -0,0 +1,46 @@
+/*
+ * Clientside callbacks (loaded automatically by Dash from assets/).
+ *
+ * ckd.apply_map_data merges a data-only payload from map_data.payload()
+ * and the colour range from a RangeSlider into the choropleth figure the
+ * browser already has, so the county GeoJSON is never sent again after
+ * the first page load and range changes need no server round trip.
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ckd: {
+        apply_map_data: function(payload, range, figure, names) {
+            if (!payload || !figure || !figure.data || !figure.data.length) {
+                return window.dash_clientside.no_update;
+            }
+            names = names || {};
+            var customdata = payload.locations.map(function(fips) {
+                return names[fips] || ['', ''];
+            });
+            var trace = Object.assign({}, figure.data[0], {
+                locations: payload.locations,
+                z: payload.z,
+                customdata: customdata,
+                hovertemplate: payload.hovertemplate
+            });
+
+            var layout = Object.assign({}, figure.layout);
+            var coloraxis = Object.assign({}, layout.coloraxis);
+            if (range && range.length === 2) {
+                coloraxis.cmin = range[0];
+                coloraxis.cmax = range[1];
+            }
+            coloraxis.colorbar = Object.assign({}, coloraxis.colorbar, {
+                title: {text: payload.label}
+            });
+            layout.coloraxis = coloraxis;
+            if (payload.title) {
+                layout.title = Object.assign({}, layout.title, {text: payload.title});
+            }
+
+            return Object.assign({}, figure, {
+                data: [trace].concat(figure.data.slice(1)),
+                layout: layout
+            });
+        }
+    }
+});
@@ -0,0 +1,361 @@
+"""
+Streaming ingestion of the USDA Food Access Research Atlas.
+
+The atlas workbook has ~72k tract rows and ~150 columns. pd.read_excel
+goes through openpyxl, which builds a Python object per cell (minutes
+for this sheet) and holds the whole sheet in memory. ingest() streams
+the worksheet XML out of the .xlsx zip instead, a few MB at a time,
+pulls the cells of each block out with one regular expression (any
+attribute order; <v> values, shared strings and plain or rich-text
+inline strings; a cell it cannot read is an error, never a silent gap)
+and turns them into columns with numpy, normalizes the names with vectorized
+string operations, and appends the block to one Parquet file per state:
+
+    .cache/atlas/State=ALABAMA/part.parquet
+    .cache/atlas/State=ALASKA/part.parquet
+    ...
+
+so peak memory is bounded by one block whatever the size of the
+workbook. The dataset remembers the sha256 of the workbook it came
+from and is only rebuilt when that changes; read_atlas() reads back just
+the columns (and states) asked for.
+
+    python atlas.py             # ingest, if the workbook changed
+    python atlas.py --force     # ingest anyway
+
+CKD_ATLAS_DIR moves the dataset, CKD_ATLAS_CHUNK_MB changes the block
+size (of uncompressed XML).
+"""
+import gc
+import html
+import json
+import os
+import posixpath
+import re
+import shutil
+import sys
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import aggregation
+import datasource
+
+ATLAS_DIR = os.environ.get('CKD_ATLAS_DIR', os.path.join(datasource.ROOT, '.cache', 'atlas'))
+CHUNK_BYTES = int(float(os.environ.get('CKD_ATLAS_CHUNK_MB', '8')) * (1 << 20))
+SHEET = 'Food Access Research Atlas'
+SOURCE_FILE = '_source.json'
+
+#columns kept as text, everything else is read as float64
+TEXT_COLUMNS = ['CensusTract', 'State', 'County']
+PARTITION = 'State'
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+#one worksheet cell: column letters and row number of its r attribute and its
+#t (type) attribute, in whatever order the attributes come, then either a
+#<v> value (after an optional formula) or the content of an inline string
+CELL = re.compile(
+    rb'<c\s(?=[^>]*?\br="([A-Z]+)(\d+)")(?:(?=[^>]*\bt="(\w*)"))?[^>]*'
+    rb'(?:/>|>(?:<f[^>]*/>|<f[^>]*>[^<]*</f>)?(?:<v>([^<]*)</v>|<v\s*/>|<is>(.*?)</is>)?</c>)',
+    re.S)
+#text runs of an inline string; phonetic runs (<rPh>) are not part of the text
+TEXT_RUN = re.compile(rb'<t(?:\s[^>]*)?>([^<]*)</t>|<t(?:\s[^>]*)?/>')
+PHONETIC = re.compile(rb'<rPh\b.*?</rPh>', re.S)
+
+
+def normalize_names(chunk):
+
+    """
+    Upper case state and county names, without the ' COUNTY' suffix,
+    as the name joins in helpers.py expect them
+    """
+
+    chunk['State'] = chunk['State'].str.upper().str.strip()
+    chunk['County'] = chunk['County'].str.upper().str.replace(' COUNTY', '', regex=False).str.strip()
+    return chunk
+
+
+def _sheet_path(archive, sheet):
+    #worksheet part of the sheet called ``sheet``, via workbook.xml and its relationships
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels.iter(PKG_REL_NS + 'Relationship')}
+    for node in workbook.iter(MAIN_NS + 'sheet'):
+        if node.get('name') == sheet:
+            target = targets[node.get(REL_NS + 'id')]
+            return target.lstrip('/') if target.startswith('/') else posixpath.join('xl', target)
+    raise KeyError('no sheet %r in workbook' % sheet)
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return np.array([], dtype=object)
+    strings = []
+    for _, node in ET.iterparse(archive.open('xl/sharedStrings.xml')):
+        if node.tag == MAIN_NS + 'si':
+            #as _inline_text: the <t>, or the <t> of each run, never a phonetic <rPh>
+            runs = node.findall(MAIN_NS + 't') + node.findall('%sr/%st' % (MAIN_NS, MAIN_NS))
+            strings.append(''.join(t.text or '' for t in runs))
+            node.clear()
+    return np.array(strings, dtype=object)
+
+
+def _text(values, shared, strings):
+    #cell text: shared strings by index, everything else decoded in place
+    out = np.empty(len(values), dtype=object)
+    out[shared] = strings[values[shared].astype(np.int64)]
+    out[~shared] = pd.Series(values[~shared], dtype=object).str.decode('utf-8').to_numpy()
+    escaped = pd.Series(out, dtype=object).str.contains('&', regex=False).fillna(False).to_numpy()
+    out[escaped] = [html.unescape(x) for x in out[escaped]]
+    return out
+
+
+def _numbers(values):
+    values = np.where(values == b'', b'nan', values)
+    try:
+        return values.astype('float64')
+    except ValueError:
+        return pd.to_numeric(pd.Series(values).str.decode('utf-8'), errors='coerce').to_numpy('float64')
+
+
+def _inline_text(content):
+    #text of an <is> element: one <t>, or the <t> of each rich-text run
+    return b''.join(TEXT_RUN.findall(PHONETIC.sub(b'', content)))
+
+
+def _cells(block):
+    #(column letters, row numbers, shared-string flags, raw values) of the cells in an XML block
+    gc.disable()    #millions of small tuples: collection passes would dominate
+    try:
+        found = CELL.findall(block)
+        #every <c> element, to check that CELL read all of them
+        expected = sum(block.count(b'<c' + end) for end in (b' ', b'>', b'/', b'\n', b'\t', b'\r'))
+        if len(found) != expected:
+            raise ValueError(
+                'could not read %d of %d worksheet cells (a cell without an r '
+                'attribute, or unexpected content)' % (expected - len(found), expected))
+        if not found:
+            return None
+        letters, rows, types, values, inline = zip(*found)
+        letters = np.array(letters)
+        rows = np.array(rows).astype(np.int64)
+        shared = np.array(types) == b's'
+        values = np.array(values)
+        if any(inline):
+            inline = np.array([_inline_text(x) if x else x for x in inline])
+            values = np.where(values == b'', inline, values)
+        return letters, rows, shared, values
+    finally:
+        gc.enable()
+
+
+def _frame(cells, header, strings):
+    letters, rows, shared, values = cells
+    first = rows.min()
+    index = rows - first
+    length = index.max() + 1
+    columns = {}
+    for letter, name in header.items():
+        mask = letters == letter
+        if name in TEXT_COLUMNS:
+            column = np.full(length, None, dtype=object)
+            column[index[mask]] = _text(values[mask], shared[mask], strings)
+        else:
+            column = np.full(length, np.nan)
+            column[index[mask]] = _numbers(values[mask])
+        columns[name] = column
+    chunk = pd.DataFrame(columns)
+    #drop rows with no cells at all (gaps in the row numbering)
+    present = np.zeros(length, dtype=bool)
+    present[index] = True
+    chunk = chunk[present].reset_index(drop=True)
+
+    for name in TEXT_COLUMNS:
+        chunk[name] = chunk[name].astype(str)
+    #tracts are 11-digit codes, stored as numbers in the workbook
+    chunk['CensusTract'] = chunk['CensusTract'].str.split('.').str[0].str.zfill(11)
+    return normalize_names(chunk)
+
+
+def iter_chunks(path, sheet=SHEET, chunk_bytes=CHUNK_BYTES):
+
+    """
+    Yield the rows of one sheet as DataFrames, one per ``chunk_bytes``
+    of worksheet XML. The first row with any cells is the header.
+    """
+
+    with zipfile.ZipFile(path) as archive:
+        strings = _shared_strings(archive)
+        header = None
+        buffer = b''
+        with archive.open(_sheet_path(archive, sheet)) as stream:
+            while True:
+                block = stream.read(chunk_bytes)
+                buffer += block
+                #only parse complete rows, keep the rest for the next block
+                end = buffer.rfind(b'</row>') + len(b'</row>') if block else len(buffer)
+                if block and end < len(b'</row>'):
+                    continue
+                cells = _cells(buffer[:end])
+                buffer = buffer[end:]
+                if cells is not None:
+                    if header is None:
+                        letters, rows, shared, values = cells
+                        #rows come in sheet order: the first cell is in the header row
+                        top = rows == rows[0]
+                        names = _text(values[top], shared[top], strings)
+                        header = dict(zip(letters[top], names))
+                        cells = tuple(part[~top] for part in cells)
+                    if len(cells[1]):
+                        yield _frame(cells, header, strings)
+                if not block:
+                    break
+
+
+def _partition_dir(root, state):
+    return os.path.join(root, '%s=%s' % (PARTITION, state))
+
+
+def write_partitions(chunks, out_dir):
+
+    """
+    Append every chunk to one Parquet file per state under ``out_dir``.
+    Each state keeps an open writer, each chunk becomes a row group.
+    Returns the number of rows written.
+    """
+
+    writers = {}
+    schema = None
+    total = 0
+    try:
+        for chunk in chunks:
+            if schema is None:
+                schema = pa.Schema.from_pandas(chunk.drop(columns=PARTITION), preserve_index=False)
+            states = chunk[PARTITION].to_numpy()
+            codes, uniques = pd.factorize(states, sort=True)
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            part = chunk.drop(columns=PARTITION).iloc[order]
+            for i, state in enumerate(uniques):
+                rows = part.iloc[bounds[i]:bounds[i + 1]]
+                if state not in writers:
+                    os.makedirs(_partition_dir(out_dir, state), exist_ok=True)
+                    writers[state] = pq.ParquetWriter(
+                        os.path.join(_partition_dir(out_dir, state), 'part.parquet'), schema)
+                writers[state].write_table(
+                    pa.Table.from_pandas(rows, schema=schema, preserve_index=False))
+            total += len(chunk)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return total
+
+
+def source_version(out_dir=ATLAS_DIR):
+    try:
+        with open(os.path.join(out_dir, SOURCE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ingest(url=datasource.FOOD_ATLAS_URL, out_dir=ATLAS_DIR, force=False, chunk_bytes=CHUNK_BYTES):
+
+    """
+    Build the partitioned dataset from the workbook behind ``url``
+    unless it is already built from the same file. The new dataset is
+    written next to the old one and swapped in when complete.
+    """
+
+    path = datasource.fetch(url)
+    sha = datasource.content_hash(path)
+    current = source_version(out_dir)
+    if not force and current and current.get('sha256') == sha:
+        return out_dir
+
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.atlas-')
+    try:
+        rows = write_partitions(iter_chunks(path, chunk_bytes=chunk_bytes), tmp)
+        with open(os.path.join(tmp, SOURCE_FILE), 'w') as f:
+            json.dump({'url': url, 'sha256': sha, 'rows': rows}, f)
+        old = None
+        if os.path.exists(out_dir):
+            old = tmp + '-old'
+            os.replace(out_dir, old)
+        os.replace(tmp, out_dir)
+        if old:
+            shutil.rmtree(old, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return out_dir
+
+
+def read_atlas(columns=None, states=None, out_dir=ATLAS_DIR):
+
+    """
+    Tract rows of the ingested atlas, ingesting first if needed.
+    ``columns`` and ``states`` restrict what is read from disk.
+    """
+
+    if source_version(out_dir) is None:
+        ingest(out_dir=out_dir)
+    if columns is not None:
+        columns = [c for c in columns if c != PARTITION] + [PARTITION]
+    filters = [(PARTITION, 'in', list(states))] if states is not None else None
+    dff = pd.read_parquet(out_dir, columns=columns, filters=filters)
+    dff[PARTITION] = dff[PARTITION].astype(str)
+    return dff
+
+
+def county_table(means=(), sums=(), shares=(), weight='POP2010', percent_of=None, out_dir=ATLAS_DIR):
+
+    """
+    Tract metrics aggregated to counties (the first five digits of the
+    tract code), weighted by ``weight``: see aggregation.Membership.
+    The ``weight`` column of the result holds the county total. With
+    weight=None every tract counts the same, which is how the bundled
+    DataProcessed.parquet was built.
+
+    percent_of: {column: denominator column}; those tract counts are
+    first turned into a percentage of the tract's denominator (NaN
+    where it is 0), e.g. {'lalowi1': 'POP2010'}.
+    """
+
+    percent_of = percent_of or {}
+    columns = ['CensusTract'] + ([weight] if weight else []) + list(means) + list(sums) \
+        + list(shares) + list(percent_of) + list(percent_of.values())
+    tracts = read_atlas(columns=list(dict.fromkeys(columns)), out_dir=out_dir)
+    tracts['FIPS'] = tracts['CensusTract'].str[:5]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, denominator in percent_of.items():
+            tracts[name] = tracts[name] / tracts[denominator] * 100
+    tracts[list(percent_of)] = tracts[list(percent_of)].replace([np.inf, -np.inf], np.nan)
+
+    membership = aggregation.Membership(
+        tracts[['FIPS']], weights=tracts[weight] if weight else None)
+    counties = membership.aggregate(tracts, means=means, sums=sums, shares=shares)
+    if weight:
+        counties[weight] = membership.totals()
+    return counties
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    out_dir = ingest(force='--force' in argv)
+    print('%s: %s' % (out_dir, source_version(out_dir)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
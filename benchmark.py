@@ -0,0 +1,393 @@
+"""
+Benchmarks of the prediction, correlation and choropleth hot paths.
+
+Every case runs on the bundled DataProcessed table (as the app loads it,
+see compile_assets.py) and on synthetic tables 1x, 10x and 100x its
+size. A synthetic table is the bundled one repeated with jittered
+metrics and, after the first copy, new county ids, so group counts grow
+with the scale the way more counties would.
+
+    make_predictions     helpers.make_predictions on the 2016-2019 rows
+    prediction_engine    PredictionEngine build + one scenario (the app path)
+    correlation_cube     correlation.correlation_cube
+    get_correlation      get_correlation on an empty cache (without the
+                         significance.py resampling, which has its own knobs)
+    get_correlation_hit  get_correlation with the cube cached on disk
+    choropleth           map_data.choropleth as app.build_ckd_map calls it,
+                         frozen as figure_cache stores it
+    map_data_payload     map_data.payload, the live map callback path
+
+Each case is run once under tracemalloc for its peak memory (which also
+warms it up), then timed over --repeat runs without it, so the tracing
+overhead stays out of the timings (median reported). Results are appended to
+.cache/benchmarks/results.jsonl and compared with benchmark_baseline.json;
+a case more than CKD_BENCH_TOLERANCE (25%) slower or larger than its
+baseline is flagged and the exit status is 1. Datasets run from small to
+large, and a case whose peak memory at the previous scale, grown with
+the row count, would not fit in the available memory is recorded as
+skipped rather than run into the OOM killer.
+
+    python benchmark.py                         # everything, against the baseline
+    python benchmark.py --datasets bundled x10  # some datasets
+    python benchmark.py --cases choropleth      # some cases
+    python benchmark.py --save-baseline         # record the baseline from this run
+
+Timings depend on the machine: record the baseline on the machine that
+runs the comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import compile_assets
+import correlation
+import datasource
+import figure_cache
+import geometry
+import helpers
+import map_data
+import tables
+
+BASELINE = os.path.join(datasource.ROOT, 'benchmark_baseline.json')
+RESULTS = os.environ.get(
+    'CKD_BENCH_RESULTS', os.path.join(datasource.ROOT, '.cache', 'benchmarks', 'results.jsonl'))
+TOLERANCE = float(os.environ.get('CKD_BENCH_TOLERANCE', '0.25'))
+#differences below these are noise, whatever the ratio
+MIN_SECONDS = 0.005
+MIN_BYTES = 1 << 20
+#skip a case whose expected peak is above this share of the available memory
+MEMORY_HEADROOM = 0.8
+#case -> the case its (untimed) setup runs
+SETUP_RUNS = {'get_correlation_hit': 'get_correlation'}
+
+DATASETS = ['bundled', 'x1', 'x10', 'x100']
+JITTER = 0.05   #sigma of the lognormal noise on the synthetic metrics
+SEED = 2023
+MAP_YEAR = 2019
+
+
+def _tile(column, scale, rename=None):
+    #a categorical column repeated ``scale`` times; with ``rename``, copy i > 0
+    #gets its own categories rename(category, i)
+    categories = column.cat.categories
+    codes = column.cat.codes.to_numpy().astype(np.int64)
+    if rename is None:
+        return pd.Categorical.from_codes(np.tile(codes, scale), categories)
+    names = list(categories) + [rename(c, i) for i in range(1, scale) for c in categories]
+    tiled = np.concatenate([np.where(codes < 0, -1, codes + i * len(categories)) for i in range(scale)])
+    return pd.Categorical.from_codes(tiled, names)
+
+
+def synthetic(df, scale, seed=SEED):
+
+    """
+    ``scale`` copies of df (as compacted by tables.compact) with every
+    metric multiplied by lognormal noise; copies after the first get
+    their own FIPS codes and county names, so they are new counties to
+    every groupby. Built from category codes and one float32 block, so
+    the 100x table fits in memory next to the cases run on it.
+    """
+
+    rng = np.random.default_rng(seed)
+    metrics = [c for c in df.select_dtypes('number').columns if c != 'Year']
+    renamed = {
+        'FIPS': lambda fips, i: '%s-%d' % (fips, i),
+        'County': lambda county, i: '%s %d' % (county, i),
+    }
+    columns = {}
+    for name in df.columns:
+        if name in tables.KEY_COLUMNS:
+            columns[name] = _tile(df[name], scale, renamed.get(name))
+        elif name == 'Year':
+            columns[name] = np.tile(df[name].to_numpy(), scale)
+    n = len(df)
+    values = np.empty((n * scale, len(metrics)), dtype='float32')
+    base = df[metrics].to_numpy(dtype='float32')
+    for i in range(scale):
+        noise = rng.lognormal(0, JITTER, base.shape).astype('float32')
+        np.multiply(base, noise, out=values[i * n:(i + 1) * n])
+    out = pd.DataFrame(columns)
+    for j, name in enumerate(metrics):
+        out[name] = values[:, j]
+    return out[list(df.columns)]
+
+
+def load_dataset(name):
+    df = compile_assets.load_assets()['data_processed']
+    if name == 'bundled':
+        return df
+    return synthetic(df, int(name.lstrip('x')))
+
+
+def _prediction_input(df):
+    #what pipeline.py and the scatter engine predict from
+    return df[df.Year>2015].assign(Year=2024)
+
+
+def _choropleth(data, geojson):
+    #the figure app.build_ckd_map builds on a figure cache miss
+    fig = map_data.choropleth(data, geojson, 'CkdRate', (20, 40), title='CKD Prevalence by US Counties')
+    return figure_cache.freeze(fig, geojson)
+
+
+@contextmanager
+def _correlation_cache(directory):
+    #point correlation.cached_table at ``directory`` for the duration
+    saved, correlation.CACHE_DIR = correlation.CACHE_DIR, directory
+    try:
+        yield
+    finally:
+        correlation.CACHE_DIR = saved
+
+
+def cases(df, geojson, scratch):
+
+    """
+    {case: (setup, run)}: setup() prepares what run(prepared) needs and
+    is not timed. Temporary directories go to the ``scratch`` list, for
+    the caller to clean up.
+    """
+
+    def cold_correlation(_):
+        with tempfile.TemporaryDirectory(prefix='ckd-bench-') as directory:
+            with _correlation_cache(directory):
+                return correlation.get_correlation(df, significance=False)
+
+    def warm_setup():
+        #one untimed call fills a private cache that the timed calls hit
+        scratch.append(tempfile.TemporaryDirectory(prefix='ckd-bench-'))
+        with _correlation_cache(scratch[-1].name):
+            correlation.get_correlation(df, significance=False)
+        return scratch[-1].name
+
+    def warm_correlation(directory):
+        with _correlation_cache(directory):
+            return correlation.get_correlation(df, significance=False)
+
+    year = df[df.Year==MAP_YEAR]
+    return {
+        'make_predictions': (
+            lambda: _prediction_input(df), helpers.make_predictions),
+        'prediction_engine': (
+            lambda: _prediction_input(df),
+            lambda test_df: helpers.PredictionEngine(test_df).make_predictions(1.2, 1.1, 1.3)),
+        'correlation_cube': (lambda: None, lambda _: correlation.correlation_cube(df)),
+        'get_correlation': (lambda: None, cold_correlation),
+        'get_correlation_hit': (warm_setup, warm_correlation),
+        'choropleth': (lambda: None, lambda _: _choropleth(year, geojson)),
+        'map_data_payload': (lambda: None, lambda _: map_data.payload(year, 'CkdRate')),
+    }
+
+
+def measure(setup, run, repeat):
+    prepared = setup()
+    #the traced run also warms up whatever the first call initializes
+    tracemalloc.start()
+    try:
+        run(prepared)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(prepared)
+        seconds.append(time.perf_counter() - started)
+    return {
+        'median_s': statistics.median(seconds),
+        'min_s': min(seconds),
+        'runs': len(seconds),
+        'peak_bytes': peak,
+    }
+
+
+def machine():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def available_memory():
+    #bytes the system can still hand out, None where that is unknown
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _too_big(case, rows, previous):
+    #reason to skip ``case`` when its peak at the last, smaller scale (or that
+    #of the case its setup runs), grown linearly to ``rows``, would not fit
+    #in memory: the run would be killed
+    if previous is None:
+        return None
+    peaks = [
+        previous['cases'][name]['peak_bytes'] for name in (case, SETUP_RUNS.get(case))
+        if 'peak_bytes' in previous['cases'].get(name, {})]
+    if not peaks:
+        return None
+    expected = max(peaks) * rows / previous['rows']
+    available = available_memory()
+    if available is None or expected < MEMORY_HEADROOM * available:
+        return None
+    return 'skipped: needs ~%.1f GB, %.1f GB available' % (expected / 2**30, available / 2**30)
+
+
+def run(datasets=DATASETS, only=None, repeat=3, log=print):
+
+    """
+    {dataset: {'rows': n, 'cases': {case: measurement}}}. A case that
+    would not fit in memory is recorded as {'skipped': reason} instead.
+    """
+
+    geojson = geometry.load_counties()
+    #plotly imports its validators on first use: build one small figure first,
+    #or that would count against the first dataset's choropleth
+    _choropleth(compile_assets.load_assets()['data_processed'].head(10), geojson)
+    results = {}
+    previous = None
+    for name in datasets:
+        started = time.time()
+        df = load_dataset(name)
+        scratch = []
+        suite = cases(df, geojson, scratch)
+        measured = {}
+        try:
+            for case, (setup, func) in suite.items():
+                if only and case not in only:
+                    continue
+                skipped = _too_big(case, len(df), previous)
+                if skipped:
+                    measured[case] = {'skipped': skipped}
+                    if log:
+                        log('%-8s %-20s %s' % (name, case, skipped))
+                    continue
+                measured[case] = measure(setup, func, repeat)
+                if log:
+                    log('%-8s %-20s %9.3fs %9.1f MB' % (
+                        name, case, measured[case]['median_s'], measured[case]['peak_bytes'] / 2**20))
+        finally:
+            for directory in scratch:
+                directory.cleanup()
+        results[name] = previous = {'rows': len(df), 'cases': measured}
+        if log:
+            log('%-8s %d rows in %.1fs' % (name, len(df), time.time() - started))
+        del df, suite
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+
+    """
+    [(dataset, case, metric, baseline, current, ratio)] for every
+    measurement beyond ``tolerance`` of its baseline, slower or larger
+    """
+
+    regressions = []
+    for name, entry in results.items():
+        base_cases = baseline.get('datasets', {}).get(name, {}).get('cases', {})
+        for case, current in entry['cases'].items():
+            base = base_cases.get(case)
+            if base is None or 'skipped' in base or 'skipped' in current:
+                continue
+            for metric, floor in (('median_s', MIN_SECONDS), ('peak_bytes', MIN_BYTES)):
+                before, now = base[metric], current[metric]
+                if now > before * (1 + tolerance) and now - before > floor:
+                    regressions.append((name, case, metric, before, now, now / before if before else float('inf')))
+    return regressions
+
+
+def read_baseline(path=BASELINE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_baseline(results, path=BASELINE):
+    #replace the baseline of the datasets in results, keep the others
+    baseline = read_baseline(path) or {'datasets': {}}
+    baseline['machine'] = machine()
+    baseline['recorded'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    for name, entry in results.items():
+        cases = dict(baseline['datasets'].get(name, {}).get('cases', {}))
+        cases.update((case, m) for case, m in entry['cases'].items() if 'skipped' not in m)
+        baseline['datasets'][name] = {'rows': entry['rows'], 'cases': cases}
+    tmp = path + '.%d.tmp' % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp, path)
+    return path
+
+
+def append_results(results, regressions, path=RESULTS):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': machine(),
+        'datasets': results,
+        'regressions': [list(r) for r in regressions],
+    }
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--datasets', nargs='*', default=DATASETS, choices=DATASETS)
+    parser.add_argument('--cases', nargs='*', default=None, help='only these cases')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case')
+    parser.add_argument('--save-baseline', action='store_true', help='record this run as the baseline')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--out', default=RESULTS, help='JSONL file the results are appended to')
+    args = parser.parse_args(argv)
+
+    results = run(args.datasets, args.cases, args.repeat)
+    baseline = read_baseline(args.baseline)
+    regressions = compare(results, baseline) if baseline else []
+    print('results appended to %s' % append_results(results, regressions, args.out))
+
+    if args.save_baseline:
+        print('baseline written to %s' % save_baseline(results, args.baseline))
+        return 0
+    if baseline is None:
+        print('no baseline at %s (record one with --save-baseline)' % args.baseline)
+        return 0
+    if baseline.get('machine') != machine():
+        print('note: the baseline was recorded on another machine (%s)' % baseline.get('machine'))
+    for name, case, metric, before, now, ratio in regressions:
+        unit, scale = ('s', 1) if metric == 'median_s' else ('MB', 2**20)
+        print('REGRESSION %-8s %-20s %-10s %.3f%s -> %.3f%s (x%.2f)' % (
+            name, case, metric, before / scale, unit, now / scale, unit, ratio))
+    if not regressions:
+        print('no regressions beyond %d%% of the baseline' % (TOLERANCE * 100))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Offline asset compiler.
+
+Turns the spreadsheet and parquet sources behind the dashboard into
+pre-cleaned Parquet artifacts plus a manifest, so app.py can load them
+with plain columnar reads instead of parsing charts.xlsx on every boot.
+
+    python compile_assets.py            # compile into data/compiled/
+    python compile_assets.py --check    # exit 1 if the artifacts are stale
+
+Compiling also brings data/compiled/significance.parquet (see
+significance.py) up to date with the compiled table; app.py only reads
+it. --no-significance skips that.
+
+The manifest records the sha256 of every source file; load_assets()
+falls back to compiling in memory when the artifacts are missing or
+out of date, so a forgotten rebuild never serves stale charts.
+"""
+import argparse
+import json
+import os
+import sys
+
+import pandas as pd
+
+import datasource
+import tables
+
+COMPILED_DIR = os.path.join(datasource.ROOT, 'data', 'compiled')
+MANIFEST = os.path.join(COMPILED_DIR, 'manifest.json')
+MANIFEST_VERSION = 2
+
+
+def _ckd_incidence(xls):
+    ckd_inc_df = pd.read_excel(
+        xls, sheet_name='CKD Incidence Research', usecols=['DASH Score', 'Odds ratio']
+    ).dropna()
+    return ckd_inc_df[ckd_inc_df['DASH Score']!=1]
+
+
+def _diet(xls):
+    diet_df = pd.read_excel(
+        xls, sheet_name='Diet Followed', usecols=['Type of Diet', 'Percentage of population']
+    ).dropna().sort_values(by=['Percentage of population'])
+    diet_df['Percentage of population'] = diet_df['Percentage of population'] * 100
+    return diet_df
+
+
+def _snap_foods(xls):
+    #source: https://www.fns.usda.gov/snap/foods-typically-purchased-supplemental-nutrition-assistance-program-snap-households
+    usecols = ['Food Category', 'Percentage of Total Spend']
+    foods = pd.read_excel(xls, sheet_name='What SNAP People Buy', usecols=usecols).dropna()
+    foods = foods[foods['Food Category']!='Total Summary Category Expenditures']
+    foods['Percentage of Total Spend'] = foods['Percentage of Total Spend'] * 100
+    return foods
+
+
+def _money_for_food(xls):
+    return pd.read_excel(
+        xls, sheet_name='Money for Food', usecols=['Frequency', 'Percentage']).dropna()
+
+
+def _diet_reasons(xls):
+    return pd.read_excel(
+        xls, sheet_name='Reasons for Diets', usecols=['Reason', 'Percentage of People']).dropna()
+
+
+def _data_processed(path):
+    return tables.compact(pd.read_parquet(path))
+
+
+#artifact name -> (source url, builder)
+ARTIFACTS = {
+    'ckd_incidence': (datasource.CHARTS_URL, _ckd_incidence),
+    'diet': (datasource.CHARTS_URL, _diet),
+    'snap_foods': (datasource.CHARTS_URL, _snap_foods),
+    'money_for_food': (datasource.CHARTS_URL, _money_for_food),
+    'diet_reasons': (datasource.CHARTS_URL, _diet_reasons),
+    'data_processed': (datasource.DATA_PROCESSED_URL, _data_processed),
+}
+
+
+def source_hashes():
+    urls = sorted({url for url, _ in ARTIFACTS.values()})
+    return {url: datasource.content_hash(datasource.fetch(url)) for url in urls}
+
+
+def compile_all():
+    """Build every artifact in memory and return {name: DataFrame}"""
+    opened = {}
+    compiled = {}
+    for name, (url, builder) in ARTIFACTS.items():
+        if url not in opened:
+            path = datasource.fetch(url)
+            opened[url] = pd.ExcelFile(path) if path.endswith('.xlsx') else path
+        compiled[name] = builder(opened[url]).reset_index(drop=True)
+    return compiled
+
+
+def write_assets(compiled, out_dir=COMPILED_DIR):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {'version': MANIFEST_VERSION, 'sources': source_hashes(), 'artifacts': {}}
+    for name, table in compiled.items():
+        fname = name + '.parquet'
+        table.to_parquet(os.path.join(out_dir, fname), index=False)
+        manifest['artifacts'][name] = {
+            'file': fname,
+            'rows': len(table),
+            'columns': list(table.columns),
+            'memory_mb': round(tables.memory_usage_mb(table), 2),
+        }
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+def read_manifest(out_dir=COMPILED_DIR):
+    try:
+        with open(os.path.join(out_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(manifest):
+    return (
+        manifest is not None
+        and manifest.get('version') == MANIFEST_VERSION
+        and set(manifest['artifacts']) == set(ARTIFACTS)
+        and manifest['sources'] == source_hashes()
+    )
+
+
+def load_assets(out_dir=COMPILED_DIR):
+    """
+    Load the compiled artifacts as {name: DataFrame}, compiling from
+    the sources in memory if they are missing or stale
+    """
+    manifest = read_manifest(out_dir)
+    if not is_fresh(manifest):
+        return compile_all()
+    return {
+        name: pd.read_parquet(os.path.join(out_dir, meta['file']))
+        for name, meta in manifest['artifacts'].items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--out', default=COMPILED_DIR, help='output directory')
+    parser.add_argument('--check', action='store_true', help='only check freshness')
+    parser.add_argument('--no-significance', action='store_true',
+                        help='skip precomputing the correlation significance tables')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        fresh = is_fresh(read_manifest(args.out))
+        print('fresh' if fresh else 'stale')
+        return 0 if fresh else 1
+
+    manifest = write_assets(compile_all(), args.out)
+    for name, meta in sorted(manifest['artifacts'].items()):
+        print('%-16s %6d rows %7.2f MB -> %s' % (
+            name, meta['rows'], meta['memory_mb'], meta['file']))
+    if not args.no_significance:
+        import significance
+        significance.precompute(load_assets(args.out)['data_processed'])
+        print('significance     -> %s' % significance.SIGNIFICANCE_PATH)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
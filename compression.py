@@ -0,0 +1,37 @@
+"""
+Content-negotiated compression of the dynamic Dash responses.
+
+WhiteNoise only covers the static files; the layout and every
+_dash-update-component response go through Flask. Compress them with
+brotli or gzip (whichever the client accepts, brotli first) via
+flask-compress:
+
+    CKD_COMPRESS_MIN_SIZE   smallest response worth compressing (bytes, 1024)
+    CKD_COMPRESS_LEVEL      gzip level (6)
+    CKD_COMPRESS_BR_LEVEL   brotli quality (5)
+    CKD_COMPRESS=0          turn it off
+"""
+import os
+
+from flask_compress import Compress
+
+ENABLED = os.environ.get('CKD_COMPRESS', '1') == '1'
+
+
+def configure(server):
+
+    """
+    Enable compression on a Flask server. Call this after the Dash app
+    exists: Dash(compress=True) would force gzip-only, so the app is
+    built with compress=False and compression is set up here instead.
+    """
+
+    if not ENABLED:
+        return None
+    server.config.update(
+        COMPRESS_ALGORITHM=['br', 'gzip'],
+        COMPRESS_MIN_SIZE=int(os.environ.get('CKD_COMPRESS_MIN_SIZE', '1024')),
+        COMPRESS_LEVEL=int(os.environ.get('CKD_COMPRESS_LEVEL', '6')),
+        COMPRESS_BR_LEVEL=int(os.environ.get('CKD_COMPRESS_BR_LEVEL', '5')),
+    )
+    return Compress(server)
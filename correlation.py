@@ -0,0 +1,213 @@
+"""
+Spearman correlation of CKD prevalence with the social determinants.
+
+correlation_cube() computes every coefficient for every (Year, State)
+group at once, plus a national row per year: all groups are ranked in
+one groupby pass and the coefficients come from grouped sums of the
+centred ranks, with p-values from the same t-approximation
+scipy.stats.spearmanr uses. The cube is cached on disk, keyed by a hash
+of the data, so a worker boot reads it back instead of recomputing, and
+the charts switch year and state by slicing it (get_correlation).
+
+Bootstrap intervals and permutation p-values for the national tables
+come from significance.py, which uses spearman() for the single-table
+case.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+import datasource
+import tables
+
+CACHE_DIR = os.environ.get(
+    'CKD_CORRELATION_CACHE_DIR', os.path.join(datasource.ROOT, '.cache', 'correlation'))
+CACHE_VERSION = 1
+
+#State value of the national rows in the correlation cube
+NATIONAL = 'All States'
+
+TARGET = 'CkdRate'
+FEATURES = [
+    'CkdRate','unEmpRate', 'PovertyRate',
+    'lalowihalf','lalowi1','lalowi10', 'lalowi20',
+    'laseniorshalf','laseniors1', 'laseniors10', 'laseniors20',
+    'lasnaphalf', 'lasnap1', 'lasnap10','lasnap20',
+    'TractWhite', 'TractBlack',
+    'TractAsian', 'TractNHOPI', 'TractAIAN', 'TractOMultir', 'TractSNAP']
+
+#features shown on the social determinants chart rather than the food access one
+DETERMINANTS = ['CkdRate','unEmpRate','PovertyRate','TractWhite', 'TractBlack',
+    'TractAsian', 'TractNHOPI', 'TractAIAN', 'TractOMultir', 'TractSNAP']
+
+
+def assign_distance(x):
+
+    if '20' in x[-2:]: return '20 Miles'
+    if '10' in x[-2:]: return '10 Miles'
+    if ('1' in x[-2:])&(any(c.isalpha() for c in x[-2:])): return '1 Miles'
+    if 'lf' in x[-2:]: return '0.5 Miles'
+    return x
+
+
+def assign_names(x):
+
+    if 'lalow' in x: return 'Low Income'
+    if 'laseniors' in x: return 'Senior'
+    if 'lasnap' in x: return 'SNAP'
+    return x
+
+
+def rankdata(a, axis=0):
+
+    """
+    Average ranks (ties share the mean of their positions) along one
+    axis of an n-d array, like scipy.stats.rankdata(a, axis=axis) but
+    without looping over the other axes in Python.
+    """
+
+    a = np.ascontiguousarray(np.moveaxis(np.asarray(a), axis, -1))
+    n = a.shape[-1]
+    order = np.argsort(a, axis=-1, kind='mergesort')
+    ordered = np.take_along_axis(a, order, axis=-1)
+    pos = np.broadcast_to(np.arange(n), a.shape)
+    edge = ordered[..., 1:] != ordered[..., :-1]
+    first = np.concatenate([np.ones(a.shape[:-1] + (1,), bool), edge], axis=-1)
+    last = np.concatenate([edge, np.ones(a.shape[:-1] + (1,), bool)], axis=-1)
+    start = np.maximum.accumulate(np.where(first, pos, 0), axis=-1)
+    end = np.flip(np.minimum.accumulate(np.flip(np.where(last, pos, n - 1), -1), axis=-1), -1)
+    ranks = np.empty(a.shape)
+    np.put_along_axis(ranks, order, (start + end) / 2 + 1, axis=-1)
+    return np.moveaxis(ranks, -1, axis)
+
+
+def spearman(target, features):
+
+    """
+    Spearman coefficient and two-sided p-value of ``target`` (n,)
+    against every column of ``features`` (n, k), ranking each column
+    once. Matches scipy.stats.spearmanr column by column.
+    """
+
+    n = len(target)
+    ranks = rankdata(np.column_stack([target, features]), axis=0)
+    ranks -= ranks.mean(axis=0)
+    norms = np.sqrt((ranks**2).sum(axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.clip((ranks[:, 1:].T @ ranks[:, 0]) / (norms[1:] * norms[0]), -1, 1)
+    return r, p_values(r, n)
+
+
+def p_values(r, n):
+    #two-sided p-value of Spearman coefficients r from n observations (t-approximation)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.clip(r, -1, 1)
+        dof = n - 2
+        t = r * np.sqrt(dof / ((r + 1.0) * (1.0 - r)))
+        return 2 * stats.t.sf(np.abs(t), dof)
+
+
+def label_table(dd):
+    #chart labels for a table with a Feature column
+    dd = dd.copy()
+    dd['Distance from supermarket'] = dd['Feature'].map(assign_distance)
+    dd['Population Group'] = dd['Feature'].map(assign_names)
+    return dd
+
+
+def correlation_cube(df, cols=FEATURES, target=TARGET):
+
+    """
+    Spearman coefficient and p-value of every feature for every (Year,
+    State) group, and for every Year over all states (State=NATIONAL).
+    Long format: Year, State, Feature, Correlation Coeff with CKD,
+    p_value, n. All groups are ranked in one groupby pass and the
+    coefficients come from grouped sums of the centred ranks.
+    """
+
+    data = df[['Year'] + cols].astype('float64')
+    data['Year'] = df['Year'].astype('int64').to_numpy()
+    data['State'] = df['State'].astype(str).to_numpy()
+    data = pd.concat([data, data.assign(State=NATIONAL)], ignore_index=True)
+
+    keys = [data['Year'], data['State']]
+    ranks = data[cols].groupby(keys, sort=False).rank(method='average')
+    ranks -= ranks.groupby(keys, sort=False).transform('mean')
+    num = ranks.mul(ranks[target], axis=0).groupby(keys).sum()
+    norms = np.sqrt((ranks**2).groupby(keys).sum())
+    n = ranks.groupby(keys).size()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = num / norms.mul(norms[target], axis=0)
+    r = r.rename_axis(['Year', 'State']).rename_axis('Feature', axis=1).stack(dropna=False)
+    cube = r.rename('Correlation Coeff with CKD').reset_index()
+    cube['n'] = n.reindex(pd.MultiIndex.from_frame(cube[['Year', 'State']])).to_numpy()
+    cube['p_value'] = np.round(p_values(cube['Correlation Coeff with CKD'].to_numpy(), cube['n'].to_numpy()), 4)
+    cube['Year'] = cube['Year'].astype('int16')
+    return cube[['Year', 'State', 'Feature', 'Correlation Coeff with CKD', 'p_value', 'n']]
+
+
+def cube_slice(cube, year, state=NATIONAL):
+    #one year and state of the cube: Feature, coefficient, p-value and chart labels
+    dd = cube[(cube['Year'] == year) & (cube['State'] == state)]
+    return label_table(dd[['Feature', 'Correlation Coeff with CKD', 'p_value']].reset_index(drop=True))
+
+
+def split_table(dd):
+
+    """Split a correlation table into the food access and social determinant charts"""
+
+    dd = dd.sort_values(
+        by=['Population Group','Distance from supermarket'])
+    columns = ['Population Group','Distance from supermarket','Correlation Coeff with CKD', 'p_value']
+    if 'ci_low' in dd:
+        #error bar lengths for px.bar(error_y=..., error_y_minus=...)
+        dd = dd.assign(
+            ci_plus=dd['ci_high'] - dd['Correlation Coeff with CKD'],
+            ci_minus=dd['Correlation Coeff with CKD'] - dd['ci_low'],
+        )
+        columns += ['ci_low', 'ci_high', 'ci_plus', 'ci_minus', 'perm_p_value']
+    dd = dd[columns]
+
+    d1 = dd[~dd['Population Group'].isin(DETERMINANTS)]
+    d2 = dd[dd['Population Group'].isin(DETERMINANTS)]
+    d2 = d2.rename(columns={'Distance from supermarket':'Social Determinant'})
+    d2['Social Determinant'] = d2['Social Determinant'].str.replace('Tract', 'Proportion of ', regex=False)
+
+    return d1, d2
+
+
+def cached_table(name, data, build):
+    #parquet file keyed by a hash of the input data
+    path = os.path.join(CACHE_DIR, '%s-v%d-%s.parquet' % (name, CACHE_VERSION, tables.data_version(data)))
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+    result = build()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = path + '.%d.tmp' % os.getpid()
+    result.to_parquet(tmp)
+    os.replace(tmp, path)
+    return result
+
+
+def get_cube(df):
+    return cached_table('cube', df[['Year', 'State'] + FEATURES], lambda: correlation_cube(df))
+
+
+def get_correlation(df, year=2019, state=NATIONAL, significance=True, cube=None):
+
+    """
+    The two chart tables of one year and state. National tables get the
+    columns of the committed significance.py table when it was computed
+    from the same rows; the resampling itself never runs here.
+    """
+
+    dd = cube_slice(get_cube(df) if cube is None else cube, year, state)
+    if significance and state == NATIONAL:
+        import significance as sig
+        extra = sig.load(df[df.Year==year])
+        if extra is not None:
+            dd = dd.merge(extra, on='Feature', how='left')
+    return split_table(dd)
@@ -0,0 +1,298 @@
+"""
+County name -> FIPS crosswalk.
+
+The ETL used to attach FIPS codes by joining upper-cased (State,
+County) strings against fips2county.tsv, downloaded again by every
+caller. Any county spelled differently on the two sides ("ACADIA" vs
+"Acadia Parish", "DE KALB" vs "DEKALB", "ST. CLAIR" vs "SAINT CLAIR")
+was silently dropped; Louisiana and DC are missing from
+DataProcessed.parquet for that reason.
+
+The crosswalk lists every county under all the spellings we have seen:
+the county GeoJSON's official names with and without their legal
+suffix, and the CDC abbreviations in ALIASES. The GeoJSON is bundled, so
+the inputs are the same on every machine; fips2county.tsv is not read,
+as a download-cache-dependent input would make the spellings and the
+staleness check vary. It does not read DataProcessed.parquet either,
+which is built from it (pipeline.py). Each spelling is reduced to a match key by normalize_county():
+accents, punctuation, spacing, SAINT/SAINTE and the COUNTY, PARISH,
+BOROUGH... suffixes are dropped. A name then resolves to a 5-digit FIPS
+code through one index lookup, and the rest of the pipeline joins on
+integer FIPS codes (merge()).
+
+    python crosswalk.py            # build into data/compiled/
+    python crosswalk.py --check    # exit 1 if the file is stale
+
+The compiled file records its format version and the sha256 of its
+sources; load() builds it in memory when it is missing or stale.
+"""
+import functools
+import json
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import datasource
+
+CROSSWALK_PATH = os.path.join(datasource.ROOT, 'data', 'compiled', 'fips_crosswalk.parquet')
+VERSION = 2
+
+#state FIPS -> (name, abbreviation)
+STATES = {
+    '01': ('ALABAMA', 'AL'), '02': ('ALASKA', 'AK'), '04': ('ARIZONA', 'AZ'),
+    '05': ('ARKANSAS', 'AR'), '06': ('CALIFORNIA', 'CA'), '08': ('COLORADO', 'CO'),
+    '09': ('CONNECTICUT', 'CT'), '10': ('DELAWARE', 'DE'), '11': ('DISTRICT OF COLUMBIA', 'DC'),
+    '12': ('FLORIDA', 'FL'), '13': ('GEORGIA', 'GA'), '15': ('HAWAII', 'HI'),
+    '16': ('IDAHO', 'ID'), '17': ('ILLINOIS', 'IL'), '18': ('INDIANA', 'IN'),
+    '19': ('IOWA', 'IA'), '20': ('KANSAS', 'KS'), '21': ('KENTUCKY', 'KY'),
+    '22': ('LOUISIANA', 'LA'), '23': ('MAINE', 'ME'), '24': ('MARYLAND', 'MD'),
+    '25': ('MASSACHUSETTS', 'MA'), '26': ('MICHIGAN', 'MI'), '27': ('MINNESOTA', 'MN'),
+    '28': ('MISSISSIPPI', 'MS'), '29': ('MISSOURI', 'MO'), '30': ('MONTANA', 'MT'),
+    '31': ('NEBRASKA', 'NE'), '32': ('NEVADA', 'NV'), '33': ('NEW HAMPSHIRE', 'NH'),
+    '34': ('NEW JERSEY', 'NJ'), '35': ('NEW MEXICO', 'NM'), '36': ('NEW YORK', 'NY'),
+    '37': ('NORTH CAROLINA', 'NC'), '38': ('NORTH DAKOTA', 'ND'), '39': ('OHIO', 'OH'),
+    '40': ('OKLAHOMA', 'OK'), '41': ('OREGON', 'OR'), '42': ('PENNSYLVANIA', 'PA'),
+    '44': ('RHODE ISLAND', 'RI'), '45': ('SOUTH CAROLINA', 'SC'), '46': ('SOUTH DAKOTA', 'SD'),
+    '47': ('TENNESSEE', 'TN'), '48': ('TEXAS', 'TX'), '49': ('UTAH', 'UT'),
+    '50': ('VERMONT', 'VT'), '51': ('VIRGINIA', 'VA'), '53': ('WASHINGTON', 'WA'),
+    '54': ('WEST VIRGINIA', 'WV'), '55': ('WISCONSIN', 'WI'), '56': ('WYOMING', 'WY'),
+    '72': ('PUERTO RICO', 'PR'),
+}
+
+#GeoJSON LSAD code -> legal suffix of the county name
+SUFFIXES = {
+    'County': 'COUNTY', 'Parish': 'PARISH', 'Borough': 'BOROUGH', 'CA': 'CENSUS AREA',
+    'Cty&Bor': 'CITY AND BOROUGH', 'Muny': 'MUNICIPALITY', 'Muno': 'MUNICIPIO', 'city': 'CITY',
+}
+#suffixes that are not part of the match key. CITY stays: Richmond city and
+#Richmond County are different counties.
+DROPPED_SUFFIX = r'\s+(?:CITY AND BOROUGH|COUNTY|PARISH|BOROUGH|CENSUS AREA|MUNICIPALITY|MUNICIPIO)$'
+
+#abbreviated or misspelled names used by the CDC CKD prevalence source
+ALIASES = {
+    '11001': ['THE DISTRICT'],
+    '22033': ['E. BATON ROUGE'],
+    '22053': ['JEFFRSON DAVIS'],
+    '22095': ['ST. JOHN BAPTIST'],
+    '22121': ['W. BATON ROUGE'],
+    '27077': ['LAKE OF WOODS'],
+    '27173': ['YELLOW MEDCINE'],
+    '31157': ['SCOTT BLUFF'],
+    '42097': ['NORTHUMBERLND'],
+    '51133': ['NORTHUMBERLND'],
+    '51735': ['POQUOSON'],
+    '55078': ['MENOMONEE'],
+}
+
+COLUMNS = ['State', 'StateAbr', 'County', 'FIPS', 'FIPS3', 'Variant', 'Key']
+
+
+def _ascii_upper(names):
+    names = pd.Series(names, dtype=object).astype(str)
+    return names.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii').str.upper()
+
+
+def normalize_county(names):
+
+    """
+    Match keys of county names (vectorized): "St. Mary Parish",
+    "SAINT MARY" and "ST MARY" all give "STMARY"
+    """
+
+    names = _ascii_upper(names)
+    names = names.str.replace('&', ' AND ', regex=False).str.replace(r"[.'`]", '', regex=True)
+    names = names.str.replace(r'[-,/]', ' ', regex=True).str.replace(r'\s+', ' ', regex=True).str.strip()
+    names = names.str.replace(r'\bSAINTE\b', 'STE', regex=True).str.replace(r'\bSAINT\b', 'ST', regex=True)
+    names = names.str.replace(DROPPED_SUFFIX, '', regex=True)
+    return names.str.replace(' ', '', regex=False)
+
+
+def normalize_state(states):
+    #upper case state names, with two-letter abbreviations expanded
+    states = _ascii_upper(states).str.replace(r'\s+', ' ', regex=True).str.strip()
+    names = {abbr: name for name, abbr in STATES.values()}
+    return states.map(names).fillna(states)
+
+
+def fips_codes(fips):
+    #5-digit FIPS strings (or numbers) as int64, -1 where missing
+    return pd.to_numeric(pd.Series(fips, dtype=object).astype(str), errors='coerce').fillna(-1).astype('int64').to_numpy()
+
+
+def _geojson_names(geojson):
+    #official names with and without their legal suffix; the canonical
+    #name comes first: "AUTAUGA", "ACADIA PARISH", "RICHMOND CITY"
+    rows = []
+    for feature in geojson['features']:
+        p = feature['properties']
+        suffix = SUFFIXES.get(p.get('LSAD'), '')
+        name = str(p['NAME']).upper()
+        full = name + ' ' + suffix if suffix else name
+        if p.get('LSAD') == 'County':
+            rows += [(feature['id'], name, 'official'), (feature['id'], full, 'official')]
+        elif suffix == 'CITY':
+            rows.append((feature['id'], full, 'official'))
+        else:
+            rows += [(feature['id'], full, 'official'), (feature['id'], name, 'official')]
+    return pd.DataFrame(rows, columns=['FIPS', 'Variant', 'Source'])
+
+
+def sources():
+    #url -> local path of every input the crosswalk is built from (bundled only)
+    return {datasource.GEOJSON_COUNTIES_URL: datasource.GEOJSON_COUNTIES_PICKLE}
+
+
+def source_hashes():
+    return {url: datasource.content_hash(path) for url, path in sorted(sources().items())}
+
+
+def build():
+
+    """
+    The crosswalk table: one row per (county, spelling), with the
+    canonical State/StateAbr/County/FIPS/FIPS3 of the county. Keys that
+    would map to two counties of the same state are left out.
+    """
+
+    variants = [
+        _geojson_names(datasource.load_geojson_counties()),
+        pd.DataFrame(
+            [(fips, name, 'alias') for fips, names in ALIASES.items() for name in names],
+            columns=['FIPS', 'Variant', 'Source']),
+    ]
+    table = pd.concat(variants, ignore_index=True)
+    table['FIPS'] = table['FIPS'].astype(str).str.zfill(5)
+    table = table[table['FIPS'].str[:2].isin(list(STATES))]
+
+    #canonical county names, the spelling DataProcessed.parquet uses
+    official = table[table['Source'] == 'official'].drop_duplicates('FIPS')
+    canonical = dict(zip(official['FIPS'], official['Variant']))
+
+    table['State'] = table['FIPS'].str[:2].map(lambda s: STATES[s][0])
+    table['StateAbr'] = table['FIPS'].str[:2].map(lambda s: STATES[s][1])
+    table['County'] = table['FIPS'].map(canonical)
+    table['FIPS3'] = table['FIPS'].str[2:]
+    table['Key'] = normalize_county(table['Variant']).to_numpy()
+    table = table.drop_duplicates(['State', 'Key', 'FIPS'])
+
+    clashes = table.duplicated(['State', 'Key'], keep=False)
+    table = table[~clashes]
+    return table[COLUMNS].sort_values(['FIPS', 'Variant']).reset_index(drop=True)
+
+
+def write(table, path=CROSSWALK_PATH, hashes=None):
+    meta = {'version': VERSION, 'sources': hashes or source_hashes()}
+    arrow = pa.Table.from_pandas(table, preserve_index=False)
+    arrow = arrow.replace_schema_metadata(
+        dict(arrow.schema.metadata or {}, crosswalk=json.dumps(meta, sort_keys=True)))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.%d.tmp' % os.getpid()
+    pq.write_table(arrow, tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def read_meta(path=CROSSWALK_PATH):
+    try:
+        meta = pq.read_schema(path).metadata or {}
+        return json.loads(meta[b'crosswalk'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def is_fresh(path=CROSSWALK_PATH):
+    meta = read_meta(path)
+    return bool(meta) and meta.get('version') == VERSION and meta.get('sources') == source_hashes()
+
+
+class Crosswalk:
+
+    """
+    Lookups over a crosswalk table:
+
+        xw = crosswalk.load()
+        xw.lookup(['Louisiana'], ['St. Mary Parish'])   #array(['22101'])
+        ckd = xw.attach(ckd)                             #adds StateAbr, FIPS, FIPS3
+        dff = crosswalk.merge(ckd, unemp_df)             #joins on integer FIPS
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.counties = table.drop_duplicates('FIPS')[
+            ['State', 'StateAbr', 'County', 'FIPS', 'FIPS3']].reset_index(drop=True)
+        self.index = pd.Index(table['State'] + '|' + table['Key'])
+
+    def __len__(self):
+        return len(self.counties)
+
+    def positions(self, states, counties):
+        #row of the crosswalk table for each (state, county) name, -1 if unknown
+        keys = normalize_state(states).to_numpy() + '|' + normalize_county(counties).to_numpy()
+        return self.index.get_indexer(keys)
+
+    def lookup(self, states, counties):
+        #5-digit FIPS for each (state, county) name, None if unknown
+        pos = self.positions(states, counties)
+        fips = self.table['FIPS'].to_numpy(dtype=object)[pos]
+        fips[pos < 0] = None
+        return fips
+
+    def attach(self, frame, state='State', county='County', columns=('StateAbr', 'FIPS', 'FIPS3'), how='inner'):
+
+        """
+        ``frame`` with the crosswalk ``columns`` of its counties added.
+        how='inner' drops rows whose county is unknown, how='left'
+        keeps them with missing values.
+        """
+
+        pos = self.positions(frame[state], frame[county])
+        found = pos >= 0
+        out = frame.copy() if how == 'left' else frame[found].copy()
+        hits = pos if how == 'left' else pos[found]
+        for name in columns:
+            values = self.table[name].to_numpy(dtype=object)[hits]
+            if how == 'left':
+                values[~found] = None
+            out[name] = values
+        return out
+
+
+def merge(left, right, how='inner', on='FIPS', **kwargs):
+
+    """
+    pd.merge on a FIPS column, joining on integer codes so '1001',
+    '01001' and 1001 all meet. The FIPS column of ``left`` is kept.
+    """
+
+    key = '_fips_code'
+    left = left.assign(**{key: fips_codes(left[on])})
+    right = right.drop(columns=on).assign(**{key: fips_codes(right[on])})
+    right = right[right[key] >= 0]
+    return pd.merge(left, right, on=key, how=how, **kwargs).drop(columns=key)
+
+
+@functools.lru_cache(maxsize=None)
+def load(path=CROSSWALK_PATH):
+    #the compiled crosswalk, or one built in memory if it is missing or stale
+    if os.path.exists(path) and is_fresh(path):
+        return Crosswalk(pd.read_parquet(path))
+    return Crosswalk(build())
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if '--check' in argv:
+        fresh = is_fresh()
+        print('fresh' if fresh else 'stale')
+        return 0 if fresh else 1
+    table = build()
+    write(table)
+    print('%s: %d counties, %d match keys' % (CROSSWALK_PATH, table['FIPS'].nunique(), len(table)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
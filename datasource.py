@@ -0,0 +1,195 @@
+"""
+Local-first data sources for the dashboard.
+
+Every remote file the app and the ETL helpers read is resolved to a
+file on disk before pandas touches it:
+
+1. files that ship with the repo (data/, reports/) are used directly;
+2. anything else is downloaded once into a content-addressed cache
+   (``<cache>/<sha256>.<ext>``), with a small JSON index mapping each
+   URL to the hash of the last copy fetched. Updates of the index hold
+   an exclusive lock on ``index.json.lock``, so concurrent workers and
+   fetcher threads never lose each other's entries.
+
+Cold start therefore needs no network as long as the bundled copies
+are present. Set CKD_CACHE_DIR to move the cache, and CKD_OFFLINE=1 to
+fail fast instead of attempting a download.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.request import urlopen
+
+try:
+    import fcntl
+except ImportError:     #Windows: only threads of this process are serialized
+    fcntl = None
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get('CKD_CACHE_DIR', os.path.join(ROOT, '.cache', 'sources'))
+OFFLINE = os.environ.get('CKD_OFFLINE', '0') == '1'
+
+REPO_RAW = 'https://github.com/nmmarcelnv/cmsdatajam/blob/main/'
+
+#remote sources used across the project
+DATA_PROCESSED_URL = REPO_RAW + 'data/DataProcessed.parquet?raw=true'
+CHARTS_URL = REPO_RAW + 'reports/charts.xlsx?raw=true'
+CKD_PREVALENCE_URL = REPO_RAW + 'data/Prevalence_of_CKD_by_US_State_and_County_by_County_2019.parquet?raw=true'
+GEOJSON_COUNTIES_URL = 'https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json'
+FIPS2COUNTY_URL = 'https://raw.githubusercontent.com/ChuckConnell/articles/master/fips2county.tsv'
+UNEMPLOYMENT_URL = 'https://raw.githubusercontent.com/plotly/datasets/master/fips-unemp-16.csv'
+FOOD_ATLAS_URL = 'https://www.ers.usda.gov/webdocs/DataFiles/80591/FoodAccessResearchAtlasData2019.xlsx?v=9165.3'
+
+#copies of the remote sources that are committed to this repo
+BUNDLED = {
+    DATA_PROCESSED_URL: os.path.join(ROOT, 'data', 'DataProcessed.parquet'),
+    CHARTS_URL: os.path.join(ROOT, 'reports', 'charts.xlsx'),
+    CKD_PREVALENCE_URL: os.path.join(
+        ROOT, 'data', 'Prevalence_of_CKD_by_US_State_and_County_by_County_2019.parquet'),
+}
+GEOJSON_COUNTIES_PICKLE = os.path.join(ROOT, 'data', 'geojson_counties.pickle')
+
+
+def _index_path():
+    return os.path.join(CACHE_DIR, 'index.json')
+
+
+def _read_index():
+    try:
+        with open(_index_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+_index_lock = threading.Lock()
+
+
+@contextmanager
+def _locked_index():
+    #exclusive lock for a read-modify-write of the index, across threads and processes
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with _index_lock, open(_index_path() + '.lock', 'a') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_index(index):
+    _atomic_write(_index_path(), json.dumps(index, indent=1, sort_keys=True).encode())
+
+
+def _atomic_write(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _extension(url):
+    name = url.split('?')[0].rsplit('/', 1)[-1]
+    return os.path.splitext(name)[1] or '.bin'
+
+
+def content_hash(path, chunk_size=1 << 20):
+    """sha256 of a file on disk, read in chunks"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def index_entry(url):
+    """Index entry of the last download of ``url`` (sha256, size, validators...), or None"""
+    return _read_index().get(url)
+
+
+def cached_path(url):
+    """
+    Return the cache path of the last download of ``url``,
+    or None if it has never been fetched
+    """
+    entry = index_entry(url)
+    if entry is None:
+        return None
+    path = os.path.join(CACHE_DIR, entry['sha256'] + _extension(url))
+    return path if os.path.exists(path) else None
+
+
+def store(url, payload, **meta):
+    """
+    Write ``payload`` (bytes) into the content-addressed cache and
+    point ``url`` at it. Extra keyword arguments are kept in the index
+    entry (e.g. HTTP validators). Returns the cache path.
+    """
+    digest = hashlib.sha256(payload).hexdigest()
+    path = os.path.join(CACHE_DIR, digest + _extension(url))
+    if not os.path.exists(path):
+        _atomic_write(path, payload)
+    with _locked_index():
+        index = _read_index()
+        index[url] = dict(meta, sha256=digest, size=len(payload))
+        _write_index(index)
+    return path
+
+
+def fetch(url, refresh=False):
+    """
+    Resolve ``url`` to a local file path.
+
+    Bundled copies win over everything, then the content-addressed
+    cache, and only then the network.
+    """
+    if not refresh:
+        bundled = BUNDLED.get(url)
+        if bundled and os.path.exists(bundled):
+            return bundled
+        path = cached_path(url)
+        if path:
+            return path
+    if OFFLINE:
+        raise FileNotFoundError('no local copy of %s and CKD_OFFLINE=1' % url)
+    with urlopen(url) as response:
+        payload = response.read()
+    return store(url, payload)
+
+
+def read_parquet(url, **kwargs):
+    return pd.read_parquet(fetch(url), **kwargs)
+
+
+def read_excel(url, **kwargs):
+    return pd.read_excel(fetch(url), **kwargs)
+
+
+def read_csv(url, **kwargs):
+    return pd.read_csv(fetch(url), **kwargs)
+
+
+def load_geojson_counties():
+    """
+    County polygons keyed by 5-digit FIPS. The pickled copy in data/
+    loads in a few milliseconds, far faster than parsing the JSON.
+    """
+    if os.path.exists(GEOJSON_COUNTIES_PICKLE):
+        with open(GEOJSON_COUNTIES_PICKLE, 'rb') as f:
+            return pickle.load(f)
+    with open(fetch(GEOJSON_COUNTIES_URL)) as f:
+        return json.load(f)
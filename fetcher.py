@@ -0,0 +1,229 @@
+"""
+Concurrent refresh of the remote sources behind the ETL.
+
+datasource.fetch() downloads a missing source with one blocking
+urlopen() call. Refreshing all of them that way means a fresh
+connection per file, one file at a time, no retries, and every
+multi-megabyte file downloaded again whether it changed or not.
+refresh() instead:
+
+- runs the downloads concurrently on asyncio, at most CONCURRENCY at a
+  time, each blocking http.client request in a worker thread;
+- keeps idle keep-alive connections in a per-host pool (GitHub's
+  ?raw=true links redirect to raw.githubusercontent.com, so several
+  sources share a host);
+- retries connection errors, 429 and 5xx responses with exponential
+  backoff;
+- sends If-None-Match / If-Modified-Since from the validators of the
+  last download, so an unchanged source costs one 304 and no body;
+- writes new bodies atomically into the content-addressed cache via
+  datasource.store(), with the new validators.
+
+    python fetcher.py               # refresh every remote source
+    python fetcher.py URL [URL...]  # refresh some
+
+CKD_FETCH_CONCURRENCY, CKD_FETCH_RETRIES and CKD_FETCH_TIMEOUT override
+the defaults. Any http:// or https:// URL works, so a local stand-in
+server can replace the real hosts.
+"""
+import asyncio
+import http.client
+import os
+import sys
+import threading
+import time
+from email.utils import formatdate
+from urllib.parse import urljoin, urlsplit
+
+import datasource
+
+CONCURRENCY = int(os.environ.get('CKD_FETCH_CONCURRENCY', '4'))
+RETRIES = int(os.environ.get('CKD_FETCH_RETRIES', '3'))
+TIMEOUT = float(os.environ.get('CKD_FETCH_TIMEOUT', '60'))
+BACKOFF = 0.5           #seconds before the first retry, doubled each time
+MAX_REDIRECTS = 5
+USER_AGENT = 'cmsdatajam-etl'
+
+#remote sources refreshed by default (those with a bundled copy in the repo
+#are never read from the cache, see datasource.fetch)
+SOURCES = [
+    datasource.UNEMPLOYMENT_URL,
+    datasource.FOOD_ATLAS_URL,
+    datasource.GEOJSON_COUNTIES_URL,
+]
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    pass
+
+
+class ConnectionPool:
+
+    """
+    Idle HTTP(S) connections by (scheme, host, port). A connection is
+    checked out for one request and given back when its response has
+    been read, so it is reused by the next request to the same host.
+    """
+
+    def __init__(self, per_host=CONCURRENCY, timeout=TIMEOUT):
+        self.per_host = per_host
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def get(self, scheme, host, port):
+        with self._lock:
+            idle = self._idle.get((scheme, host, port))
+            if idle:
+                return idle.pop()
+            self.created += 1
+        cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return cls(host, port, timeout=self.timeout)
+
+    def put(self, scheme, host, port, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host, port), [])
+            if len(idle) < self.per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+
+def _request(pool, url, headers):
+    #one GET on a pooled connection: (status, headers, body)
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    conn = pool.get(parts.scheme, parts.hostname, port)
+    try:
+        conn.request('GET', path, headers=dict(headers, **{'User-Agent': USER_AGENT}))
+        response = conn.getresponse()
+        body = response.read()
+    except Exception:
+        conn.close()
+        raise
+    if response.will_close:
+        conn.close()
+    else:
+        pool.put(parts.scheme, parts.hostname, port, conn)
+    return response.status, response.headers, body
+
+
+def _validators(url):
+    #conditional request headers from the last download of url
+    entry = datasource.index_entry(url)
+    if not entry or datasource.cached_path(url) is None:
+        return {}
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def get(pool, url, headers, retries=RETRIES):
+
+    """
+    GET url, following redirects and retrying transient failures.
+    Returns (status, headers, body) of the final response.
+    """
+
+    target = url
+    redirects = 0
+    attempt = 0
+    while True:
+        try:
+            status, response_headers, body = _request(pool, target, headers)
+        except (OSError, http.client.HTTPException) as error:
+            if attempt >= retries:
+                raise FetchError('%s: %s' % (url, error)) from error
+            time.sleep(BACKOFF * 2 ** attempt)
+            attempt += 1
+            continue
+        if status in (301, 302, 303, 307, 308) and response_headers.get('Location'):
+            redirects += 1
+            if redirects > MAX_REDIRECTS:
+                raise FetchError('%s: too many redirects' % url)
+            target = urljoin(target, response_headers['Location'])
+            continue
+        if status in RETRY_STATUS and attempt < retries:
+            time.sleep(BACKOFF * 2 ** attempt)
+            attempt += 1
+            continue
+        return status, response_headers, body
+
+
+async def _refresh_one(pool, semaphore, url, retries):
+    async with semaphore:
+        status, headers, body = await asyncio.to_thread(get, pool, url, _validators(url), retries)
+    if status == 304:
+        return url, datasource.cached_path(url), 'not modified'
+    if status != 200:
+        raise FetchError('%s: HTTP %d' % (url, status))
+    #store() runs on the event loop thread, so index updates never race
+    path = datasource.store(
+        url, body,
+        etag=headers.get('ETag'),
+        last_modified=headers.get('Last-Modified'),
+        fetched=formatdate(usegmt=True),
+    )
+    return url, path, 'downloaded'
+
+
+async def refresh_async(urls, concurrency=CONCURRENCY, retries=RETRIES):
+
+    """
+    Refresh ``urls`` concurrently; returns {url: (path, status)} where
+    status is 'downloaded', 'not modified' or the error. One failing
+    source does not stop the others.
+    """
+
+    pool = ConnectionPool(per_host=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        results = await asyncio.gather(
+            *[_refresh_one(pool, semaphore, url, retries) for url in urls],
+            return_exceptions=True)
+    finally:
+        pool.close()
+    report = {}
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            report[url] = (datasource.cached_path(url), 'error: %s' % result)
+        else:
+            report[url] = (result[1], result[2])
+    return report
+
+
+def refresh(urls=None, concurrency=CONCURRENCY, retries=RETRIES):
+    if datasource.OFFLINE:
+        raise FetchError('refusing to fetch with CKD_OFFLINE=1')
+    urls = list(dict.fromkeys(SOURCES if urls is None else urls))
+    return asyncio.run(refresh_async(urls, concurrency, retries))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    started = time.time()
+    report = refresh(argv or None)
+    for url, (path, status) in report.items():
+        print('%-14s %s\n               -> %s' % (status, url, path))
+    print('%d sources in %.1fs' % (len(report), time.time() - started))
+    return 1 if any(status.startswith('error') for _, status in report.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Server-side cache of built figures for the choropleth callbacks.
+
+Building a county choropleth with plotly express and encoding it to
+JSON takes seconds, mostly spent on the embedded GeoJSON. Entries are
+stored as plain JSON-compatible dicts (what Dash would send anyway),
+keyed on the callback name, its normalized inputs and a data version
+stamp, so a repeat view skips figure construction and Dash only has
+to encode plain lists.
+
+The GeoJSON is not copied into each entry: freeze() swaps it for the
+one shared object passed by the caller, so entries stay small.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import tracing
+
+
+def normalize(value):
+    """Turn callback inputs into hashable, canonical key parts"""
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(v) for v in value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+
+def freeze(fig, geojson=None):
+    """
+    Figure -> plain dict; dicts (e.g. map_data payloads) pass through.
+    If ``geojson`` is given, traces carrying a GeoJSON are encoded
+    without it and then point at ``geojson`` itself, which skips
+    encoding the geometry and keeps one copy in memory however many
+    figures are cached.
+    """
+    if isinstance(fig, dict):
+        return fig
+    stripped = []
+    if geojson is not None:
+        for i, trace in enumerate(fig.data):
+            if getattr(trace, 'geojson', None) is not None:
+                trace.geojson = None
+                stripped.append(i)
+    with tracing.span('serialize'):
+        frozen = json.loads(fig.to_json())
+    for i in stripped:
+        frozen['data'][i]['geojson'] = geojson
+    return frozen
+
+
+class FigureCache:
+
+    """
+    Thread-safe LRU of frozen figures.
+
+    figures = FigureCache(maxsize=64, version=tables.data_version(df))
+    fig = figures.get_or_build(('update_map', year, ...), build, geojson=geojson_counties)
+    """
+
+    def __init__(self, maxsize=64, version=''):
+        self.maxsize = maxsize
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, name, *inputs):
+        return (name, self.version) + normalize(inputs)
+
+    def get(self, key):
+        with self._lock:
+            fig = self._entries.get(key)
+            if fig is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return fig
+
+    def put(self, key, fig):
+        with self._lock:
+            self._entries[key] = fig
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_build(self, key, build, geojson=None):
+        fig = self.get(key)
+        tracing.tag('figure_cache', 'miss' if fig is None else 'hit')
+        if fig is None:
+            fig = freeze(build(), geojson)
+            self.put(key, fig)
+        return fig
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
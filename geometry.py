@@ -0,0 +1,133 @@
+"""
+Simplified county geometry for the choropleths.
+
+Every choropleth embeds the county GeoJSON, so its size is most of each
+figure payload. This stage simplifies the polygons with shapely at a
+few tolerance levels while keeping shared borders shared: the county
+boundaries are noded into one set of lines, each border line between
+two junctions is simplified once, and the counties are re-assembled by
+polygonizing the simplified lines. Neighbouring counties therefore
+never gain gaps or overlaps, whatever the tolerance.
+
+    python geometry.py      # write data/compiled/geojson_counties_<level>.pickle
+
+CKD_GEOMETRY_LEVEL picks the level the app uses ('full' is the
+original plotly geometry).
+"""
+import os
+import pickle
+import sys
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape
+from shapely.ops import linemerge, unary_union
+
+import datasource
+
+GEOMETRY_DIR = os.path.join(datasource.ROOT, 'data', 'compiled')
+
+#level -> simplification tolerance in degrees (0.01 deg is roughly 1 km)
+LEVELS = {
+    'full': 0,
+    'high': 0.005,
+    'medium': 0.01,
+    'low': 0.025,
+}
+DEFAULT_LEVEL = os.environ.get('CKD_GEOMETRY_LEVEL', 'medium')
+PRECISION = 4   #decimal places kept in the coordinates (~10 m)
+
+
+def _round(geom):
+    return shapely.transform(geom, lambda coords: np.round(coords, PRECISION))
+
+
+def simplify_counties(geojson, tolerance):
+
+    """
+    Return a copy of a county FeatureCollection simplified with the
+    given tolerance, preserving the topology of shared borders.
+    """
+
+    features = geojson['features']
+    geoms = shapely.make_valid(np.array([shape(f['geometry']) for f in features]))
+
+    #one line per border segment between junctions, simplified once and
+    #noded again so lines that now cross still split into faces
+    borders = linemerge(unary_union(shapely.boundary(geoms)))
+    borders = shapely.simplify(shapely.get_parts(borders), tolerance, preserve_topology=True)
+    faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(unary_union(borders))))
+
+    #give every face to the county it overlaps most
+    tree = shapely.STRtree(geoms)
+    face_idx, county_idx = tree.query(faces, predicate='intersects')
+    overlap = shapely.area(shapely.intersection(faces[face_idx], geoms[county_idx]))
+    owner = np.full(len(faces), -1)
+    best = np.zeros(len(faces))
+    for f, c, a in zip(face_idx, county_idx, overlap):
+        if a > best[f]:
+            owner[f], best[f] = c, a
+
+    simplified = []
+    for i, feature in enumerate(features):
+        parts = faces[owner == i]
+        geom = unary_union(parts) if len(parts) else None
+        if geom is None or geom.area < 0.9 * geoms[i].area:
+            #county (or island parts of it) lost in the shared linework:
+            #simplify it on its own instead
+            geom = shapely.simplify(geoms[i], tolerance, preserve_topology=True)
+        #plotly matches on the feature id, the census properties are dead weight
+        simplified.append(dict(
+            feature, properties={}, geometry=mapping(shapely.make_valid(_round(geom)))))
+    return dict(geojson, features=simplified)
+
+
+def level_path(level, directory=GEOMETRY_DIR):
+    return os.path.join(directory, 'geojson_counties_%s.pickle' % level)
+
+
+def prepare(levels=LEVELS, directory=GEOMETRY_DIR):
+    """Write every simplification level next to the compiled assets"""
+    source = datasource.load_geojson_counties()
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for level, tolerance in levels.items():
+        if not tolerance:
+            continue
+        with open(level_path(level, directory), 'wb') as f:
+            pickle.dump(simplify_counties(source, tolerance), f, protocol=pickle.HIGHEST_PROTOCOL)
+        paths[level] = level_path(level, directory)
+    return paths
+
+
+def load_counties(level=DEFAULT_LEVEL):
+    """
+    County GeoJSON at the given level, from the prepared file if there
+    is one, otherwise simplified on the fly
+    """
+    if level not in LEVELS:
+        raise ValueError('unknown geometry level %r, expected one of %s' % (level, list(LEVELS)))
+    if not LEVELS[level]:
+        return datasource.load_geojson_counties()
+    path = level_path(level)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    return simplify_counties(datasource.load_geojson_counties(), LEVELS[level])
+
+
+def main():
+    import json
+    def size(geojson):
+        return len(json.dumps(geojson, separators=(',', ':')))
+    full = size(datasource.load_geojson_counties())
+    print('%-8s %9d bytes' % ('full', full))
+    for level, path in prepare().items():
+        with open(path, 'rb') as f:
+            nbytes = size(pickle.load(f))
+        print('%-8s %9d bytes (%.0f%%) -> %s' % (level, nbytes, 100 * nbytes / full, path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
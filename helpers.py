@@ -1,81 +1,33 @@
 import pandas as pd
 import numpy as np
+import atlas
+import aggregation
+import crosswalk
 
 def prepare_modeling_data():
 
-    dtypes = {
-        'StateFIPS':str,
-        'CountyFIPS_3':str,
-        'CountyName':str,
-        'StateName':str,
-        'CountyFIPS':str,
-        'StateAbbr':str,
-        'STATE_COUNTY':str
-    }
-    
-    #original source : https://nccd.cdc.gov/ckd/detail.aspx?Qnum=Q705&Strat=County&Year=2018#refreshPosition
-    ckd = pd.read_parquet('https://github.com/nmmarcelnv/cmsdatajam/blob/main/data/Prevalence_of_CKD_by_US_State_and_County_by_County_2019.parquet?raw=true')
-    ckd.columns = ['CkdRate','County','State','Year']
-    ckd = ckd[['County','State','Year','CkdRate']]
-    ckd['County'] = ckd['County'].str.upper()
-    ckd['State'] = ckd['State'].str.upper()
-    
-    #https://towardsdatascience.com/the-ultimate-state-county-fips-tool-1e4c54dc9dff
-    
-    fips = pd.read_csv(
-        'https://raw.githubusercontent.com/ChuckConnell/articles/master/fips2county.tsv', 
-        sep='\t', 
-        usecols=['CountyName','StateName','CountyFIPS','StateAbbr'],
-        dtype=dtypes
-    )
-    fips.columns=['County','State','FIPS', 'StateAbr']
-    fips = fips[['State','StateAbr','County','FIPS']]
-    fips['County'] = fips['County'].str.upper()
-    fips['State'] = fips['State'].str.upper()
-
+    """
+    County x year modelling data (the DataProcessed.parquet frame):
+    CKD prevalence, unemployment and food access by FIPS. Built by the
+    incremental ETL in pipeline.py, which only recomputes the stages
+    whose sources changed.
+    """
 
-    unemp_df = pd.read_csv("https://raw.githubusercontent.com/plotly/datasets/master/fips-unemp-16.csv",dtype={"fips": str})
-    unemp_df['unemp'] = (unemp_df['unemp']/unemp_df['unemp'].max()) *(100)
-    unemp_df = unemp_df.rename(columns={'fips':'FIPS', 'unemp':'unEmpRate'})
-    
+    import pipeline
+    return pipeline.dataset()
 
 
 def get_povertyrate_by_county():
     
-    data_atlas_link = 'https://www.ers.usda.gov/webdocs/DataFiles/80591/FoodAccessResearchAtlasData2019.xlsx?v=9165.3'
     usecols = ['State','County','LILATracts_Vehicle', 'HUNVFlag', 'LowIncomeTracts', 'PovertyRate', 'MedianFamilyIncome']
-    dfatlas = pd.read_excel(data_atlas_link,sheet_name='Food Access Research Atlas', usecols=usecols)
-
-    dfatlas['State'] = dfatlas['State'].str.upper()
-    dfatlas['County'] = dfatlas['County'].apply(lambda x: x.upper().replace(' COUNTY','').strip())
-
-    dtypes = {
-        'StateFIPS':str, 
-        'CountyFIPS_3':str, 
-        'CountyName':str, 
-        'StateName':str, 
-        'CountyFIPS':str,
-        'StateAbbr':str, 
-        'STATE_COUNTY':str
-    }
-
-    fips = pd.read_csv(
-        'https://raw.githubusercontent.com/ChuckConnell/articles/master/fips2county.tsv',
-        sep='\t', 
-        usecols=['CountyName','StateName','CountyFIPS','StateAbbr'],              
-        dtype=dtypes
-    )
-
-    fips.columns=['County','State','FIPS', 'State3']
-    fips = fips[['State','County','FIPS', 'State3']]
-    fips['State'] = fips['State'].str.upper()
-    fips['County'] = fips['County'].str.upper()
-
-    dff = pd.merge(
-        dfatlas,
-        fips.drop_duplicates(),
-        on=['State', 'County'],
-    )
+    #streamed into partitioned parquet with normalized names (see atlas.py)
+    dfatlas = atlas.read_atlas(columns=['CensusTract'] + usecols)
+
+    #county FIPS are the first five digits of the tract code
+    dfatlas['FIPS'] = dfatlas['CensusTract'].str[:5]
+    states = crosswalk.load().counties[['FIPS','StateAbr']].rename(columns={'StateAbr':'State3'})
+
+    dff = crosswalk.merge(dfatlas[usecols + ['FIPS']], states)
     #save as dff.to_parquet('../data/FoodAccessResearchAtlasData2019.parquet')
     
     return dff
@@ -94,6 +46,58 @@ def model(ckd_rate,unemp_rate,laseniors10,lalowi10,lasnap10,x1=0,x2=0,x3=0):
     future_ckd = (x1+0.4)*laseniors10 + 0.80*ckd_rate + 0.2*unemp_rate + x2*0.2*lalowi10 - x3*0.2*lasnap10
     return future_ckd
 
+PREDICTION_KEYS = ['State','StateAbr','County','FIPS','FIPS3','Year']
+PREDICTION_FEATURES = ['CkdRate','unEmpRate','laseniors10','lalowi10','lasnap10']
+
+
+class PredictionEngine:
+    
+    """
+    Batch version of make_predictions. The group averaging is done once
+    when the engine is built and the model inputs are kept as NumPy
+    arrays, so a prediction for every county is a single vectorized
+    evaluation of model() instead of a row-wise apply.
+    
+    engine = PredictionEngine(df[df.Year>2015])
+    rates = engine.predict(0.1, 0, 2)        #ndarray, one value per county
+    data = engine.make_predictions(0.1, 0, 2) #same frame as make_predictions
+    
+    The averaging goes through an aggregation.Membership of the rows,
+    kept as .membership, optionally weighted by a column of test_df
+    (e.g. weight='Pop2010').
+    """
+    
+    def __init__(self, test_df, weight=None):
+        
+        self.membership = aggregation.Membership(
+            test_df[PREDICTION_KEYS], weights=None if weight is None else test_df[weight])
+        metrics = [
+            c for c in test_df.select_dtypes('number').columns if c not in PREDICTION_KEYS]
+        self.frame = self.membership.aggregate(test_df, means=metrics)
+        self.features = {
+            name: self.frame[name].to_numpy(dtype='float64') for name in PREDICTION_FEATURES
+        }
+        
+    def __len__(self):
+        return len(self.frame)
+    
+    def predict(self, x1=0,x2=0,x3=0):
+        f = self.features
+        return model(
+            f['CkdRate'],f['unEmpRate'],f['laseniors10'],f['lalowi10'],f['lasnap10'],x1,x2,x3)
+    
+    def make_predictions(self, x1=0,x2=0,x3=0, rates=None):
+        
+        """
+        Return a copy of the group-averaged frame with CkdRate replaced
+        by the predicted rates (computed here unless given)
+        """
+        
+        data = self.frame.copy()
+        data['CkdRate'] = self.predict(x1,x2,x3) if rates is None else rates
+        return data
+
+
 def make_predictions(test_df, x1=0,x2=0,x3=0):
     
     """
@@ -103,22 +107,13 @@ def make_predictions(test_df, x1=0,x2=0,x3=0):
     
     Note that predictions are more accurate when projections 
     are not too far into the future
-    """
     
+    Callers that predict repeatedly on the same data should build a
+    PredictionEngine once and reuse it.
+    """
     
     #test_df['Year'] = year
-    test_df = test_df.groupby(
-        ['State','StateAbr','County','FIPS','FIPS3','Year']
-    ).mean().reset_index()
-    test_df['CkdRate'] = test_df.apply(
-        lambda row: model(
-            row['CkdRate'],row['unEmpRate'],row['laseniors10'],row['lalowi10'],row['lasnap10'],x1,x2,x3), 
-        axis=1
-    )
-    
-    #0.80*test_df['CkdRate'] + 0.20*test_df['unEmpRate']
-    
-    return test_df
+    return PredictionEngine(test_df).make_predictions(x1,x2,x3)
 
 def combine_datasets(train, test):
     
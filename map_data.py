@@ -0,0 +1,79 @@
+"""
+Data-only updates for the county choropleths.
+
+The full figure, GeoJSON included, is sent once with the page layout.
+After that the map callbacks only return a small payload (FIPS codes,
+values and labels) into a dcc.Store, and the clientside function
+ckd.apply_map_data (assets/clientside.js) writes it into the figure
+already held by the browser. The colour range sliders feed that
+clientside function directly and never cause a server round trip. State and County for the hover
+labels come from a county-names store that is also sent only once.
+
+choropleth() builds the full figure, for the layout and for full figure
+responses; it has no Dash dependency, so benchmark.py times the same code.
+
+Set CKD_DATA_ONLY_UPDATES=0 to go back to full figure responses.
+"""
+import os
+
+import numpy as np
+import plotly.express as px
+
+ENABLED = os.environ.get('CKD_DATA_ONLY_UPDATES', '1') == '1'
+
+#axis labels of the choropleths, and of their data-only updates
+LABELS = {'CkdRate':'CKD Prevalence (%)'}
+DECIMALS = 4
+
+
+def store_id(graph_id):
+    return graph_id + '-data'
+
+
+def county_names(df):
+    """{FIPS: [State, County]} for the hover labels"""
+    names = df[['FIPS','State','County']].astype(str).drop_duplicates('FIPS')
+    return {fips: [state, county] for fips, state, county in names.itertuples(index=False)}
+
+
+def choropleth(data, geojson, color, range_color, title=None):
+    """County choropleth of ``color``, as the app's maps draw it"""
+    return px.choropleth(
+        data, 
+        geojson=geojson,
+        locations="FIPS", 
+        color=color,
+        scope='usa',
+        color_continuous_scale='YlOrRd',
+        range_color=range_color,
+        hover_data = {'State':True, 'County':True},
+        labels=LABELS,
+        title=title,
+    )
+
+
+def hovertemplate(label):
+    #matches what px.choropleth builds for hover_data={'State':True, 'County':True}
+    return (
+        'FIPS=%{location}<br>State=%{customdata[0]}<br>County=%{customdata[1]}<br>'
+        + label + '=%{z}<extra></extra>'
+    )
+
+
+def payload(data, color, title=None):
+    """
+    The part of a choropleth that changes between callbacks. Where a
+    county appears more than once (the 2024 projections keep one row
+    per base year) only the last row is sent: it is the one drawn on
+    top anyway.
+    """
+    data = data.drop_duplicates('FIPS', keep='last')
+    label = LABELS.get(color, color)
+    z = np.round(data[color].to_numpy(dtype='float64'), DECIMALS)
+    return {
+        'locations': data['FIPS'].astype(str).tolist(),
+        'z': z.tolist(),
+        'label': label,
+        'hovertemplate': hovertemplate(label),
+        'title': title,
+    }
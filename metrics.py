@@ -0,0 +1,242 @@
+"""
+Prometheus metrics for the Dash callbacks.
+
+instrument(app) wraps every server-side callback registered on the app
+(the entries of app.callback_map, i.e. what _dash-update-component
+dispatches to) and records, per callback function:
+
+    ckd_callback_duration_seconds   histogram of the time spent in the callback,
+                                    including the JSON encoding of its response
+    ckd_callback_response_bytes     histogram of the encoded response size,
+                                    before compression
+    ckd_callback_calls_total        calls by outcome: ok, error, or prevented
+                                    (PreventUpdate, not an error)
+
+register_cache() adds the hit and miss counts of any cache with .hits
+and .misses (FigureCache, PredictionCache, ScenarioGrid):
+
+    ckd_cache_hits_total, ckd_cache_misses_total, ckd_cache_hit_ratio
+
+and configure(server) serves all of it in the Prometheus text format
+on /metrics. Counters live in the worker process: with several gunicorn
+workers each scrape sees the worker that answered, hence the pid label
+on ckd_process_start_time_seconds.
+
+    CKD_METRICS=0           turn it off
+    CKD_METRICS_ROUTE       where to serve them (/metrics)
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+import flask
+from dash.exceptions import PreventUpdate
+
+ENABLED = os.environ.get('CKD_METRICS', '1') == '1'
+ROUTE = os.environ.get('CKD_METRICS_ROUTE', '/metrics')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#seconds; the choropleth callbacks take seconds on a cold figure cache
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+#bytes; a map with its GeoJSON is a few MB, a map_data payload tens of kB
+PAYLOAD_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20)
+OUTCOMES = ('ok', 'error', 'prevented')
+
+
+class Histogram:
+
+    """Bucket counts (not cumulative), sum and count of the observed values"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        #the first bucket whose upper bound is >= value; the last one is +Inf
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        #(le, cumulative count) in exposition order
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield _number(bound), total
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (k, escape(v)) for k, v in labels.items())
+
+
+class Registry:
+
+    """
+    Callback and cache metrics of one process.
+
+    registry.observe('update_map', 0.42, 1835022)
+    registry.register_cache('figures', figures)
+    text = registry.render()
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.callbacks = {}
+        self.caches = {}
+        self._lock = threading.Lock()
+
+    def _callback(self, name):
+        if name not in self.callbacks:
+            self.callbacks[name] = {
+                'latency': Histogram(LATENCY_BUCKETS),
+                'payload': Histogram(PAYLOAD_BUCKETS),
+                'calls': dict.fromkeys(OUTCOMES, 0),
+            }
+        return self.callbacks[name]
+
+    def track(self, name):
+        #report ``name`` with zero counts until its first call
+        with self._lock:
+            self._callback(name)
+
+    def observe(self, name, seconds, size=None, outcome='ok'):
+        with self._lock:
+            entry = self._callback(name)
+            entry['latency'].observe(seconds)
+            if size is not None:
+                entry['payload'].observe(size)
+            entry['calls'][outcome] += 1
+
+    def register_cache(self, name, cache):
+        self.caches[name] = cache
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        def histogram(name, key):
+            for callback, entry in callbacks:
+                hist = entry[key]
+                for le, count in hist.samples():
+                    lines.append('%s_bucket%s %d' % (name, _labels(callback=callback, le=le), count))
+                lines.append('%s_sum%s %s' % (name, _labels(callback=callback), _number(hist.sum)))
+                lines.append('%s_count%s %d' % (name, _labels(callback=callback), hist.count))
+
+        with self._lock:
+            callbacks = sorted(
+                (name, {
+                    'latency': _copy(entry['latency']),
+                    'payload': _copy(entry['payload']),
+                    'calls': dict(entry['calls']),
+                })
+                for name, entry in self.callbacks.items())
+
+        family('ckd_callback_duration_seconds', 'histogram',
+               'Time spent in a Dash callback, including encoding its response.')
+        histogram('ckd_callback_duration_seconds', 'latency')
+        family('ckd_callback_response_bytes', 'histogram',
+               'Size of the encoded callback response, before compression.')
+        histogram('ckd_callback_response_bytes', 'payload')
+        family('ckd_callback_calls_total', 'counter', 'Callback calls by outcome.')
+        for callback, entry in callbacks:
+            for outcome, count in entry['calls'].items():
+                lines.append('ckd_callback_calls_total%s %d' % (
+                    _labels(callback=callback, outcome=outcome), count))
+
+        caches = sorted((name, cache.hits, cache.misses) for name, cache in self.caches.items())
+        family('ckd_cache_hits_total', 'counter', 'Cache lookups that found an entry.')
+        for name, hits, _ in caches:
+            lines.append('ckd_cache_hits_total%s %d' % (_labels(cache=name), hits))
+        family('ckd_cache_misses_total', 'counter', 'Cache lookups that had to compute the entry.')
+        for name, _, misses in caches:
+            lines.append('ckd_cache_misses_total%s %d' % (_labels(cache=name), misses))
+        family('ckd_cache_hit_ratio', 'gauge', 'Hits over lookups since the worker started.')
+        for name, hits, misses in caches:
+            ratio = hits / (hits + misses) if hits + misses else 0.0
+            lines.append('ckd_cache_hit_ratio%s %s' % (_labels(cache=name), _number(ratio)))
+
+        family('ckd_process_start_time_seconds', 'gauge', 'Start time of the worker, in unix seconds.')
+        lines.append('ckd_process_start_time_seconds%s %s' % (
+            _labels(pid=os.getpid()), _number(self.started)))
+        return '\n'.join(lines) + '\n'
+
+
+def _copy(hist):
+    copy = Histogram(hist.buckets)
+    copy.counts = list(hist.counts)
+    copy.sum = hist.sum
+    copy.count = hist.count
+    return copy
+
+
+REGISTRY = Registry()
+
+
+def _timed(name, func, registry):
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = func(*args, **kwargs)
+        except PreventUpdate:
+            registry.observe(name, time.perf_counter() - started, outcome='prevented')
+            raise
+        except Exception:
+            registry.observe(name, time.perf_counter() - started, outcome='error')
+            raise
+        #dispatch gets the encoded JSON response, so this is what goes on the wire
+        size = len(response.encode('utf-8')) if isinstance(response, str) else len(response)
+        registry.observe(name, time.perf_counter() - started, size)
+        return response
+    timed.__name__ = func.__name__
+    timed.__wrapped__ = func
+    timed.instrumented = True
+    return timed
+
+
+def instrument(app, registry=REGISTRY):
+
+    """
+    Time every server-side callback registered on ``app`` so far. Call
+    it after the last app.callback(); calling it again only wraps the
+    callbacks added since.
+    """
+
+    if not ENABLED:
+        return registry
+    for entry in app.callback_map.values():
+        func = entry.get('callback')
+        if func is None or getattr(func, 'instrumented', False):
+            continue
+        registry.track(func.__name__)
+        entry['callback'] = _timed(func.__name__, func, registry)
+    return registry
+
+
+def register_cache(name, cache, registry=REGISTRY):
+    registry.register_cache(name, cache)
+
+
+def configure(server, registry=REGISTRY, route=ROUTE):
+    #serve the registry on ``route`` of a Flask server
+    if not ENABLED:
+        return None
+
+    def metrics():
+        return flask.Response(registry.render(), content_type=CONTENT_TYPE)
+
+    server.add_url_rule(route, 'ckd_metrics', metrics)
+    return registry
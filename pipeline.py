@@ -0,0 +1,271 @@
+"""
+Incremental ETL that rebuilds data/DataProcessed.parquet.
+
+Declared stages, each with the remote sources and upstream stages it
+reads:
+
+    ckd           CDC CKD prevalence by county and year
+    fips          ckd + StateAbr/FIPS/FIPS3 from the name crosswalk
+    unemployment  unemployment rate by FIPS
+    atlas         Food Access Research Atlas, tracts rolled up to counties
+                  (atlas.county_table, plain tract means as in the bundled
+                  DataProcessed.parquet)
+    dataset       fips + unemployment + atlas: DataProcessed.parquet
+    predictions   baseline PREDICTION_YEAR projections from helpers.make_predictions
+    combined      helpers.combine_datasets(dataset, predictions)
+
+A stage's fingerprint hashes its code version, the sha256 of its
+sources and the fingerprints of its upstream stages. Outputs are stored
+in .cache/etl/ under their fingerprint, so a refresh only recomputes the
+stages downstream of a source that changed, and unchanged outputs are
+not even read back.
+
+DataProcessed.parquet keeps the observed years only: app.py makes the
+PREDICTION_YEAR rows itself from the "Adjust %" inputs, so the
+projections go to their own artifacts.
+
+    python pipeline.py                  # refresh, then write DataProcessed.parquet
+    python pipeline.py --dry-run        # only show which stages would run
+    python pipeline.py --force atlas    # recompute a stage (and what depends on it)
+    python pipeline.py --refresh        # first re-download changed sources (fetcher.py)
+
+CKD_ETL_DIR moves the stage cache.
+"""
+import argparse
+import hashlib
+import json
+import glob
+import os
+import shutil
+import sys
+import time
+
+import pandas as pd
+
+import atlas
+import crosswalk
+import datasource
+import fetcher
+import helpers
+
+ETL_DIR = os.environ.get('CKD_ETL_DIR', os.path.join(datasource.ROOT, '.cache', 'etl'))
+OUTPUT = datasource.BUNDLED[datasource.DATA_PROCESSED_URL]
+PREDICTION_YEAR = 2024
+
+KEYS = ['State', 'StateAbr', 'County', 'FIPS', 'FIPS3']
+#tract counts reported as a percentage of the tract population
+POPULATION_SHARES = [
+    'lalowihalf', 'laseniorshalf', 'lasnaphalf', 'lalowi1', 'laseniors1', 'lasnap1',
+    'lalowi10', 'laseniors10', 'lasnap10', 'lalowi20', 'laseniors20', 'lasnap20',
+    'TractWhite', 'TractBlack', 'TractAsian', 'TractNHOPI', 'TractAIAN', 'TractOMultir',
+]
+#tract counts reported as a percentage of the occupied housing units
+HOUSING_SHARES = ['TractSNAP']
+COLUMNS = KEYS + ['Year', 'CkdRate', 'unEmpRate', 'Pop2010', 'OHU2010', 'PovertyRate'] \
+    + POPULATION_SHARES + HOUSING_SHARES
+
+
+def _ckd(inputs):
+    #original source : https://nccd.cdc.gov/ckd/detail.aspx?Qnum=Q705&Strat=County&Year=2018#refreshPosition
+    ckd = datasource.read_parquet(datasource.CKD_PREVALENCE_URL)
+    ckd.columns = ['CkdRate','County','State','Year']
+    ckd = ckd[['County','State','Year','CkdRate']]
+    ckd['County'] = ckd['County'].str.upper()
+    ckd['State'] = ckd['State'].str.upper()
+    return ckd
+
+
+def _fips(inputs):
+    ckd = crosswalk.load().attach(inputs['ckd'], columns=('StateAbr','FIPS','FIPS3'))
+    #canonical county names, so every year of a county carries the same name
+    names = crosswalk.load().counties.set_index('FIPS')['County']
+    ckd['County'] = ckd['FIPS'].map(names).to_numpy()
+    return ckd
+
+
+def _unemployment(inputs):
+    unemp_df = datasource.read_csv(datasource.UNEMPLOYMENT_URL,dtype={"fips": str})
+    unemp_df['unemp'] = (unemp_df['unemp']/unemp_df['unemp'].max()) *(100)
+    return unemp_df.rename(columns={'fips':'FIPS', 'unemp':'unEmpRate'})[['FIPS','unEmpRate']]
+
+
+def _atlas(inputs):
+    #the columns keep their DataProcessed meaning: every one, Pop2010 and
+    #OHU2010 included, is the unweighted mean over the county's tracts, the
+    #counts taken as a percentage of their tract's population or housing units
+    out_dir = atlas.ingest(out_dir=atlas.ATLAS_DIR)
+    percent_of = dict(dict.fromkeys(POPULATION_SHARES, 'POP2010'), **dict.fromkeys(HOUSING_SHARES, 'OHU2010'))
+    counties = atlas.county_table(
+        means=['POP2010','OHU2010','PovertyRate'] + POPULATION_SHARES + HOUSING_SHARES,
+        weight=None, percent_of=percent_of, out_dir=out_dir)
+    return counties.rename(columns={'POP2010': 'Pop2010'})
+
+
+def _dataset(inputs):
+    dff = crosswalk.merge(inputs['fips'], inputs['unemployment'])
+    dff = crosswalk.merge(dff, inputs['atlas'])
+    return dff[COLUMNS].sort_values(['State','County','Year']).reset_index(drop=True)
+
+
+def _predictions(inputs):
+    train = inputs['dataset']
+    test_df = train[train.Year>2015].assign(Year=PREDICTION_YEAR)
+    return helpers.make_predictions(test_df)[COLUMNS]
+
+
+def _combined(inputs):
+    return helpers.combine_datasets(inputs['dataset'], inputs['predictions']).reset_index(drop=True)
+
+
+#stage -> (code version, sources, upstream stages, builder); in run order
+STAGES = {
+    'ckd': (1, [datasource.CKD_PREVALENCE_URL], [], _ckd),
+    'fips': (1, [], ['ckd'], _fips),
+    'unemployment': (1, [datasource.UNEMPLOYMENT_URL], [], _unemployment),
+    'atlas': (2, [datasource.FOOD_ATLAS_URL], [], _atlas),
+    'dataset': (1, [], ['fips', 'unemployment', 'atlas'], _dataset),
+    'predictions': (1, [], ['dataset'], _predictions),
+    'combined': (1, [], ['dataset', 'predictions'], _combined),
+}
+
+
+def _crosswalk_version():
+    #the fips stage also depends on the crosswalk and what it is built from
+    return {'version': crosswalk.VERSION, 'sources': crosswalk.source_hashes()}
+
+
+def fingerprints(force=()):
+
+    """
+    {stage: fingerprint}. Stages in ``force`` get a fresh fingerprint
+    (and so does everything downstream of them).
+    """
+
+    hashes = {}
+    result = {}
+    for name, (version, sources, upstream, _) in STAGES.items():
+        for url in sources:
+            if url not in hashes:
+                hashes[url] = datasource.content_hash(datasource.fetch(url))
+        parts = {
+            'stage': name,
+            'version': version,
+            'sources': {url: hashes[url] for url in sources},
+            'upstream': {dep: result[dep] for dep in upstream},
+        }
+        if name == 'fips':
+            parts['crosswalk'] = _crosswalk_version()
+        if name in force:
+            parts['forced'] = time.time()
+        result[name] = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+    return result
+
+
+def output_path(name, fingerprint, out_dir=ETL_DIR):
+    return os.path.join(out_dir, '%s-%s.parquet' % (name, fingerprint))
+
+
+def _write(table, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.%d.tmp' % os.getpid()
+    table.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _prune(name, fingerprint, out_dir=ETL_DIR):
+    #drop outputs of earlier fingerprints of a stage
+    keep = output_path(name, fingerprint, out_dir)
+    for path in glob.glob(output_path(name, '*', out_dir)):
+        if path != keep:
+            os.remove(path)
+
+
+def remote_sources():
+    #every remote source a stage reads, except those with a bundled copy
+    urls = [url for _, sources, _, _ in STAGES.values() for url in sources]
+    return [url for url in dict.fromkeys(urls) if url not in datasource.BUNDLED]
+
+
+def plan(force=(), out_dir=ETL_DIR):
+    #{stage: (fingerprint, up to date?)}
+    return {
+        name: (fp, os.path.exists(output_path(name, fp, out_dir)))
+        for name, fp in fingerprints(force).items()
+    }
+
+
+def run(force=(), out_dir=ETL_DIR, log=print):
+
+    """
+    Bring every stage up to date and return {stage: (fingerprint,
+    status)}, status being 'fresh' or 'built'. Outputs of fresh stages
+    are only read when a stage downstream of them has to be rebuilt.
+    """
+
+    stages = plan(force, out_dir)
+    loaded = {}
+
+    def load(name):
+        if name not in loaded:
+            loaded[name] = pd.read_parquet(output_path(name, stages[name][0], out_dir))
+        return loaded[name]
+
+    report = {}
+    for name, (version, sources, upstream, builder) in STAGES.items():
+        fp, fresh = stages[name]
+        if fresh:
+            report[name] = (fp, 'fresh')
+            continue
+        started = time.time()
+        table = builder({dep: load(dep) for dep in upstream})
+        _write(table, output_path(name, fp, out_dir))
+        _prune(name, fp, out_dir)
+        loaded[name] = table
+        report[name] = (fp, 'built')
+        if log:
+            log('%-13s built %6d rows in %.1fs' % (name, len(table), time.time() - started))
+    return report
+
+
+def dataset(out_dir=ETL_DIR):
+    #the DataProcessed frame of the current pipeline state
+    fp = run(out_dir=out_dir, log=None)['dataset'][0]
+    return pd.read_parquet(output_path('dataset', fp, out_dir))
+
+
+def publish(report, out_dir=ETL_DIR, output=OUTPUT):
+    #copy the dataset stage to DataProcessed.parquet if it differs
+    source = output_path('dataset', report['dataset'][0], out_dir)
+    if os.path.exists(output) and datasource.content_hash(output) == datasource.content_hash(source):
+        return False
+    tmp = output + '.%d.tmp' % os.getpid()
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, output)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='only show which stages would run')
+    parser.add_argument('--force', nargs='*', default=[], choices=list(STAGES), help='stages to recompute')
+    parser.add_argument('--out', default=OUTPUT, help='where to write DataProcessed.parquet')
+    parser.add_argument('--refresh', action='store_true', help='re-download changed sources first')
+    args = parser.parse_args(argv)
+
+    if args.refresh:
+        for url, (path, status) in fetcher.refresh(remote_sources()).items():
+            print('%-13s %s' % (status, url))
+
+    if args.dry_run:
+        for name, (fp, fresh) in plan(args.force).items():
+            print('%-13s %s %s' % (name, fp, 'fresh' if fresh else 'would run'))
+        return 0
+
+    report = run(args.force)
+    changed = publish(report, output=args.out)
+    print('%s %s' % (args.out, 'written' if changed else 'unchanged'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Prediction cache shared by every gunicorn worker on a host.
+
+Scenarios on the precomputed grid (scenario_grid.py) never get here;
+this catches everything else, e.g. a typed-in 0.25. Each distinct
+(engine, perc_senior, perc_lowi, perc_snap) is computed once per
+deployment and stored as a .npy file in a local directory that all
+workers read. Reads bump the file's mtime, and writes evict the least
+recently used entries beyond the size cap.
+
+CKD_PREDICTION_CACHE_DIR and CKD_PREDICTION_CACHE_SIZE (entries)
+override the defaults.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+import datasource
+
+CACHE_DIR = os.environ.get(
+    'CKD_PREDICTION_CACHE_DIR', os.path.join(datasource.ROOT, '.cache', 'predictions'))
+MAX_ENTRIES = int(os.environ.get('CKD_PREDICTION_CACHE_SIZE', '256'))
+
+
+def _normalize(x):
+    return None if x is None else round(float(x), 6)
+
+
+class PredictionCache:
+
+    """
+    LRU-evicted, size-capped disk store of prediction arrays.
+
+    cache = PredictionCache()
+    rates = cache.get_or_compute('map', fingerprint, engine.predict, 0.25, 0, 3)
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_entries=MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, name, fingerprint, x1, x2, x3):
+        key = repr((name, fingerprint, _normalize(x1), _normalize(x2), _normalize(x3)))
+        return os.path.join(
+            self.directory, '%s-%s.npy' % (name, hashlib.sha1(key.encode()).hexdigest()))
+
+    def get(self, path):
+        try:
+            rates = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return rates
+
+    def put(self, path, rates):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-', suffix='.npy')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(rates))
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = glob.glob(os.path.join(self.directory, '*.npy'))
+        if len(entries) <= self.max_entries:
+            return
+        def mtime(p):
+            try:
+                return os.stat(p).st_mtime
+            except OSError:
+                return 0
+        entries.sort(key=mtime)
+        for p in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def get_or_compute(self, name, fingerprint, predict, x1=0, x2=0, x3=0):
+        path = self.path(name, fingerprint, x1, x2, x3)
+        rates = self.get(path)
+        if rates is not None:
+            self.hits += 1
+            return rates
+        self.misses += 1
+        rates = predict(x1, x2, x3)
+        self.put(path, rates)
+        return rates
+
+    def clear(self):
+        for p in glob.glob(os.path.join(self.directory, '*.npy')):
+            os.remove(p)
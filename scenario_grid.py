@@ -0,0 +1,189 @@
+"""
+Precomputed prediction scenarios.
+
+The three "Adjust %" inputs only take a few values (perc-senior and
+perc-lowi step by 0.1 over 0-1, perc-snap steps by 1 over 0-10), i.e.
+11 x 11 x 11 = 1331 scenarios. ScenarioGrid evaluates helpers.model for
+every county under every scenario once and keeps the result in a
+memory-mapped float32 counties x scenarios matrix (column-major, so a
+scenario is one contiguous column). The file is shared through the OS
+page cache by every gunicorn worker on the host.
+
+    python scenario_grid.py     # precompute the grids into .cache/scenarios/
+
+Workers that find no grid on disk build it themselves (well under a
+second with the vectorized engine). Grids are named by a fingerprint of
+the engine's inputs; a build removes the grids of other fingerprints,
+so a data change does not leave the previous matrices behind.
+"""
+import hashlib
+import glob
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import datasource
+import helpers
+
+GRID_DIR = os.environ.get('CKD_SCENARIO_DIR', os.path.join(datasource.ROOT, '.cache', 'scenarios'))
+ENABLED = os.environ.get('CKD_SCENARIO_GRID', '1') == '1'
+
+#domains of the perc-senior, perc-lowi and perc-snap inputs in app.py
+X1_STEPS = 10   #0, 0.1, ..., 1
+X2_STEPS = 10   #0, 0.1, ..., 1
+X3_MAX = 10     #0, 1, ..., 10
+SHAPE = (X1_STEPS + 1, X2_STEPS + 1, X3_MAX + 1)
+
+
+def prediction_engines(df):
+    """The engines behind the 2024 map and scatter projections in app.py"""
+    test_df = df[(df.Year>2015)]
+    return {
+        'map': helpers.PredictionEngine(test_df),
+        'scatter': helpers.PredictionEngine(test_df.assign(Year=2024)),
+    }
+
+
+def _grid_index(value, steps, scale):
+    #position of value on the grid, or None if it is not a grid point
+    if value is None:
+        return None
+    pos = float(value) * scale
+    i = int(round(pos))
+    if abs(pos - i) > 1e-6 or not 0 <= i <= steps:
+        return None
+    return i
+
+
+def scenario_column(x1, x2, x3):
+    """Column of (x1, x2, x3) in the scenario matrix, or None if off-grid"""
+    i1 = _grid_index(x1, X1_STEPS, X1_STEPS)
+    i2 = _grid_index(x2, X2_STEPS, X2_STEPS)
+    i3 = _grid_index(x3, X3_MAX, 1)
+    if None in (i1, i2, i3):
+        return None
+    return int(np.ravel_multi_index((i1, i2, i3), SHAPE))
+
+
+def engine_fingerprint(engine):
+    h = hashlib.sha256(repr(SHAPE).encode())
+    for name in helpers.PREDICTION_FEATURES:
+        h.update(np.ascontiguousarray(engine.features[name]).tobytes())
+    return h.hexdigest()[:16]
+
+
+class ScenarioGrid:
+
+    """
+    Memory-mapped predictions of one PredictionEngine over every
+    scenario. lookup() returns a read-only float32 column, or None for
+    inputs that are not on the grid (the caller then computes directly).
+    """
+
+    def __init__(self, name, engine, directory=GRID_DIR):
+        self.name = name
+        self.engine = engine
+        self.fingerprint = engine_fingerprint(engine)
+        self.path = os.path.join(directory, '%s-%s.f32' % (name, self.fingerprint))
+        self._matrix = None
+        #scenarios answered from the grid, and those that fell through to rates()'s fallbacks
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def shape(self):
+        return (len(self.engine), int(np.prod(SHAPE)))
+
+    def _temporary(self):
+        #a world-readable temporary file next to the grid, for os.replace
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        os.close(fd)
+        os.chmod(tmp, 0o644)
+        return tmp
+
+    def build(self):
+        """
+        Evaluate every scenario, write the matrix and its .json sidecar
+        atomically, then remove the grids of other fingerprints
+        """
+        tmp = self._temporary()
+        try:
+            out = np.memmap(tmp, dtype='float32', mode='w+', shape=self.shape, order='F')
+            x1 = np.linspace(0, 1, X1_STEPS + 1)
+            x2 = np.linspace(0, 1, X2_STEPS + 1)
+            for col, (i1, i2, i3) in enumerate(np.ndindex(*SHAPE)):
+                out[:, col] = self.engine.predict(x1[i1], x2[i2], i3)
+            out.flush()
+            del out
+            os.replace(tmp, self.path)
+            tmp = self._temporary()
+            with open(tmp, 'w') as f:
+                json.dump({'name': self.name, 'shape': self.shape, 'grid': SHAPE}, f)
+            os.replace(tmp, self.path + '.json')
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.prune()
+        return self.path
+
+    def prune(self):
+        #grids of this name built from other data; workers that still map
+        #one keep their mapping until they exit
+        pattern = os.path.join(os.path.dirname(self.path), '%s-*.f32' % self.name)
+        for path in glob.glob(pattern):
+            if path == self.path:
+                continue
+            for stale in (path, path + '.json'):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            if not os.path.exists(self.path):
+                self.build()
+            self._matrix = np.memmap(
+                self.path, dtype='float32', mode='r', shape=self.shape, order='F')
+        return self._matrix
+
+    def lookup(self, x1=0, x2=0, x3=0):
+        col = scenario_column(x1, x2, x3)
+        if col is None or not ENABLED:
+            return None
+        return self.matrix[:, col]
+
+    def rates(self, x1=0, x2=0, x3=0, cache=None):
+        """
+        Predicted rates for a scenario: the grid column if there is one,
+        else the shared prediction cache (if given), else the engine
+        """
+        rates = self.lookup(x1, x2, x3)
+        if rates is not None:
+            self.hits += 1
+            return rates
+        self.misses += 1
+        if cache is not None:
+            return cache.get_or_compute(
+                self.name, self.fingerprint, self.engine.predict, x1, x2, x3)
+        return self.engine.predict(x1, x2, x3)
+
+
+def main():
+    import compile_assets
+    df = compile_assets.load_assets()['data_processed']
+    for name, engine in prediction_engines(df).items():
+        path = ScenarioGrid(name, engine).build()
+        print('%-8s %d x %d -> %s' % (name, len(engine), int(np.prod(SHAPE)), path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
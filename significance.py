@@ -0,0 +1,222 @@
+"""
+Bootstrap confidence intervals and permutation p-values for the
+Spearman correlations behind the correlation charts.
+
+Resamples are processed in batches, each batch fully vectorized
+(bootstrap ranks come from resampling counts over presorted columns,
+permutations just shuffle the target ranks), and the batches are
+spread over a process pool. That is too much work for a worker boot,
+so the table for the national charts is computed offline and committed
+with the other compiled artifacts:
+
+    data/compiled/significance.parquet
+
+Its schema metadata records the data version of the rows it was
+computed from and the settings. load() is a plain read that returns
+None when those no longer match (the correlation charts then have no
+error bars), so a stale table is never shown; the app never resamples.
+
+    python significance.py          # recompute and write it
+                                    # (also run by python compile_assets.py)
+    python significance.py --check  # exit 1 if it is stale
+
+CKD_SIGNIFICANCE_RESAMPLES and CKD_SIGNIFICANCE_WORKERS override the
+defaults.
+"""
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import correlation
+import datasource
+import tables
+
+N_RESAMPLES = int(os.environ.get('CKD_SIGNIFICANCE_RESAMPLES', '2000'))
+WORKERS = int(os.environ.get('CKD_SIGNIFICANCE_WORKERS', '0')) or os.cpu_count() or 1
+BATCH_SIZE = 50
+CONFIDENCE = 0.95
+SEED = 2023
+#year of the national tables built at startup (app.corr_df1, app.corr_df2)
+YEAR = 2019
+SIGNIFICANCE_PATH = os.path.join(datasource.ROOT, 'data', 'compiled', 'significance.parquet')
+VERSION = 1
+
+_matrix = None   #(n, k+1) data of the current job, target first, set per worker
+_ties = None     #per column: (sort order, tie group starts, tie group of each row)
+
+
+def _tie_groups(matrix):
+    groups = []
+    for column in matrix.T:
+        order = np.argsort(column, kind='mergesort')
+        ordered = column[order]
+        first = np.r_[True, ordered[1:] != ordered[:-1]]
+        group = np.empty(len(column), dtype='int64')
+        group[order] = np.cumsum(first) - 1
+        groups.append((order, np.flatnonzero(first), group))
+    return groups
+
+
+def _init(matrix):
+    global _matrix, _ties
+    _matrix = matrix
+    _ties = _tie_groups(matrix)
+
+
+def _pearson_rows(a, b, weights=None):
+    #correlation of (..., n) ranks a with each of (k, ..., n) ranks b along
+    #the last axis, optionally with (..., n) weights (bootstrap counts);
+    #returns (..., k)
+    if weights is None:
+        weights = np.ones(a.shape[-1])
+    total = weights.sum(axis=-1, keepdims=True)
+    a = a - (weights * a).sum(axis=-1, keepdims=True) / total
+    b = b - (weights * b).sum(axis=-1, keepdims=True) / total
+    wa = weights * a
+    num = (wa * b).sum(axis=-1)
+    den = np.sqrt((wa * a).sum(axis=-1)) * np.sqrt((weights * b**2).sum(axis=-1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.moveaxis(num / den, 0, -1)
+
+
+def _bootstrap_batch(args):
+
+    """
+    Spearman coefficients of ``size`` bootstrap resamples. A resample
+    is described by how many times it draws each row, and the rank of
+    a value in the resample only depends on those counts, so ranks come
+    from cumulative counts over the presorted columns: no sorting and
+    no copying of resampled data.
+    """
+
+    seed, size = args
+    rng = np.random.default_rng(seed)
+    n = _matrix.shape[0]
+    draws = rng.integers(0, n, size=(size, n)) + n * np.arange(size)[:, None]
+    counts = np.bincount(draws.ravel(), minlength=size * n).reshape(size, n).astype('float64')
+
+    ranks = np.empty((len(_ties), size, n))
+    for j, (order, starts, group) in enumerate(_ties):
+        in_group = np.add.reduceat(counts[:, order], starts, axis=1)
+        group_rank = np.cumsum(in_group, axis=1) - in_group + (in_group + 1) / 2
+        ranks[j] = group_rank[:, group]
+    return _pearson_rows(ranks[0], ranks[1:], weights=counts)
+
+
+def _permutation_batch(args):
+    seed, size = args
+    rng = np.random.default_rng(seed)
+    ranks = correlation.rankdata(_matrix, axis=0)
+    #ranks of a permuted column are the permuted ranks: no re-ranking needed
+    perms = rng.permuted(np.tile(ranks[:, 0], (size, 1)), axis=1)
+    return _pearson_rows(perms, ranks[:, 1:].T[:, None, :])
+
+
+def _run(func, matrix, n_resamples, seed, workers):
+    seeds = np.random.SeedSequence(seed).generate_state(-(-n_resamples // BATCH_SIZE))
+    sizes = [min(BATCH_SIZE, n_resamples - i * BATCH_SIZE) for i in range(len(seeds))]
+    jobs = list(zip(seeds.tolist(), sizes))
+    if workers <= 1:
+        _init(matrix)
+        return np.concatenate([func(job) for job in jobs])
+    with ProcessPoolExecutor(workers, initializer=_init, initargs=(matrix,)) as pool:
+        return np.concatenate(list(pool.map(func, jobs)))
+
+
+def significance_table(dff, cols=correlation.FEATURES, target=correlation.TARGET,
+                       n_resamples=N_RESAMPLES, seed=SEED, workers=WORKERS):
+
+    """
+    Per feature: bootstrap percentile interval of the Spearman
+    coefficient and the two-sided permutation p-value
+    """
+
+    matrix = np.column_stack([
+        dff[target].to_numpy(dtype='float64'), dff[cols].to_numpy(dtype='float64')])
+    observed, _ = correlation.spearman(matrix[:, 0], matrix[:, 1:])
+
+    boot = _run(_bootstrap_batch, matrix, n_resamples, seed, workers)
+    tail = (1 - CONFIDENCE) / 2 * 100
+    low, high = np.nanpercentile(boot, [tail, 100 - tail], axis=0)
+
+    perm = _run(_permutation_batch, matrix, n_resamples, seed + 1, workers)
+    extreme = (np.abs(perm) >= np.abs(observed) - 1e-12).sum(axis=0)
+    p_perm = (extreme + 1) / (n_resamples + 1)
+
+    return pd.DataFrame({
+        'Feature': cols,
+        'ci_low': low,
+        'ci_high': high,
+        'perm_p_value': np.round(p_perm, 4),
+    })
+
+
+def _meta(dff, n_resamples=N_RESAMPLES, seed=SEED):
+    #what a stored table was computed from
+    return {
+        'version': VERSION,
+        'data': tables.data_version(dff[correlation.FEATURES]),
+        'n_resamples': n_resamples,
+        'seed': seed,
+        'confidence': CONFIDENCE,
+    }
+
+
+def read_meta(path=None):
+    path = path or SIGNIFICANCE_PATH
+    try:
+        meta = pq.read_schema(path).metadata or {}
+        return json.loads(meta[b'significance'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def write(table, meta, path=None):
+    path = path or SIGNIFICANCE_PATH
+    arrow = pa.Table.from_pandas(table, preserve_index=False)
+    arrow = arrow.replace_schema_metadata(
+        dict(arrow.schema.metadata or {}, significance=json.dumps(meta, sort_keys=True)))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.%d.tmp' % os.getpid()
+    pq.write_table(arrow, tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def load(dff, path=None):
+    #the stored table if it was computed from ``dff`` with the current settings, else None
+    if read_meta(path) != _meta(dff):
+        return None
+    return pd.read_parquet(path or SIGNIFICANCE_PATH)
+
+
+def precompute(df, year=YEAR, path=None):
+    #compute and store the table of the national ``year`` charts, unless it is current
+    dff = df[df.Year==year]
+    table = load(dff, path)
+    if table is None:
+        table = significance_table(dff, n_resamples=N_RESAMPLES, seed=SEED)
+        write(table, _meta(dff), path)
+    return table
+
+
+def main(argv=None):
+    import compile_assets
+    argv = sys.argv[1:] if argv is None else argv
+    df = compile_assets.load_assets()['data_processed']
+    if '--check' in argv:
+        fresh = load(df[df.Year==YEAR]) is not None
+        print('fresh' if fresh else 'stale')
+        return 0 if fresh else 1
+    print(precompute(df).to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
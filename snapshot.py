@@ -0,0 +1,164 @@
+"""
+Startup snapshot of the built dashboard layout.
+
+Most of a worker's cold start goes into building the initial figures of
+app.layout: the two px.choropleth maps alone spend seconds validating
+and deep-copying the county GeoJSON, and every gunicorn worker does it
+again on every boot. The layout only depends on the code and on the
+tables behind it, so the first build is serialized to JSON (the same
+type/namespace/props form Dash sends to the browser) under a
+fingerprint of both:
+
+    .cache/snapshot/layout-<fingerprint>.json
+
+and later boots rebuild the component tree from that file instead of
+calling px.* at all. Any change to a module, a table, the geometry
+level or the Dash/Plotly versions gives a new fingerprint, so a stale
+snapshot is never served; the old files are pruned when the new one
+is written.
+
+    python snapshot.py          # build the snapshot now (imports app.py)
+    python snapshot.py --check  # exit 1 if there is no snapshot for the current tree
+
+CKD_LAYOUT_SNAPSHOT=0 turns snapshots off, CKD_SNAPSHOT_DIR moves them.
+"""
+import glob
+import hashlib
+import json
+import os
+import sys
+
+import dash
+import plotly
+from dash import dash_table, dcc, html
+from dash.development.base_component import Component
+from plotly.io.json import to_json_plotly
+import dash_bootstrap_components as dbc
+
+import datasource
+import tables
+
+SNAPSHOT_DIR = os.environ.get('CKD_SNAPSHOT_DIR', os.path.join(datasource.ROOT, '.cache', 'snapshot'))
+ENABLED = os.environ.get('CKD_LAYOUT_SNAPSHOT', '1') != '0'
+VERSION = 1
+
+#component libraries the layout is built from, by the namespace they serialize with
+LIBRARIES = {
+    'dash_html_components': html,
+    'dash_core_components': dcc,
+    'dash_bootstrap_components': dbc,
+    'dash_table': dash_table,
+}
+
+
+def _code_hashes():
+    #every top-level module: the layout is whatever app.py and its imports build
+    return {
+        os.path.basename(path): datasource.content_hash(path)
+        for path in sorted(glob.glob(os.path.join(datasource.ROOT, '*.py')))
+    }
+
+
+def fingerprint(frames, files=(), extra=None):
+
+    """
+    Key of a layout built from the tables in ``frames`` ({name:
+    DataFrame}) and the data ``files``, by the current code. ``extra``
+    is any other JSON-able setting the layout depends on.
+    """
+
+    parts = {
+        'version': VERSION,
+        'libraries': {
+            'dash': dash.__version__, 'plotly': plotly.__version__, 'dbc': dbc.__version__},
+        'code': _code_hashes(),
+        'tables': {name: tables.data_version(frame) for name, frame in sorted(frames.items())},
+        'files': {
+            os.path.relpath(path, datasource.ROOT): datasource.content_hash(path)
+            for path in files if os.path.exists(path)
+        },
+        'extra': extra,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def snapshot_path(key, directory=SNAPSHOT_DIR):
+    return os.path.join(directory, 'layout-%s.json' % key)
+
+
+def to_json(layout):
+    return to_json_plotly(layout)
+
+
+def _component(node):
+    #json object_hook: serialized components back into Dash components,
+    #innermost first, so children are already components when their parent is built
+    if len(node) == 3 and 'namespace' in node and 'type' in node and 'props' in node:
+        cls = getattr(LIBRARIES.get(node['namespace']), node['type'], None)
+        if isinstance(cls, type) and issubclass(cls, Component):
+            return cls(**node['props'])
+    return node
+
+
+def from_json(text):
+    return json.loads(text, object_hook=_component)
+
+
+def load(key, directory=SNAPSHOT_DIR):
+
+    """
+    The layout stored under ``key``, or None when snapshots are off or
+    there is none yet
+    """
+
+    if not ENABLED:
+        return None
+    try:
+        with open(snapshot_path(key, directory)) as f:
+            layout = from_json(f.read())
+    except (OSError, ValueError):
+        return None
+    return layout if isinstance(layout, Component) else None
+
+
+def save(layout, key, directory=SNAPSHOT_DIR):
+
+    """
+    Store ``layout`` under ``key`` (once) and drop the snapshots of
+    other keys. Returns the path, or None when snapshots are off.
+    """
+
+    if not ENABLED:
+        return None
+    path = snapshot_path(key, directory)
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp = path + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as f:
+            f.write(to_json(layout))
+        os.replace(tmp, path)
+    for old in glob.glob(snapshot_path('*', directory)):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return path
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not ENABLED:
+        print('layout snapshots are off (CKD_LAYOUT_SNAPSHOT=0)')
+        return 1
+    import app      #builds, or loads, the layout and saves the snapshot
+    path = snapshot_path(app.layout_key)
+    if '--check' in argv:
+        print('%s %s' % (path, 'built from the current tree' if app.layout_snapshot else 'was missing'))
+        return 0 if app.layout_snapshot else 1
+    print('%s: %.1f MB' % (path, os.path.getsize(path) / 2**20))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+In-memory indexes over the main DataProcessed table, built once at
+load time so the callbacks never rescan the full multi-year frame, plus
+the compact dtypes the table is stored with.
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+KEY_COLUMNS = ['State','StateAbr','County','FIPS','FIPS3']
+
+
+def compact(df):
+    
+    """
+    Store the string keys as categoricals (FIPS stays a zero-padded
+    string category so it still matches the GeoJSON ids), Year as int16
+    and every float metric as float32. Roughly a quarter of the
+    original memory for DataProcessed.
+    """
+    
+    out = df.copy()
+    for col in KEY_COLUMNS:
+        if col in out and not isinstance(out[col].dtype, pd.CategoricalDtype):
+            out[col] = out[col].astype('category')
+    if 'Year' in out:
+        out['Year'] = out['Year'].astype('int16')
+    floats = out.select_dtypes('float64').columns
+    out[floats] = out[floats].astype('float32')
+    return out
+
+
+def memory_usage_mb(df):
+    return df.memory_usage(deep=True).sum() / 2**20
+
+
+class YearPartitions:
+
+    """
+    The table sorted by Year, with one contiguous slice per year.
+
+    years = YearPartitions(df)
+    data = years[2019]     #O(1), no boolean scan and no copy
+
+    Slices share memory with the partitioned table: treat them as
+    read-only and use .assign()/.copy() before changing columns.
+    Unknown years give an empty frame with the same columns.
+    """
+
+    def __init__(self, df, column='Year'):
+        self.column = column
+        self.table = df.sort_values(column, kind='mergesort').reset_index(drop=True)
+        values = self.table[column].to_numpy()
+        keys, starts = np.unique(values, return_index=True)
+        stops = np.append(starts[1:], len(values))
+        self.bounds = {
+            key.item(): (int(start), int(stop)) for key, start, stop in zip(keys, starts, stops)
+        }
+        self._slices = {
+            key: self.table.iloc[start:stop] for key, (start, stop) in self.bounds.items()
+        }
+        self._empty = self.table.iloc[0:0]
+
+    def __getitem__(self, year):
+        return self._slices.get(year, self._empty)
+
+    def __contains__(self, year):
+        return year in self._slices
+
+    def __iter__(self):
+        return iter(self._slices)
+
+    @property
+    def years(self):
+        return list(self._slices)
+
+
+class FipsIndex:
+
+    """
+    Index from (Year, FIPS) to row position in a partitioned table.
+
+    fips = FipsIndex(years)
+    fips.rows(2019, '01001')              #one county
+    fips.rows(2019, ['01001', '01003'])   #several, in the order given
+
+    Each year keeps its integer FIPS codes sorted, with their row
+    positions, as two numpy arrays (16 bytes a row), built the first
+    time the year is queried; lookups are a searchsorted. Unknown codes
+    are skipped. Like YearPartitions, the returned frame is a selection
+    of the shared table and should be treated as read-only.
+    """
+
+    def __init__(self, partitions, column='FIPS'):
+        self.partitions = partitions
+        self.table = partitions.table
+        self.column = column
+        self._years = {}
+
+    def _year(self, year):
+        #(sorted FIPS codes, their row positions) of one year's partition
+        if year not in self._years:
+            start, stop = self.partitions.bounds.get(year, (0, 0))
+            codes = fips_codes(self.table[self.column].iloc[start:stop])
+            order = np.argsort(codes, kind='stable')
+            self._years[year] = (codes[order], order + start)
+        return self._years[year]
+
+    def positions_of(self, year, fips):
+        if isinstance(fips, str):
+            fips = [fips]
+        codes, positions = self._year(year)
+        wanted = fips_codes(fips)
+        #the last row of a repeated code, like a dict filled in row order
+        at = np.searchsorted(codes, wanted, side='right') - 1
+        found = (wanted >= 0) & (at >= 0)
+        found[found] = codes[at[found]] == wanted[found]
+        return positions[at[found]]
+
+    def rows(self, year, fips):
+        return self.table.iloc[self.positions_of(year, fips)]
+
+
+def fips_codes(fips):
+    #FIPS strings (or numbers) as int64, -1 where missing or not a number
+    if isinstance(getattr(fips, 'dtype', None), pd.CategoricalDtype):
+        #convert each category once
+        categories = np.append(fips_codes(fips.cat.categories), -1)
+        return categories[fips.cat.codes.to_numpy()]
+    codes = pd.to_numeric(pd.Series(fips, dtype=object).astype(str), errors='coerce')
+    return codes.fillna(-1).astype('int64').to_numpy()
+
+
+def parse_fips(text):
+    """Split free text such as '01001, 01003' into 5-digit FIPS codes"""
+    return [code.zfill(5) for code in text.replace(',', ' ').split()]
+
+
+def data_version(df):
+    """Short content stamp of a table, for cache keys"""
+    hashed = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha1(hashed.tobytes()).hexdigest()[:12]
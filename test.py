@@ -6,36 +6,18 @@ from dash import Dash, html, dcc
 import dash_bootstrap_components as dbc
 import gunicorn 
 from whitenoise import WhiteNoise   
-
-dtypes = {
-    'StateFIPS':str,
-    'CountyFIPS_3':str,
-    'CountyName':str,
-    'StateName':str,
-    'CountyFIPS':str,
-    'StateAbbr':str,
-    'STATE_COUNTY':str
-}
+import crosswalk
 
 ckd = pd.read_csv('https://raw.githubusercontent.com/nmmarcelnv/cmsdatajam/main/data/Prevalence_of_CKD_by_US_State_and_County_by_County_2019.csv')
-fips = pd.read_csv(
-    'https://raw.githubusercontent.com/ChuckConnell/articles/master/fips2county.tsv',
-    sep='\t',
-    usecols=['CountyName','StateName','CountyFIPS','StateAbbr'],
-    dtype=dtypes
-)
-
-fips.columns=['county','state','fips', 'state3']
-fips = fips[['state','county','fips', 'state3']]
-fips['county'] = fips['county'].str.upper()
-fips['state'] = fips['state'].str.upper()
-
 ckd.columns=['cases','county','state']
 ckd['county'] = ckd['county'].str.upper()
 ckd['state'] = ckd['state'].str.upper()
 ckd = ckd[['state','county','cases']]
 
-df = pd.merge(ckd, fips,on=['state','county'])
+#fips and state3 from the name crosswalk (see crosswalk.py)
+df = crosswalk.load().attach(
+    ckd, state='state', county='county', columns=('FIPS','StateAbr')
+).rename(columns={'FIPS':'fips', 'StateAbr':'state3'})
 
 fig = px.choropleth(
     df, 
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+#the app's modules live at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datasource
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    #an empty source cache for the duration of a test
+    directory = tmp_path / 'sources'
+    monkeypatch.setattr(datasource, 'CACHE_DIR', str(directory))
+    return directory
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import aggregation
+import compile_assets
+import datasource
+import helpers
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    n = 500
+    frame = pd.DataFrame({
+        'State': rng.choice(['TX', 'GA', 'AL'], n),
+        'County': rng.choice(['A', 'B', 'C', 'D'], n),
+        'x': rng.normal(size=n),
+        'y': rng.integers(0, 3, n).astype('float64'),
+        'w': rng.uniform(0, 100, n),
+    })
+    frame.loc[rng.choice(n, 40, replace=False), 'x'] = np.nan
+    frame.loc[rng.choice(n, 10, replace=False), 'County'] = None
+    return frame
+
+
+def test_unweighted_matches_groupby(frame):
+    membership = aggregation.Membership(frame[['State', 'County']])
+    out = membership.aggregate(frame, means=['x'], sums=['y'])
+    grouped = frame.groupby(['State', 'County']).agg(x=('x', 'mean'), y=('y', 'sum')).reset_index()
+    pd.testing.assert_frame_equal(out, grouped, check_exact=False)
+    np.testing.assert_array_equal(membership.totals(), frame.groupby(['State', 'County']).size())
+
+
+def test_categorical_keys_in_key_order():
+    #several categorical keys: sorted like plain strings, not in order of appearance
+    frame = pd.DataFrame({'a': ['y', 'x', 'y', 'x'], 'b': ['q', 'p', 'p', 'q'], 'v': [1., 2, 3, 4]})
+    cats = frame.astype({'a': 'category', 'b': 'category'})
+    out = aggregation.Membership(cats[['a', 'b']]).aggregate(cats, means=['v'])
+    assert out[['a', 'b']].astype(str).values.tolist() == [['x', 'p'], ['x', 'q'], ['y', 'p'], ['y', 'q']]
+    assert out['v'].tolist() == [2, 4, 3, 1]
+
+
+def test_weighted_matches_explicit_sums(frame):
+    membership = aggregation.Membership(frame[['State', 'County']], weights=frame['w'])
+    out = membership.aggregate(frame, means=['x'], sums=['y'], shares=['y'])
+    keys = [frame['State'], frame['County']]
+    present = frame['x'].notna()
+    expected = pd.DataFrame({
+        'x': (frame['x'] * frame['w']).groupby(keys).sum() / frame['w'].where(present).groupby(keys).sum(),
+        'y': (frame['y'] * frame['w']).groupby(keys).sum(),
+        'share': (frame['w'] * (frame['y'] != 0)).groupby(keys).sum() / frame['w'].groupby(keys).sum(),
+    }).reset_index(drop=True)
+    np.testing.assert_allclose(out['x'], expected['x'])
+    np.testing.assert_allclose(membership.sums(frame['y']), expected['y'])
+    np.testing.assert_allclose(membership.shares(frame['y']), expected['share'])
+    np.testing.assert_allclose(membership.totals(), frame['w'].groupby(keys).sum())
+
+
+def test_prediction_engine_matches_baseline_make_predictions():
+    #the row-wise groupby + apply of the original helpers.make_predictions,
+    #on the table the original app.py read
+    raw = pd.read_parquet(datasource.BUNDLED[datasource.DATA_PROCESSED_URL])
+    test_df = raw[raw.Year>2015].copy()
+    baseline = test_df.groupby(helpers.PREDICTION_KEYS).mean().reset_index()
+    baseline['CkdRate'] = baseline.apply(
+        lambda row: helpers.model(
+            row['CkdRate'],row['unEmpRate'],row['laseniors10'],row['lalowi10'],row['lasnap10'],0.1,0.2,3),
+        axis=1)
+
+    df = compile_assets.load_assets()['data_processed']
+    data = helpers.PredictionEngine(df[df.Year>2015]).make_predictions(0.1, 0.2, 3)
+    assert len(data) == len(baseline)
+    for key in helpers.PREDICTION_KEYS:
+        assert data[key].astype(baseline[key].dtype).tolist() == baseline[key].tolist()
+    for column in helpers.PREDICTION_FEATURES + ['PovertyRate', 'Pop2010']:
+        np.testing.assert_allclose(data[column], baseline[column], rtol=1e-5, err_msg=column)
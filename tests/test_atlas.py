@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import atlas
+import datasource
+from xlsx import frame_rows, write_workbook
+
+URL = 'https://example.org/atlas.xlsx'
+#0-4 header names, then two states and a rich-text county (with a phonetic run)
+SHARED = ['CensusTract', 'State', 'County', 'POP2010', 'PovertyRate',
+          'Alabama', 'Texas', ('Ha', 'rris County')]
+
+
+ROWS = [
+    #header: attributes in every order, one name as an inline string
+    '<row r="1" spans="1:5"><c r="A1" t="s"><v>0</v></c><c t="s" r="B1"><v>1</v></c>'
+    '<c s="2" t="s" r="C1"><v>2</v></c><c r="D1" s="1" t="inlineStr"><is><t>POP2010</t></is></c>'
+    '<c r="E1" t="s"><v>4</v></c></row>',
+    #shared strings, a formula, an empty cell
+    '<row r="2"><c r="A2" s="3"><v>1001020100</v></c><c s="1" r="B2" t="s"><v>5</v></c>'
+    '<c r="C2" t="inlineStr"><is><t>Autauga County</t></is></c><c r="D2"><f>1+1</f><v>1912</v></c>'
+    '<c r="E2"/></row>',
+    #gap (rows 3 and 4 missing), rich-text inline string with a phonetic run, escaped text
+    '<row r="5"><c r="A5"><v>48201100000</v></c><c r="B5" t="s"><v>6</v></c>'
+    '<c t="inlineStr" r="C5"><is><r><t>Har</t></r><r><rPr><i/></rPr><t xml:space="preserve">ris &amp; Co County</t></r>'
+    '<rPh sb="0" eb="1"><t>x</t></rPh></is></c><c r="D5"><v>4093.5</v></c><c r="E5"><v>12.5</v></c></row>',
+    #rich-text shared string, a missing column
+    '<row r="6"><c r="A6"><v>48201100100</v></c><c r="B6" t="s"><v>6</v></c>'
+    '<c r="C6" t="s"><v>7</v></c><c r="E6"><v>3</v></c></row>',
+]
+
+
+def _workbook(path, rows=ROWS):
+    return write_workbook(path, rows, SHARED)
+
+
+EXPECTED = pd.DataFrame({
+    'CensusTract': ['01001020100', '48201100000', '48201100100'],
+    'State': ['ALABAMA', 'TEXAS', 'TEXAS'],
+    'County': ['AUTAUGA', 'HARRIS & CO', 'HARRIS'],
+    'POP2010': [1912, 4093.5, np.nan],
+    'PovertyRate': [np.nan, 12.5, 3],
+})
+
+
+@pytest.mark.parametrize('chunk_bytes', [1 << 20, 64])
+def test_iter_chunks(tmp_path, chunk_bytes):
+    path = _workbook(tmp_path / 'atlas.xlsx')
+    chunks = list(atlas.iter_chunks(path, chunk_bytes=chunk_bytes))
+    if chunk_bytes == 64:
+        assert len(chunks) > 1
+    result = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(result, EXPECTED)
+
+
+def test_header_is_the_first_row(tmp_path):
+    #the header is the first row with cells, whatever its number
+    header = ROWS[0].replace('1"', '3"')
+    path = _workbook(tmp_path / 'atlas.xlsx', ['<row r="2"/>', header] + ROWS[2:])
+    result = pd.concat(atlas.iter_chunks(path), ignore_index=True)
+    pd.testing.assert_frame_equal(result, EXPECTED.iloc[1:].reset_index(drop=True))
+
+
+def test_unreadable_cell_is_an_error(tmp_path):
+    rows = ROWS + ['<row r="7"><c t="n"><v>1</v></c></row>']
+    path = _workbook(tmp_path / 'atlas.xlsx', rows)
+    with pytest.raises(ValueError, match='could not read 1 of'):
+        list(atlas.iter_chunks(path))
+
+
+def test_ingest(tmp_path, cache_dir):
+    with open(_workbook(tmp_path / 'atlas.xlsx'), 'rb') as f:
+        datasource.store(URL, f.read())
+    out_dir = str(tmp_path / 'atlas')
+    atlas.ingest(url=URL, out_dir=out_dir, chunk_bytes=64)
+    assert atlas.source_version(out_dir)['rows'] == 3
+    result = atlas.read_atlas(out_dir=out_dir).sort_values('CensusTract').reset_index(drop=True)
+    pd.testing.assert_frame_equal(result[list(EXPECTED)], EXPECTED, check_dtype=False)
+    texas = atlas.read_atlas(columns=['CensusTract'], states=['TEXAS'], out_dir=out_dir)
+    assert sorted(texas['CensusTract']) == ['48201100000', '48201100100']
+
+
+TRACTS = pd.DataFrame({
+    'CensusTract': ['01001020100', '01001020200', '01003010100'],
+    'State': ['Alabama'] * 3,
+    'County': ['Autauga County', 'Autauga County', 'Baldwin County'],
+    'POP2010': [1000.0, 3000.0, 0.0],
+    'PovertyRate': [10.0, 30.0, 5.0],
+    'lalowi1': [100.0, 1500.0, 0.0],
+})
+
+
+@pytest.fixture
+def tracts_dir(tmp_path, cache_dir):
+    with open(write_workbook(tmp_path / 'atlas.xlsx', frame_rows(TRACTS)), 'rb') as f:
+        datasource.store(URL, f.read())
+    return atlas.ingest(url=URL, out_dir=str(tmp_path / 'atlas'))
+
+
+def test_county_table_weighted(tracts_dir):
+    counties = atlas.county_table(means=['PovertyRate'], shares=['lalowi1'], out_dir=tracts_dir)
+    assert counties['FIPS'].tolist() == ['01001', '01003']
+    assert counties['PovertyRate'].tolist()[0] == pytest.approx(25.0)
+    assert counties['POP2010'].tolist() == [4000.0, 0.0]
+    assert counties['lalowi1'].tolist()[0] == 1.0
+
+
+def test_county_table_plain_means_of_percentages(tracts_dir):
+    counties = atlas.county_table(
+        means=['POP2010', 'PovertyRate', 'lalowi1'], weight=None,
+        percent_of={'lalowi1': 'POP2010'}, out_dir=tracts_dir)
+    first, second = counties.to_dict('records')
+    assert (first['POP2010'], first['PovertyRate'], first['lalowi1']) == (2000.0, 20.0, 30.0)
+    #a tract without population has no percentage, rather than an infinite one
+    assert second['POP2010'] == 0.0 and np.isnan(second['lalowi1'])
@@ -0,0 +1,29 @@
+import gzip
+
+import brotli
+import flask
+
+import compression
+
+
+def client():
+    server = flask.Flask(__name__)
+    compression.configure(server)
+    server.add_url_rule('/big', 'big', lambda: '{"z": [%s]}' % ','.join(['1.5'] * 2000))
+    server.add_url_rule('/small', 'small', lambda: '{}')
+    return server.test_client()
+
+
+def test_brotli_first_then_gzip():
+    body = client().get('/big').get_data()
+    response = client().get('/big', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.get_data()) == body
+    response = client().get('/big', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()) == body
+
+
+def test_small_responses_stay_plain():
+    response = client().get('/small', headers={'Accept-Encoding': 'br'})
+    assert 'Content-Encoding' not in response.headers
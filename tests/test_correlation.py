@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+import compile_assets
+import correlation
+import datasource
+
+
+@pytest.fixture(scope='module')
+def df():
+    return compile_assets.load_assets()['data_processed']
+
+
+def baseline_correlation(df, year=2019):
+    #the loop over scipy.stats.spearmanr of the original app.get_correlation
+    dff = df[(df.Year==year)]
+    dd = pd.DataFrame()
+    feats, corrs, p_values = [], [], []
+    for feati in correlation.FEATURES:
+        feats.append(feati)
+        corr, p_value = stats.spearmanr(dff['CkdRate'], dff[feati])
+        corrs.append(corr)
+        p_values.append(p_value)
+    dd['Feature'] = feats
+    dd['Correlation Coeff with CKD'] = corrs
+    dd['p_value'] = [round(x, 4) for x in p_values]
+    dd['Distance from supermarket'] = dd['Feature'].apply(correlation.assign_distance)
+    dd['Population Group'] = dd['Feature'].apply(correlation.assign_names)
+    dd = dd.sort_values(by=['Population Group','Distance from supermarket'])
+    dd = dd[['Population Group','Distance from supermarket','Correlation Coeff with CKD', 'p_value']]
+    d1 = dd[~dd['Population Group'].isin(correlation.DETERMINANTS)]
+    d2 = dd[dd['Population Group'].isin(correlation.DETERMINANTS)]
+    d2 = d2.rename(columns={'Distance from supermarket':'Social Determinant'})
+    d2['Social Determinant'] = d2['Social Determinant'].apply(lambda x: x.replace('Tract', 'Proportion of '))
+    return d1, d2
+
+
+def test_get_correlation_matches_baseline(df):
+    raw = pd.read_parquet(datasource.BUNDLED[datasource.DATA_PROCESSED_URL])
+    for new, old in zip(correlation.get_correlation(df, year=2019, significance=False), baseline_correlation(raw)):
+        pd.testing.assert_frame_equal(new.reset_index(drop=True), old.reset_index(drop=True), atol=1e-6)
+
+
+@pytest.mark.parametrize('state', [correlation.NATIONAL, 'TEXAS', 'VERMONT'])
+def test_cube_matches_spearmanr(df, state):
+    cube = correlation.correlation_cube(df[df.Year.isin([2010, 2019])])
+    for year in (2010, 2019):
+        rows = df[df.Year==year]
+        if state != correlation.NATIONAL:
+            rows = rows[rows.State==state]
+        dd = correlation.cube_slice(cube, year, state).set_index('Feature')
+        for feature in correlation.FEATURES:
+            r, p = stats.spearmanr(rows['CkdRate'], rows[feature])
+            assert dd.loc[feature, 'Correlation Coeff with CKD'] == pytest.approx(r, abs=1e-9, nan_ok=True)
+            assert dd.loc[feature, 'p_value'] == pytest.approx(round(p, 4), abs=1e-4, nan_ok=True)
+
+
+def test_rankdata_matches_scipy():
+    a = np.random.default_rng(0).integers(0, 5, (40, 3)).astype('float64')
+    np.testing.assert_array_equal(correlation.rankdata(a), stats.rankdata(a, axis=0))
+    r, p = correlation.spearman(a[:, 0], a[:, 1:])
+    for i in (1, 2):
+        expected = stats.spearmanr(a[:, 0], a[:, i])
+        assert r[i - 1] == pytest.approx(expected[0]) and p[i - 1] == pytest.approx(expected[1])
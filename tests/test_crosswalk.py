@@ -0,0 +1,32 @@
+import pandas as pd
+
+import crosswalk
+import datasource
+
+
+def test_inputs_do_not_depend_on_the_download_cache(cache_dir):
+    before = crosswalk.source_hashes()
+    datasource.store(datasource.FIPS2COUNTY_URL, b'CountyName\tCountyFIPS\nAutauga\t01001\n')
+    assert crosswalk.source_hashes() == before
+    assert crosswalk.is_fresh()
+
+
+def test_committed_crosswalk_is_what_build_gives():
+    committed = pd.read_parquet(crosswalk.CROSSWALK_PATH)
+    pd.testing.assert_frame_equal(committed, crosswalk.build())
+
+
+def test_lookup_spellings():
+    xw = crosswalk.load()
+    fips = xw.lookup(
+        ['Louisiana', 'LA', 'ILLINOIS', 'Virginia', 'Virginia', 'Minnesota', 'Texas'],
+        ['St. Mary Parish', 'ACADIA', 'DE KALB', 'Richmond city', 'Richmond County',
+         'LAKE OF WOODS', 'Nowhere'])
+    assert list(fips) == ['22101', '22001', '17037', '51760', '51159', '27077', None]
+
+
+def test_merge_joins_on_integer_codes():
+    left = pd.DataFrame({'FIPS': ['01001', '01003'], 'a': [1, 2]})
+    right = pd.DataFrame({'FIPS': [1001, 1003], 'b': [3, 4]})
+    merged = crosswalk.merge(left, right)
+    assert merged.to_dict('list') == {'FIPS': ['01001', '01003'], 'a': [1, 2], 'b': [3, 4]}
@@ -0,0 +1,33 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import datasource
+
+
+def _store_many(worker, count):
+    for i in range(count):
+        datasource.store('https://example.org/%d/%d.csv' % (worker, i), b'%d,%d' % (worker, i))
+
+
+def test_store_points_url_at_content(cache_dir):
+    path = datasource.store('https://example.org/a.csv?x=1', b'a,b\n1,2\n', etag='"v1"')
+    assert open(path, 'rb').read() == b'a,b\n1,2\n'
+    assert datasource.cached_path('https://example.org/a.csv?x=1') == path
+    assert datasource.index_entry('https://example.org/a.csv?x=1')['etag'] == '"v1"'
+
+
+def test_concurrent_threads_keep_every_entry(cache_dir):
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(_store_many, range(8), [25] * 8))
+    assert len(datasource._read_index()) == 8 * 25
+
+
+def test_concurrent_processes_keep_every_entry(cache_dir):
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_store_many, args=(w, 25)) for w in range(4)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+        assert p.exitcode == 0
+    assert len(datasource._read_index()) == 4 * 25
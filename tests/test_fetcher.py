@@ -0,0 +1,140 @@
+import socket
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import datasource
+import fetcher
+
+ETAG = '"v1"'
+MODIFIED = 'Wed, 01 Mar 2023 10:00:00 GMT'
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'      #keep-alive, so connections can be reused
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers), self.client_address[1]))
+            count = server.counts[self.path] = server.counts.get(self.path, 0) + 1
+        if self.path == '/data.csv':
+            if self.headers.get('If-None-Match') == ETAG:
+                return self.reply(304)
+            return self.reply(200, b'a,b\n1,2\n', ETag=ETAG, **{'Last-Modified': MODIFIED})
+        if self.path == '/flaky':
+            return self.reply(503 if count <= 2 else 200, b'ok')
+        if self.path == '/down':
+            return self.reply(503, b'down')
+        if self.path == '/reset' and count == 1:
+            #close with RST instead of answering
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = True
+            return
+        if self.path == '/reset':
+            return self.reply(200, b'ok')
+        if self.path.startswith('/hop'):
+            hops = int(self.path[len('/hop'):])
+            return self.reply(302, Location='/hop%d' % (hops - 1) if hops > 1 else '/data.csv')
+        if self.path == '/loop':
+            return self.reply(301, Location='/loop')
+        self.reply(404)
+
+    def reply(self, status, body=b'', **headers):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.counts = {}
+    httpd.url = 'http://127.0.0.1:%d' % httpd.server_address[1]
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    #backoff delays, without waiting for them
+    delays = []
+    monkeypatch.setattr(fetcher.time, 'sleep', delays.append)
+    return delays
+
+
+def test_refresh_downloads_then_revalidates(server, cache_dir, monkeypatch):
+    monkeypatch.setattr(datasource, 'OFFLINE', False)
+    url = server.url + '/data.csv'
+    path, status = fetcher.refresh([url])[url]
+    assert status == 'downloaded'
+    assert open(path, 'rb').read() == b'a,b\n1,2\n'
+    assert datasource.index_entry(url)['etag'] == ETAG
+
+    assert fetcher.refresh([url])[url] == (path, 'not modified')
+    _, headers, _ = server.requests[-1]
+    assert headers['If-None-Match'] == ETAG
+    assert headers['If-Modified-Since'] == MODIFIED
+
+
+def test_retries_server_errors_with_backoff(server, sleeps):
+    pool = fetcher.ConnectionPool()
+    status, _, body = fetcher.get(pool, server.url + '/flaky', {})
+    assert (status, body) == (200, b'ok')
+    assert server.counts['/flaky'] == 3
+    assert sleeps == [fetcher.BACKOFF, fetcher.BACKOFF * 2]
+
+
+def test_gives_up_after_retries(server, sleeps, cache_dir, monkeypatch):
+    monkeypatch.setattr(datasource, 'OFFLINE', False)
+    url = server.url + '/down'
+    path, status = fetcher.refresh([url], retries=2)[url]
+    assert (path, status) == (None, 'error: %s: HTTP 503' % url)
+    assert server.counts['/down'] == 3
+    assert len(sleeps) == 2
+
+
+def test_retries_connection_reset(server, sleeps):
+    pool = fetcher.ConnectionPool()
+    status, _, body = fetcher.get(pool, server.url + '/reset', {})
+    assert (status, body) == (200, b'ok')
+    assert server.counts['/reset'] == 2
+    assert sleeps == [fetcher.BACKOFF]
+
+
+def test_follows_redirects(server):
+    pool = fetcher.ConnectionPool()
+    status, _, body = fetcher.get(pool, server.url + '/hop3', {})
+    assert (status, body) == (200, b'a,b\n1,2\n')
+    assert [path for path, _, _ in server.requests] == ['/hop3', '/hop2', '/hop1', '/data.csv']
+
+
+def test_redirects_are_capped(server):
+    pool = fetcher.ConnectionPool()
+    with pytest.raises(fetcher.FetchError, match='too many redirects'):
+        fetcher.get(pool, server.url + '/loop', {})
+    assert server.counts['/loop'] == fetcher.MAX_REDIRECTS + 1
+
+
+def test_pool_reuses_connections(server):
+    pool = fetcher.ConnectionPool()
+    for _ in range(3):
+        assert fetcher.get(pool, server.url + '/data.csv', {})[0] == 200
+    assert pool.created == 1
+    assert len({port for _, _, port in server.requests}) == 1
+    pool.close()
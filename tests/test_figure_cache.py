@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from plotly.io.json import to_json_plotly
+
+import app
+import datasource
+import figure_cache
+
+
+def plain(value):
+    return json.loads(to_json_plotly(value))
+
+
+def test_cached_map_matches_baseline_figure():
+    #px.choropleth as the original update_map built it, on the table it read
+    raw = pd.read_parquet(datasource.BUNDLED[datasource.DATA_PROCESSED_URL])
+    fig = px.choropleth(
+        raw[raw.Year==2019],
+        geojson=app.geojson_counties,
+        locations="FIPS",
+        color='CkdRate',
+        scope='usa',
+        color_continuous_scale='YlOrRd',
+        range_color=(20, 40),
+        hover_data = {'State':True, 'County':True},
+        labels={'CkdRate':'CKD Prevalence (%)'},
+        title='CKD Prevalence by US Counties',
+    )
+    expected = json.loads(fig.to_json())
+    for _ in range(2):
+        #a miss, then a hit
+        frozen = app.update_map([20, 40], 2019, 0, 0, 0, 0)
+        assert frozen['data'][0]['geojson'] is app.geojson_counties
+        assert plain(frozen) == expected
+
+
+def test_freeze_shares_the_geojson():
+    geojson = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': '01001', 'properties': {},
+         'geometry': {'type': 'Point', 'coordinates': [-86.6, 32.5]}}]}
+    data = pd.DataFrame({'FIPS': ['01001'], 'v': [np.float32(1.5)]})
+    fig = px.choropleth(data, geojson=geojson, locations='FIPS', color='v')
+    expected = json.loads(fig.to_json())
+    frozen = figure_cache.freeze(fig, geojson)
+    assert frozen['data'][0]['geojson'] is geojson
+    assert plain(frozen) == expected
+    assert figure_cache.freeze(frozen) is frozen
+
+
+def test_cache_keys_hits_and_eviction():
+    cache = figure_cache.FigureCache(maxsize=2, version='v')
+    assert cache.key('f', [1, 2.00000001], np.int64(3)) == cache.key('f', (1, 2.0), 3)
+    built = []
+
+    def build(n):
+        built.append(n)
+        return {'n': n}
+    for n in (1, 1, 2, 3, 1):
+        assert cache.get_or_build(cache.key('f', n), lambda: build(n)) == {'n': n}
+    assert built == [1, 2, 3, 1]
+    assert (cache.hits, cache.misses, len(cache)) == (1, 4, 2)
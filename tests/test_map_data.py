@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from dash.exceptions import PreventUpdate
+
+import app
+import map_data
+
+
+def test_payload_matches_the_full_figure():
+    data = app.metric_map_data(0.5, 0.5, 2, '00000')
+    fig = app.build_metric_map('lasnap10', 0.5, 0.5, 2, '00000', [0, 50])
+    payload = map_data.payload(data, 'lasnap10')
+    trace = fig.data[0]
+    assert payload['locations'] == list(trace.locations)
+    np.testing.assert_allclose(payload['z'], trace.z, atol=10 ** -map_data.DECIMALS)
+    assert payload['hovertemplate'] == trace.hovertemplate
+
+
+def test_payload_keeps_the_last_row_of_a_county():
+    data = app.ckd_map_data(2024, 1, 0.1, 0.2, 3)
+    payload = map_data.payload(data, 'CkdRate', title='t')
+    last = data.drop_duplicates('FIPS', keep='last')
+    assert payload['locations'] == last['FIPS'].astype(str).tolist()
+    assert payload['label'] == 'CKD Prevalence (%)' and payload['title'] == 't'
+
+
+@pytest.mark.parametrize('metric', [None, ''])
+def test_cleared_metric(metric):
+    #a cleared metric-dropdown leaves the data-only map alone...
+    with pytest.raises(PreventUpdate):
+        app.update_metric_map_data(metric, 0, 0, 0, '00000')
+    #...and draws an uncoloured map with full figures, as px.choropleth always did
+    fig = app.build_metric_map(metric or None, 0, 0, 0, '00000', [0, 50])
+    assert fig.data[0].showscale is False
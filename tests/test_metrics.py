@@ -0,0 +1,51 @@
+import flask
+import pytest
+from dash.exceptions import PreventUpdate
+
+import app
+import figure_cache
+import metrics
+
+
+def test_dispatch_is_timed_by_outcome():
+    registry = metrics.Registry()
+
+    def update(value):
+        if value is None:
+            raise PreventUpdate
+        if value < 0:
+            raise ValueError(value)
+        return '{"x": %d}' % value
+    timed = metrics._timed('update', update, registry)
+    assert timed(12) == '{"x": 12}' and timed.__wrapped__ is update
+    for value, error in ((None, PreventUpdate), (-1, ValueError)):
+        with pytest.raises(error):
+            timed(value)
+    entry = registry.callbacks['update']
+    assert entry['calls'] == {'ok': 1, 'error': 1, 'prevented': 1}
+    assert entry['payload'].count == 1 and entry['payload'].sum == len('{"x": 12}')
+    assert entry['latency'].count == 3
+
+
+def test_app_callbacks_are_instrumented():
+    #clientside callbacks have no server-side function
+    callbacks = [entry['callback'] for entry in app.app.callback_map.values() if 'callback' in entry]
+    assert callbacks and all(getattr(func, 'instrumented', False) for func in callbacks)
+
+
+def test_exposition():
+    registry = metrics.Registry()
+    registry.observe('update_map', 0.3, 2048)
+    cache = figure_cache.FigureCache()
+    cache.get('missing')
+    registry.register_cache('figures', cache)
+    server = flask.Flask(__name__)
+    metrics.configure(server, registry, route='/metrics')
+    response = server.test_client().get('/metrics')
+    text = response.get_data(as_text=True)
+    assert response.content_type == metrics.CONTENT_TYPE
+    assert 'ckd_callback_duration_seconds_bucket{callback="update_map",le="0.5"} 1' in text
+    assert 'ckd_callback_duration_seconds_bucket{callback="update_map",le="0.25"} 0' in text
+    assert 'ckd_callback_response_bytes_sum{callback="update_map"} 2048' in text
+    assert 'ckd_cache_misses_total{cache="figures"} 1' in text
+    assert 'ckd_cache_hit_ratio{cache="figures"} 0.0' in text
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import atlas
+import datasource
+import pipeline
+from xlsx import frame_rows, write_workbook
+
+COUNTIES = ['01001', '48201', '06037', '38085']
+MEANS = ['Pop2010', 'OHU2010', 'PovertyRate'] + pipeline.POPULATION_SHARES + pipeline.HOUSING_SHARES
+#tracts of unequal size around each county value: a weighted mean, or a
+#sum, would no longer come out as the bundled value
+SPREAD = np.array([0.5, 1.0, 1.5])
+
+
+@pytest.fixture
+def bundled():
+    dff = pd.read_parquet(datasource.BUNDLED[datasource.DATA_PROCESSED_URL])
+    return dff[dff.FIPS.isin(COUNTIES)].drop_duplicates('FIPS').set_index('FIPS')
+
+
+def _tracts(bundled):
+    rows = []
+    for fips, county in bundled.iterrows():
+        pop = county['Pop2010'] * SPREAD
+        ohu = county['OHU2010'] * SPREAD[::-1]
+        for i in range(len(SPREAD)):
+            row = {
+                'CensusTract': '%s%06d' % (fips, i + 1),
+                'State': county['State'].title(),
+                'County': county['County'].title() + ' County',
+                'POP2010': pop[i],
+                'OHU2010': ohu[i],
+                'PovertyRate': county['PovertyRate'] * SPREAD[i],
+            }
+            #counts whose tract percentages average to the county value
+            for name in pipeline.POPULATION_SHARES:
+                row[name] = county[name] * SPREAD[i] / 100 * pop[i]
+            for name in pipeline.HOUSING_SHARES:
+                row[name] = county[name] * SPREAD[i] / 100 * ohu[i]
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def test_atlas_stage_keeps_the_bundled_column_definitions(bundled, tmp_path, cache_dir, monkeypatch):
+    path = write_workbook(tmp_path / 'atlas.xlsx', frame_rows(_tracts(bundled)))
+    with open(path, 'rb') as f:
+        datasource.store(datasource.FOOD_ATLAS_URL, f.read())
+    monkeypatch.setattr(atlas, 'ATLAS_DIR', str(tmp_path / 'atlas'))
+
+    counties = pipeline._atlas({}).set_index('FIPS')
+    assert sorted(counties.index) == sorted(COUNTIES)
+    pd.testing.assert_frame_equal(
+        counties.loc[bundled.index, MEANS], bundled[MEANS], check_names=False, rtol=1e-9)
@@ -0,0 +1,36 @@
+import json
+import os
+
+import compile_assets
+import scenario_grid
+
+
+def _engines(scale=1.0):
+    df = compile_assets.load_assets()['data_processed']
+    df = df[df.State.isin(['ALABAMA', 'VERMONT'])]
+    return scenario_grid.prediction_engines(df.assign(CkdRate=df.CkdRate * scale))
+
+
+def test_build_writes_matrix_and_sidecar(tmp_path):
+    grid = scenario_grid.ScenarioGrid('map', _engines()['map'], directory=str(tmp_path))
+    grid.build()
+    with open(grid.path + '.json') as f:
+        meta = json.load(f)
+    assert meta['shape'] == list(grid.shape)
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(p) for p in (grid.path, grid.path + '.json'))
+    assert abs(grid.lookup(0.3, 0.1, 2) - grid.engine.predict(0.3, 0.1, 2)).max() < 1e-3
+
+
+def test_build_prunes_other_fingerprints(tmp_path):
+    old = scenario_grid.ScenarioGrid('map', _engines()['map'], directory=str(tmp_path))
+    old.build()
+    scatter = scenario_grid.ScenarioGrid('scatter', _engines()['scatter'], directory=str(tmp_path))
+    scatter.build()
+    new = scenario_grid.ScenarioGrid('map', _engines(1.1)['map'], directory=str(tmp_path))
+    assert new.fingerprint != old.fingerprint
+    new.build()
+    names = set(os.listdir(tmp_path))
+    assert os.path.basename(old.path) not in names
+    assert os.path.basename(old.path) + '.json' not in names
+    assert {os.path.basename(new.path), os.path.basename(scatter.path)} <= names
@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+import compile_assets
+import correlation
+import significance
+
+
+@pytest.fixture
+def full(tmp_path, monkeypatch):
+    monkeypatch.setattr(correlation, 'CACHE_DIR', str(tmp_path))
+    return compile_assets.load_assets()['data_processed']
+
+
+@pytest.fixture
+def df(full, tmp_path, monkeypatch):
+    monkeypatch.setattr(significance, 'SIGNIFICANCE_PATH', str(tmp_path / 'significance.parquet'))
+    return full[full.State.isin(['ALABAMA', 'GEORGIA', 'TEXAS'])]
+
+
+def test_get_correlation_never_resamples(df, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('resampling at startup')
+    monkeypatch.setattr(significance, 'significance_table', fail)
+    d1, d2 = correlation.get_correlation(df, year=2019)
+    assert 'ci_plus' not in d1 and 'ci_plus' not in d2
+    assert significance.load(df[df.Year==2019]) is None
+
+
+def test_get_correlation_uses_precomputed_results(df, monkeypatch):
+    calls = []
+
+    def table(dff, n_resamples, seed):
+        calls.append(len(dff))
+        return pd.DataFrame({
+            'Feature': correlation.FEATURES, 'ci_low': -0.5, 'ci_high': 0.5, 'perm_p_value': 0.01})
+    monkeypatch.setattr(significance, 'significance_table', table)
+    significance.precompute(df)
+    d1, d2 = correlation.get_correlation(df, year=2019)
+    assert calls == [int((df.Year==2019).sum())]
+    assert d1['ci_high'].eq(0.5).all() and d2['perm_p_value'].eq(0.01).all()
+    significance.precompute(df)
+    assert len(calls) == 1
+    #rows it was not computed from get no error bars
+    assert significance.load(df[(df.Year==2019) & (df.State!='TEXAS')]) is None
+
+
+def test_committed_table_matches_compiled_data(full, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('resampling at startup')
+    monkeypatch.setattr(significance, 'significance_table', fail)
+    d1, d2 = correlation.get_correlation(full, year=significance.YEAR)
+    assert d1['ci_plus'].notna().all() and d2['ci_plus'].notna().all()
+    assert d1['perm_p_value'].between(0, 1).all()
+
+
+def test_significance_table_single_process(df):
+    dff = df[df.Year==2019]
+    table = significance.significance_table(dff, n_resamples=60, workers=1)
+    observed = correlation.cube_slice(correlation.correlation_cube(dff), 2019)
+    merged = observed.merge(table, on='Feature').iloc[1:]
+    assert (merged['ci_low'] <= merged['Correlation Coeff with CKD'] + 1e-9).all()
+    assert (merged['Correlation Coeff with CKD'] <= merged['ci_high'] + 1e-9).all()
+    assert merged['perm_p_value'].between(0, 1).all()
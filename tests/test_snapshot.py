@@ -0,0 +1,27 @@
+import pandas as pd
+
+import app
+import snapshot
+
+
+def test_layout_round_trip():
+    text = snapshot.to_json(app.app.layout)
+    assert snapshot.to_json(snapshot.from_json(text)) == text
+
+
+def test_save_load_and_prune(tmp_path):
+    layout = app.html.Div([app.html.H1('CKD', id='title'), app.dcc.Graph(id='map', figure={'data': []})])
+    old = snapshot.save(layout, 'old', directory=str(tmp_path))
+    assert snapshot.load('new', directory=str(tmp_path)) is None
+    new = snapshot.save(layout, 'new', directory=str(tmp_path))
+    assert [p.name for p in tmp_path.iterdir()] == ['layout-new.json']
+    assert old != new
+    assert snapshot.to_json(snapshot.load('new', directory=str(tmp_path))) == snapshot.to_json(layout)
+
+
+def test_fingerprint_follows_the_tables():
+    frame = pd.DataFrame({'x': [1.0, 2.0]})
+    key = snapshot.fingerprint({'df': frame})
+    assert snapshot.fingerprint({'df': frame.copy()}) == key
+    assert snapshot.fingerprint({'df': frame.assign(x=[1.0, 3.0])}) != key
+    assert snapshot.fingerprint({'df': frame}, extra={'geometry': 'low'}) != key
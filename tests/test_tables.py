@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import compile_assets
+import datasource
+import tables
+
+
+@pytest.fixture(scope='module')
+def df():
+    return compile_assets.load_assets()['data_processed']
+
+
+@pytest.fixture(scope='module')
+def years(df):
+    return tables.YearPartitions(df)
+
+
+def _baseline(df, year, fips_id):
+    #app.update_metric_map before the index
+    return df[(df.Year==year)&(df.FIPS==fips_id)]
+
+
+def test_partitions_match_boolean_filters(df, years):
+    for year in sorted(df.Year.unique()):
+        expected = df[df.Year==year].reset_index(drop=True)
+        pd.testing.assert_frame_equal(years[year].reset_index(drop=True), expected)
+    assert len(years[1999]) == 0 and list(years[1999].columns) == list(df.columns)
+
+
+def test_fips_index_matches_boolean_filters(df, years):
+    index = tables.FipsIndex(years)
+    rng = np.random.default_rng(0)
+    codes = rng.choice(df.FIPS.astype(str).unique(), 50, replace=False)
+    for year in [2005, 2012, 2019]:
+        for code in codes:
+            expected = _baseline(df, year, code).reset_index(drop=True)
+            pd.testing.assert_frame_equal(index.rows(year, code).reset_index(drop=True), expected)
+
+
+def test_fips_index_order_and_unknown_codes(df, years):
+    index = tables.FipsIndex(years)
+    rows = index.rows(2019, ['01003', '99999', 'abc', '01001'])
+    assert rows['FIPS'].astype(str).tolist() == ['01003', '01001']
+    assert len(index.rows(1999, '01001')) == 0
+    #only the years asked for are indexed
+    assert list(index._years) == [2019, 1999]
+
+
+def test_fips_index_memory(years):
+    index = tables.FipsIndex(years)
+    index.rows(2019, '01001')
+    codes, positions = index._years[2019]
+    assert codes.nbytes + positions.nbytes == 16 * len(years[2019])
+
+
+def test_compact_keeps_values():
+    raw = pd.read_parquet(datasource.BUNDLED[datasource.DATA_PROCESSED_URL])
+    compacted = tables.compact(raw)
+    assert compacted['FIPS'].dtype == 'category' and compacted['Year'].dtype == 'int16'
+    for name in raw:
+        if raw[name].dtype == 'float64':
+            assert compacted[name].dtype == 'float32'
+            np.testing.assert_allclose(compacted[name], raw[name], rtol=1e-6)
+        else:
+            assert compacted[name].astype(raw[name].dtype).equals(raw[name])
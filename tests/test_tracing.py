@@ -0,0 +1,40 @@
+import flask
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def client():
+    buffer = tracing.TraceBuffer(size=20, log_path=None)
+    for i in range(30):
+        trace = tracing.Trace('callback_%d' % (i % 2))
+        buffer.add(trace.to_dict(trace.started + i / 1000, 'ok'))
+    server = flask.Flask(__name__)
+    tracing.configure(server, buffer=buffer)
+    return server.test_client()
+
+
+@pytest.mark.parametrize('query, count', [
+    ('', 20), ('&limit=5', 5), ('&limit=abc', 20), ('&limit=-3', 1), ('&limit=0', 1),
+    ('&limit=100000', 20), ('&limit=4&callback=callback_1', 4),
+])
+def test_limit(client, query, count):
+    response = client.get('/traces?format=json' + query)
+    assert response.status_code == 200
+    assert len(response.get_json()) == count
+
+
+def test_spans_nest_inside_a_trace():
+    trace = tracing.Trace('update')
+    token = tracing._current.set(trace)
+    try:
+        with tracing.span('filter'):
+            with tracing.span('aggregate'):
+                pass
+        tracing.tag('figure_cache', 'hit')
+    finally:
+        tracing._current.reset(token)
+    spans = trace.to_dict(trace.started + 1, 'ok')['spans']
+    assert [(s['name'], s['depth']) for s in spans] == [('filter', 1), ('aggregate', 2)]
+    assert trace.tags == {'figure_cache': 'hit'}
@@ -0,0 +1,71 @@
+"""Minimal .xlsx files for the atlas tests, written straight from XML"""
+import zipfile
+from xml.sax.saxutils import escape
+
+import pandas as pd
+
+import atlas
+
+MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+WORKBOOK = (
+    '<workbook xmlns="%s" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Notes" sheetId="1" r:id="rId1"/>'
+    '<sheet name="%s" sheetId="2" r:id="rId2"/></sheets></workbook>' % (MAIN, atlas.SHEET))
+RELS = (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Target="/xl/worksheets/sheet2.xml"/></Relationships>')
+
+
+def _shared_strings(shared):
+    #a tuple is a rich-text string: one run per part, plus a phonetic run
+    items = []
+    for s in shared:
+        if isinstance(s, tuple):
+            runs = ''.join('<r><rPr><b/></rPr><t>%s</t></r>' % x for x in s)
+            items.append('<si>%s<rPh sb="0" eb="1"><t>PH</t></rPh></si>' % runs)
+        else:
+            items.append('<si><t>%s</t></si>' % s)
+    return '<sst xmlns="%s" count="%d">%s</sst>' % (MAIN, len(items), ''.join(items))
+
+
+def _sheet(rows):
+    return '<worksheet xmlns="%s"><cols><col min="1" max="5" width="9"/></cols><sheetData>%s</sheetData></worksheet>' % (
+        MAIN, ''.join(rows))
+
+
+def write_workbook(path, rows, shared=()):
+    #rows: <row> elements of the atlas sheet; shared: the shared strings table
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('xl/workbook.xml', WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', RELS)
+        archive.writestr('xl/sharedStrings.xml', _shared_strings(shared))
+        archive.writestr('xl/worksheets/sheet1.xml', _sheet([]))
+        archive.writestr('xl/worksheets/sheet2.xml', _sheet(rows))
+    return str(path)
+
+
+def _letters(i):
+    letters = ''
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        letters = chr(65 + r) + letters
+    return letters
+
+
+def frame_rows(frame):
+    #<row> elements for a header and the rows of ``frame``: text inline, NaN left out
+    def cell(ref, value):
+        if isinstance(value, str):
+            return '<c r="%s" t="inlineStr"><is><t>%s</t></is></c>' % (ref, escape(value))
+        if pd.isna(value):
+            return ''
+        return '<c r="%s"><v>%r</v></c>' % (ref, float(value))
+
+    rows = []
+    for r, values in enumerate([list(frame.columns)] + frame.values.tolist(), start=1):
+        cells = ''.join(cell('%s%d' % (_letters(i), r), v) for i, v in enumerate(values))
+        rows.append('<row r="%d">%s</row>' % (r, cells))
+    return rows
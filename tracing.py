@@ -0,0 +1,288 @@
+"""
+Stage-level tracing of the Dash callbacks.
+
+metrics.py says how long a callback took; a trace says where the time
+went. Every callback dispatch opens a trace, and the stages inside it
+are marked with spans:
+
+    with tracing.span('filter'):
+        data = years[year]
+    with tracing.span('predict'):
+        rates = map_grid.rates(...)
+
+The stages used in app.py are filter (selecting rows), predict (the
+2024 projections), aggregate (group means over the selected rows),
+figure (px.* / map_data payloads) and serialize (figure JSON in
+figure_cache, then Dash encoding the response).
+instrument(app) opens the trace around each entry of app.callback_map.
+@traced on the callback function marks where its body ends, so the
+time Dash spends encoding the response afterwards is recorded as the
+last serialize span. tag() attaches facts such as a figure cache hit.
+Outside a trace, span() and tag() do nothing.
+
+Finished traces go to an in-process ring buffer, shown on /traces
+(slowest first with ?sort=slowest, ?callback=NAME, ?limit=N, ?format=json). With
+CKD_TRACE_LOG they are also appended as JSON lines to that file, so slow
+requests can be broken down after the fact.
+
+    CKD_TRACING=0           turn it off
+    CKD_TRACE_BUFFER        traces kept in memory per worker (500)
+    CKD_TRACE_LOG           JSONL file to append traces to (off)
+    CKD_TRACE_MIN_MS        only log traces at least this slow (0)
+    CKD_TRACE_ROUTE         where to serve the viewer (/traces)
+"""
+import contextvars
+import functools
+import html
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import flask
+from dash.exceptions import PreventUpdate
+
+ENABLED = os.environ.get('CKD_TRACING', '1') == '1'
+BUFFER_SIZE = int(os.environ.get('CKD_TRACE_BUFFER', '500'))
+LOG_PATH = os.environ.get('CKD_TRACE_LOG')
+MIN_MS = float(os.environ.get('CKD_TRACE_MIN_MS', '0'))
+ROUTE = os.environ.get('CKD_TRACE_ROUTE', '/traces')
+
+#stage -> colour in the viewer
+STAGES = {
+    'filter': '#5bc0de',
+    'predict': '#f0ad4e',
+    'aggregate': '#9b59b6',
+    'figure': '#5cb85c',
+    'serialize': '#d9534f',
+}
+OTHER = '#777'
+
+_current = contextvars.ContextVar('ckd_trace', default=None)
+_ids = itertools.count(1)
+
+
+class Trace:
+
+    def __init__(self, name, inputs=()):
+        self.id = next(_ids)
+        self.name = name
+        self.inputs = list(inputs)
+        self.wall = time.time()
+        self.started = time.perf_counter()
+        self.spans = []     #(name, start, end, depth), in the order they finish
+        self.tags = {}
+        self.depth = 0
+        self.body_end = None
+
+    def to_dict(self, ended, status):
+        def ms(t):
+            return round((t - self.started) * 1000, 3)
+        spans = sorted(self.spans, key=lambda s: (s[1], s[3]))
+        return {
+            'id': self.id,
+            'pid': os.getpid(),
+            'callback': self.name,
+            'time': self.wall,
+            'duration_ms': ms(ended),
+            'status': status,
+            'inputs': self.inputs,
+            'tags': self.tags,
+            'spans': [
+                {'name': name, 'start_ms': ms(start), 'duration_ms': round((end - start) * 1000, 3),
+                 'depth': depth}
+                for name, start, end, depth in spans
+            ],
+        }
+
+
+class TraceBuffer:
+
+    """The last ``size`` finished traces, plus an optional JSONL log"""
+
+    def __init__(self, size=BUFFER_SIZE, log_path=LOG_PATH, min_ms=MIN_MS):
+        self.traces = deque(maxlen=size)
+        self.log_path = log_path
+        self.min_ms = min_ms
+        self._lock = threading.Lock()
+
+    def add(self, trace):
+        line = None
+        if self.log_path and trace['duration_ms'] >= self.min_ms:
+            line = json.dumps(trace, default=str) + '\n'
+        with self._lock:
+            self.traces.append(trace)
+            if line:
+                with open(self.log_path, 'a') as f:
+                    f.write(line)
+
+    def recent(self, callback=None, slowest=False, limit=100):
+        with self._lock:
+            traces = list(self.traces)
+        if callback:
+            traces = [t for t in traces if t['callback'] == callback]
+        if slowest:
+            traces.sort(key=lambda t: t['duration_ms'], reverse=True)
+        else:
+            traces.reverse()
+        return traces[:limit]
+
+
+BUFFER = TraceBuffer()
+
+
+@contextmanager
+def span(name):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    trace.depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((name, started, time.perf_counter(), trace.depth))
+        trace.depth -= 1
+
+
+def tag(key, value):
+    trace = _current.get()
+    if trace is not None:
+        trace.tags[key] = value
+
+
+def traced(func):
+
+    """
+    Decorator for callback functions, under @app.callback: marks the end
+    of the body, after which Dash encodes the response
+    """
+
+    @functools.wraps(func)
+    def body(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            trace = _current.get()
+            if trace is not None:
+                trace.body_end = time.perf_counter()
+    return body
+
+
+def _traced_dispatch(name, func, buffer):
+    def dispatch(*args, **kwargs):
+        trace = Trace(name, args)
+        token = _current.set(trace)
+        status = 'ok'
+        try:
+            return func(*args, **kwargs)
+        except PreventUpdate:
+            status = 'prevented'
+            raise
+        except Exception as error:
+            status = 'error: %s' % type(error).__name__
+            raise
+        finally:
+            ended = time.perf_counter()
+            _current.reset(token)
+            if status == 'ok' and trace.body_end is not None:
+                trace.spans.append(('serialize', trace.body_end, ended, 1))
+            buffer.add(trace.to_dict(ended, status))
+    dispatch.__name__ = func.__name__
+    dispatch.__wrapped__ = func
+    dispatch.traced = True
+    return dispatch
+
+
+def instrument(app, buffer=BUFFER):
+
+    """
+    Trace every server-side callback registered on ``app`` so far.
+    Call it after the last app.callback().
+    """
+
+    if not ENABLED:
+        return buffer
+    for entry in app.callback_map.values():
+        func = entry.get('callback')
+        if func is None or getattr(func, 'traced', False):
+            continue
+        entry['callback'] = _traced_dispatch(func.__name__, func, buffer)
+    return buffer
+
+
+def breakdown(trace):
+    #milliseconds per stage, top-level spans only; the rest is 'other'
+    stages = {}
+    for s in trace['spans']:
+        if s['depth'] == 1:
+            stages[s['name']] = stages.get(s['name'], 0) + s['duration_ms']
+    stages['other'] = max(trace['duration_ms'] - sum(stages.values()), 0)
+    return stages
+
+
+PAGE = """<!doctype html>
+<html><head><title>Callback traces</title><style>
+body {{ font-family: sans-serif; font-size: 13px; background: #272b30; color: #ddd; }}
+table {{ border-collapse: collapse; }} td, th {{ padding: 2px 8px; text-align: left; vertical-align: top; }}
+tr:nth-child(even) {{ background: #32383e; }} a {{ color: #9cf; }}
+.bar {{ display: flex; width: 400px; height: 12px; margin-top: 3px; }} .bar span {{ height: 12px; }}
+.spans {{ color: #aaa; font-size: 12px; }}
+</style></head><body>
+<h3>Callback traces, worker {pid}</h3>
+<p>{legend} &middot; <a href="?sort=slowest">slowest</a> &middot; <a href="?">latest</a>
+&middot; <a href="?format=json">json</a></p>
+<table><tr><th>time</th><th>callback</th><th>status</th><th>ms</th><th>stages</th></tr>
+{rows}
+</table></body></html>
+"""
+
+
+def _row(trace):
+    stages = breakdown(trace)
+    total = trace['duration_ms'] or 1
+    bar = ''.join(
+        '<span style="width:%.1f%%;background:%s" title="%s %.1f ms"></span>'
+        % (100 * ms / total, STAGES.get(name, OTHER), html.escape(name), ms)
+        for name, ms in stages.items() if ms > 0)
+    spans = ' '.join(
+        '%s%s&nbsp;%.1f' % ('&middot;' * (s['depth'] - 1), html.escape(s['name']), s['duration_ms'])
+        for s in trace['spans'])
+    tags = ' '.join('%s=%s' % (html.escape(str(k)), html.escape(str(v))) for k, v in trace['tags'].items())
+    return (
+        '<tr><td>%s</td><td><a href="?callback=%s">%s</a></td><td>%s</td><td>%.1f</td>'
+        '<td><div class="bar">%s</div><div class="spans">%s %s</div>'
+        '<div class="spans">inputs: %s</div></td></tr>' % (
+            time.strftime('%H:%M:%S', time.localtime(trace['time'])),
+            html.escape(trace['callback']), html.escape(trace['callback']),
+            html.escape(trace['status']), trace['duration_ms'], bar, spans, tags,
+            html.escape(json.dumps(trace['inputs'], default=str)[:200])))
+
+
+def configure(server, buffer=BUFFER, route=ROUTE):
+    #serve the trace viewer on ``route`` of a Flask server
+    if not ENABLED:
+        return None
+
+    def traces():
+        args = flask.request.args
+        #a missing or malformed limit is the default, anything else is clamped
+        limit = args.get('limit', 100, type=int)
+        recent = buffer.recent(
+            callback=args.get('callback'),
+            slowest=args.get('sort') == 'slowest',
+            limit=min(max(limit, 1), buffer.traces.maxlen),
+        )
+        if args.get('format') == 'json':
+            return flask.jsonify(recent)
+        legend = ' '.join(
+            '<span style="color:%s">&#9632;</span> %s' % (colour, name)
+            for name, colour in list(STAGES.items()) + [('other', OTHER)])
+        return PAGE.format(pid=os.getpid(), legend=legend, rows='\n'.join(_row(t) for t in recent))
+
+    server.add_url_rule(route, 'ckd_traces', traces)
+    return buffer